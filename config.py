@@ -1,4 +1,5 @@
 import os
+from datetime import time
 
 # Directory #
 BASE_PATH: str = os.getcwd()
@@ -8,89 +9,187 @@ QUERY_PATH = os.path.join(BASE_PATH, "query")
 
 DB_MASTER_FPATH = os.path.join(DB_PATH, "master.db")
 
+# users / messages (and their provider rollups) split over this many files next to master.db by user_id hash,
+# master.shard0.db ... (0 keeps everything in master.db). Move existing data with tools/reshard.py first
+DB_SHARDS = 0
+
+# Extra bots served by the same process next to the TELE_API_KEY one (see src/tenants.py). Each has its own
+# token, database (optionally sharded like DB_SHARDS), model subset ({catalog provider: [model ids]}, None for
+# the whole catalog) and free quota; provider clients and limits, admission control, budgets, the prompt cache
+# and the work queue are shared.
+TENANTS: list[dict] = [
+    # {
+    #     "name": "brand",
+    #     "token_env": "BRAND_TELE_API_KEY",
+    #     "db_fpath": os.path.join(DB_PATH, "brand.db"),
+    #     "models": {"Claude": ["claude-3-7-sonnet-20250219"], "ChatGPT": ["gpt-4o-mini"]},
+    #     "free_queries": 10,
+    #     "shards": 0,
+    # },
+]
+
+# Named queries at or above this duration are logged with their query plan (None to disable)
+DB_SLOW_QUERY_MS: float | None = 100
+# Recent durations kept per named query for the percentiles in the admin query profile
+DB_QUERY_SAMPLE_SIZE = 1024
+
+
+# Request Tracing (JSONL, rotated by size)
+TRACE_FPATH = os.path.join(LOG_PATH, "trace.jsonl")
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+TRACE_BACKUP_COUNT = 5
+
+
+# Metrics Endpoint (Prometheus /metrics and /healthz, set port to None to disable)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT: int | None = 9100
+
 
 # Model Configuration
 MAX_TOKENS = 2048
 
+# Sent first in every request (None for none) and kept byte-identical, so providers can serve it from their prompt
+# cache: a cache_control breakpoint for Claude, automatic prefix caching for OpenAI and DeepSeek. Providers only cache
+# prefixes of ~1024+ tokens, cached tokens are billed at the catalog's cached_input_cost / cache_write_cost
+SYSTEM_PROMPT: str | None = None
 
-# LLM Models
-MODEL_CHOICES: dict = {
-    "Claude": [
-        {
-            "name": "Claude 3.7 (Sonnet)",
-            "id": "claude-3-7-sonnet-20250219",
-        },
-        {
-            "name": "Claude 3.5 (Haiku)",
-            "id": "claude-3-5-haiku-20241022",
-        },
-    ],
-    "Deepseek": [
-        {
-            "name": "Deepseek R1",
-            "id": "deepseek-reasoner",
-        },
-        {
-            "name": "Deepseek V3",
-            "id": "deepseek-chat",
-        },
-    ],
-    "ChatGPT": [
-        {
-            "name": "GPT-4o",
-            "id": "gpt-4o",
-        },
-        {
-            "name": "GPT-4o-mini",
-            "id": "gpt-4o-mini",
-        },
-    ],
-    "Perplexity": [
-        {
-            "name": "Sonar Deep Research",
-            "id": "sonar-deep-research",
-        },
-        {
-            "name": "Sonar",
-            "id": "sonar",
-        },
-    ],
+# Max concurrent API calls per provider ("default" for providers not listed)
+PROVIDER_CONCURRENCY: dict[str, int] = {
+    "default": 8,
+    "Perplexity": 4,
+}
+
+# Near-duplicate prompt cache: serve a stored answer when a recent prompt to the same model is within
+# max_hamming bits (SimHash, 64-bit) after normalisation. Only models listed here are cached.
+PROMPT_CACHE: dict = {
+    "enabled": False,
+    "models": ["gpt-4o-mini", "deepseek-chat", "claude-3-5-haiku-20241022"],
+    "max_hamming": 3,
+    "min_words": 4,
+    "ttl_hours": 24,
+    "max_entries_per_model": 5000,
 }
+PROMPT_CACHE_PRUNE_INTERVAL = 60 * 60
 
+# Message updates Telegram redelivers after a crash/restart are answered with the stored reply (or skipped)
+# instead of calling the provider and billing again. Telegram keeps unconfirmed updates for 24 hours.
+UPDATE_DEDUP: dict = {
+    "window_hours": 48,
+    "memory_size": 10000,
+}
+UPDATE_DEDUP_PRUNE_INTERVAL = 60 * 60
 
-MODEL_PRICING: dict[str, dict[str, float]] = {
-    "claude-3-7-sonnet-20250219": {
-        "input_cost": 0.000003,
-        "output_cost": 0.000015,
-    },
-    "claude-3-5-haiku-20241022": {
-        "input_cost": 0.0000008,
-        "output_cost": 0.000004,
-    },
-    "deepseek-reasoner": {
-        "input_cost": 0.00000014,
-        "output_cost": 0.00000219,
-    },
-    "deepseek-chat": {
-        "input_cost": 0.00000007,
-        "output_cost": 0.0000011,
-    },
-    "gpt-4o": {
-        "input_cost": 0.0000025,
-        "output_cost": 0.00001,
-    },
-    "gpt-4o-mini": {
-        "input_cost": 0.00000015,
-        "output_cost": 0.0000006,
+# Document summarisation: uploads are split into ~DOCUMENT_CHUNK_TOKENS parts, summarised concurrently
+# (DOCUMENT_PARALLELISM per document, on top of PROVIDER_CONCURRENCY) and then combined
+DOCUMENT_MAX_BYTES = 20 * 1024 * 1024
+DOCUMENT_CHUNK_TOKENS = 1500
+DOCUMENT_MAX_CHUNKS = 40
+DOCUMENT_PARALLELISM = 4
+
+# Photos and image documents for catalog models flagged "vision": resized and re-encoded to the provider's limits
+# in a pool of VISION_PROCESS_WORKERS processes (needs Pillow, without it only photos Telegram already scaled down
+# to the limits are sent). The caption is the prompt, VISION_DEFAULT_PROMPT if there is none
+VISION_MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+VISION_PROCESS_WORKERS = 2
+VISION_JPEG_QUALITY = 85
+VISION_DEFAULT_PROMPT = "Describe this image."
+
+# Compare mode: max models per compare and seconds to wait before the remaining answers are sent late
+COMPARE_MAX_MODELS = 4
+COMPARE_TIMEOUT = 120
+
+# Seconds a provider HTTP request may wait to connect or for the answer before it fails, so a hung call ends its
+# thread (and frees its provider slot and budget reservation) instead of running on unbilled in the background
+PROVIDER_REQUEST_TIMEOUT = COMPARE_TIMEOUT
+
+# Admission control in front of the LLM call: at most max_active requests (a compare or document counts as one)
+# talk to providers at once, the rest queue by access level (admin > premium > free) up to max_queue.
+# max_wait is how long each tier may queue before getting a "busy" reply (None = wait indefinitely)
+ADMISSION: dict = {
+    "max_active": 16,
+    "max_queue": 100,
+    "max_wait": {"admin": None, "premium": 60, "free": 15},
+}
+
+# Inbound messages per user and sliding window by access level (None = unlimited), checked in memory before any
+# database or provider work. Counters for RATE_LIMIT_MAX_USERS recently seen users are allocated up front (~110 B each).
+RATE_LIMITS: dict[str, dict] = {
+    "free": {"per_minute": 5, "per_hour": 40},
+    "premium": {"per_minute": 20, "per_hour": 300},
+    "admin": {"per_minute": None, "per_hour": None},
+}
+RATE_LIMIT_MAX_USERS = 200_000
+
+
+# Worker processes (python main.py --workers N): provider calls and accounting run in N processes fed from a
+# SQLite job queue, replies are sent back by the Telegram process. 0 keeps everything in one process
+JOBS_DB_FPATH = os.path.join(DB_PATH, "jobs.db")
+WORKER_COUNT = 0
+WORKER_CONCURRENCY = 8  # jobs in flight per worker process
+WORKER_POLL_INTERVAL = 0.5
+WORKER_HEARTBEAT_INTERVAL = 5
+WORKER_VISIBILITY_TIMEOUT = 60  # a running job is handed to another worker if its owner misses heartbeats this long
+WORKER_MAX_ATTEMPTS = 3
+WORKER_JOB_DEADLINE = 20 * 60  # seconds an attempt may run before heartbeats stop extending it and it is failed
+WORKER_RETRY_BACKOFF = 5
+WORKER_SHUTDOWN_TIMEOUT = 30
+WORKER_DELIVERY_INTERVAL = 1
+WORKER_SUPERVISE_INTERVAL = 10
+JOBS_RETENTION_HOURS = 24
+
+# Models flagged "long_running" in the catalog always run as background jobs through the job queue
+# (an in-process worker is started when --workers is 0), at most this many pending jobs per user
+BACKGROUND_MAX_PENDING = 3
+# Their provider requests get this much longer than PROVIDER_REQUEST_TIMEOUT (keep it below WORKER_JOB_DEADLINE)
+LONG_RUNNING_REQUEST_TIMEOUT = 10 * 60
+
+# Spending Caps in USD (None = unlimited), enforced per calendar day/month (UTC) before calling a provider
+# "user" caps apply to each user of that access level, "access_level" to the tier as a whole
+BUDGET_CAPS: dict[str, dict[str, dict[str, float | None]]] = {
+    "user": {
+        "free": {"daily": 0.05, "monthly": 0.50},
+        "premium": {"daily": 2.00, "monthly": 20.00},
+        "admin": {"daily": None, "monthly": None},
     },
-    "sonar-deep-research": {
-        "input_cost": 0.0000005,
-        "output_cost": 0.000002,
-        "search_cost": 0.005,
+    "access_level": {
+        "free": {"daily": 5.00, "monthly": 50.00},
+        "premium": {"daily": 50.00, "monthly": 500.00},
     },
-    "sonar": {
-        "input_cost": 0.000001,
-        "output_cost": 0.000001,
-        "search_cost": 0.005,
+    "provider": {
+        "claude": {"daily": 30.00, "monthly": 300.00},
+        "deepseek": {"daily": 10.00, "monthly": 100.00},
+        "chatgpt": {"daily": 30.00, "monthly": 300.00},
+        "perplexity": {"daily": 20.00, "monthly": 200.00},
     },
 }
+# Fall back to a cheaper model of the same provider instead of rejecting when the chosen one doesn't fit
+BUDGET_ALLOW_DOWNGRADE = True
+
+
+# Maintenance Jobs (scheduled on the bot JobQueue, times in UTC, intervals in seconds)
+FREE_QUOTA_REFILL: dict = {
+    "schedule": "monthly",  # "monthly", "weekly" or None to disable
+    "day": 1,  # day of month (monthly) or weekday 0=Sunday (weekly)
+    "time": time(0, 0),
+    "amount": 30,
+}
+DB_OPTIMIZE_TIME = time(3, 0)
+WAL_CHECKPOINT_INTERVAL = 15 * 60
+ROLLUP_REFRESH_INTERVAL = 60 * 60
+SKETCH_FLUSH_INTERVAL = 60
+
+
+# Latency / output token / cost quantile sketches per model (DDSketch, quantiles within this relative error)
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MAX_BINS = 2048
+
+
+# LLM Models
+# Providers, models and pricing are declared in the catalog file and loaded by src.models.AllModels.
+# Both dicts below are filled in place (providers without an API key are skipped) and refreshed on
+# SIGHUP or when the catalog file changes, so modules can keep importing them directly.
+MODEL_CATALOG_FPATH = os.path.join(BASE_PATH, "model_catalog.json")
+CATALOG_POLL_INTERVAL = 30
+
+MODEL_CHOICES: dict[str, list[dict]] = {}
+MODEL_PRICING: dict[str, dict[str, float]] = {}
@@ -1,55 +1,260 @@
 import os
+import argparse
+import time
+import signal
+import asyncio
 import logging
 
 from dotenv import load_dotenv
 
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
+from telegram.ext import (
+    Application,
+    CommandHandler,
+    MessageHandler,
+    filters,
+    CallbackQueryHandler,
+    ContextTypes,
+    TypeHandler,
+)
 
-from src.database import init_user_mgr
-from src.tele_common import start, help_command, menu_command, common_callback, handle_message
-from src.tele_admin import admin_command, admin_callback, add_premium_conv, add_credits_conv
+from src.database import init_user_mgr, get_user_mgr
+from src.budget import init_budget
+from src.prompt_cache import init_prompt_cache
+from src.admission import init_admission
+from src.rate_limit import init_rate_limiter
+from src.work_queue import init_work_queue
+from src.worker import Worker, WorkerPool, schedule_worker_jobs
+from src.utils import build_pricing_table
+from src.models import init_llm_models, get_llm_models
+from src.maintenance import schedule_maintenance_jobs
+from src.sketches import sketches
+from src import metrics
+from src.tracing import setup_trace_logging
+from src.tele_common import start, help_command, menu_command, common_callback, common_router, handle_message
+from src.tele_document import handle_document
+from src.tele_image import handle_image
+from src.images import shutdown_image_pool
+from src.tele_jobs import jobs_command, jobs_callback, jobs_router
+from src.tenants import Tenant, load_tenants, enter_tenant
+from src.dedup import confirm_processed_updates
+from src.tele_admin import admin_command, admin_callback, admin_router, admin_conversations
 
 from config import (
     QUERY_PATH,
     DB_MASTER_FPATH,
+    METRICS_HOST,
+    METRICS_PORT,
+    TRACE_FPATH,
+    TRACE_MAX_BYTES,
+    TRACE_BACKUP_COUNT,
+    MODEL_CATALOG_FPATH,
+    CATALOG_POLL_INTERVAL,
+    MODEL_PRICING,
+    BUDGET_CAPS,
+    BUDGET_ALLOW_DOWNGRADE,
+    PROMPT_CACHE,
+    ADMISSION,
+    RATE_LIMITS,
+    RATE_LIMIT_MAX_USERS,
+    JOBS_DB_FPATH,
+    WORKER_COUNT,
+    WORKER_SHUTDOWN_TIMEOUT,
 )
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def start_bot() -> None:
+async def on_startup(application: Application) -> None:
+    if METRICS_PORT is not None:
+        application.bot_data["metrics_server"] = await metrics.start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    # Hot reload of the model catalog, in-flight requests keep the clients they already hold
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, get_llm_models().load_catalog)
+
+    worker_pool = application.bot_data.get("worker_pool")
+    if worker_pool is not None:
+        worker_pool.start()
+    else:
+        # Background jobs of long-running models are executed on this event loop
+        local_worker = Worker("main", application.bot_data["work_queue"])
+        application.bot_data["local_worker"] = (local_worker, asyncio.create_task(local_worker.run()))
+
+    # Before polling starts, so only updates without a sent reply are redelivered
+    await confirm_processed_updates(application)
+
+    metrics.ready = True
+
+
+async def check_model_catalog(context: ContextTypes.DEFAULT_TYPE) -> None:
+    get_llm_models().reload_if_changed()
+
+
+async def on_shutdown(application: Application) -> None:
+    metrics.ready = False
+
+    worker_pool = application.bot_data.pop("worker_pool", None)
+    if worker_pool is not None:
+        await asyncio.to_thread(worker_pool.stop)
+
+    local_worker = application.bot_data.pop("local_worker", None)
+    if local_worker is not None:
+        worker, task = local_worker
+        worker.stop()
+        try:
+            await asyncio.wait_for(task, WORKER_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Background jobs still running at shutdown, they are picked up again after restart")
+
+    await asyncio.to_thread(shutdown_image_pool)
+
+    # Persist what was observed since the last sketch_flush run, including the local worker's final calls
+    await asyncio.to_thread(sketches.flush, get_user_mgr(shared=True))
+
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+    # Last, so traces of the requests finished during the drain above are still written
+    trace_listener = application.bot_data.pop("trace_listener", None)
+    if trace_listener is not None:
+        trace_listener.stop()
+
+
+def register_handlers(application: Application) -> None:
+    # Runs before every other group, so all handlers of an update see this Application's tenant
+    application.add_handler(TypeHandler(Update, enter_tenant), group=-1)
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("admin", admin_command))
+    application.add_handler(CommandHandler("change_model", menu_command))
+    application.add_handler(CommandHandler("jobs", jobs_command))
+
+    for conversation in admin_conversations():
+        application.add_handler(conversation)
+
+    application.add_handler(CallbackQueryHandler(common_callback, pattern=common_router.pattern))
+    application.add_handler(CallbackQueryHandler(admin_callback, pattern=admin_router.pattern))
+    application.add_handler(CallbackQueryHandler(jobs_callback, pattern=jobs_router.pattern))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Image documents go to the vision handler, so it has to come before the generic document one
+    application.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, handle_image))
+    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
+
+
+def build_application(tenant: Tenant, primary: bool) -> Application:
+    """One Application per bot token, only the primary one owns the process wide startup/shutdown and jobs"""
+    builder = Application.builder().token(tenant.token)
+    if primary:
+        builder = builder.post_init(on_startup).post_shutdown(on_shutdown)
+    application = builder.build()
+
+    application.bot_data["tenant"] = tenant
+    tenant.bot = application.bot
+    register_handlers(application)
+
+    schedule_maintenance_jobs(application.job_queue, tenant.free_queries, shared=primary)
+    if primary and application.job_queue is not None:
+        schedule_worker_jobs(application.job_queue)
+        application.job_queue.run_repeating(check_model_catalog, interval=CATALOG_POLL_INTERVAL, name="catalog_watch")
+
+    return application
+
+
+async def run_tenants(applications: list[Application]) -> None:
+    """run_polling() for several Applications on one event loop, the first one is the primary"""
+    primary = applications[0]
+    for application in applications:
+        await application.initialize()
+    for application in applications[1:]:
+        await confirm_processed_updates(application)
+    await on_startup(primary)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    try:
+        for application in applications:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await application.start()
+        await stop_event.wait()
+
+    finally:
+        for application in applications:
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+        for application in applications:
+            await application.shutdown()
+        await on_shutdown(primary)
+
+
+def start_bot(workers: int = WORKER_COUNT) -> None:
     # Load Variable
     load_dotenv()
-    init_user_mgr(DB_MASTER_FPATH, QUERY_PATH)
+    user_mgr = init_user_mgr(DB_MASTER_FPATH, QUERY_PATH)
+    llm_models = init_llm_models(MODEL_CATALOG_FPATH)
 
     TELE_TOKEN: str | None = os.getenv("TELE_API_KEY")
     if not TELE_TOKEN:
         logger.error("No Telegram API found in env variable.")
         raise AssertionError("No Telegram Bot API, exiting program.")
 
-    application = Application.builder().token(TELE_TOKEN).build()
+    tenant_list = load_tenants(user_mgr, TELE_TOKEN)
 
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("admin", admin_command))
-    application.add_handler(CommandHandler("change_model", menu_command))
+    # Price lookup and menus kept in sync with catalog reloads, budgets seeded from this month's messages
+    build_pricing_table(MODEL_PRICING)
+    llm_models.add_reload_hook(lambda: build_pricing_table(MODEL_PRICING))
+    for tenant in tenant_list:
+        tenant.build_menus()
+        llm_models.add_reload_hook(tenant.build_menus)
 
-    application.add_handler(add_premium_conv)
-    application.add_handler(add_credits_conv)
+    # Budgets and the prompt cache are shared by all bots, seeded from every tenant's database
+    month_spend = [row for tenant in tenant_list for row in tenant.user_mgr.get_month_spend()]
+    cache_since = time.time() - PROMPT_CACHE["ttl_hours"] * 3600
+    cached_prompts = [row for tenant in tenant_list for row in tenant.user_mgr.load_cached_prompts(cache_since)]
+    init_budget(BUDGET_CAPS, BUDGET_ALLOW_DOWNGRADE, month_spend)
+    init_prompt_cache(PROMPT_CACHE, cached_prompts)
+    init_admission(ADMISSION)
+    init_rate_limiter(RATE_LIMITS, RATE_LIMIT_MAX_USERS)
 
-    application.add_handler(CallbackQueryHandler(common_callback, pattern="^(provider_|model_|back_)"))
-    application.add_handler(CallbackQueryHandler(admin_callback, pattern="^admin_"))
+    applications = [build_application(tenant, primary=index == 0) for index, tenant in enumerate(tenant_list)]
+    primary = applications[0]
 
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    primary.bot_data["trace_listener"] = setup_trace_logging(TRACE_FPATH, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT)
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Background jobs always go through the job queue, in split mode every provider call does
+    work_queue = init_work_queue(JOBS_DB_FPATH, QUERY_PATH)
+    worker_pool = WorkerPool(workers) if workers > 0 else None
+    for application in applications:
+        application.bot_data["work_queue"] = work_queue
+        if worker_pool is not None:
+            application.bot_data["worker_pool"] = worker_pool
+
+    if len(applications) == 1:
+        primary.run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        logger.info(f"Serving {len(applications)} bots: {[tenant.name for tenant in tenant_list]}")
+        asyncio.run(run_tenants(applications))
 
 
 # Run
 if "__main__" == __name__:
+    parser = argparse.ArgumentParser(description="Telegram AI assistant bot")
+    parser.add_argument(
+        "--workers", type=int, default=WORKER_COUNT, help="worker processes for LLM calls (0 = single process)"
+    )
+    args = parser.parse_args()
+
     try:
-        start_bot()
+        start_bot(workers=args.workers)
     except Exception as e:
         logger.error(e)
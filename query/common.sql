@@ -17,7 +17,7 @@ WHERE user_id = ?;
 -- name: add_new_user
 INSERT INTO users 
     (user_id, username, first_name, last_name, access_level, remaining_free_queries)
-VALUES (?, ?, ?, ?, 'free', 30);
+VALUES (?, ?, ?, ?, 'free', ?);
 
 
 -- name: validate_user
@@ -78,11 +78,26 @@ SELECT
 FROM messages;
 
 
+-- name: update_provider_cache_stats
+INSERT INTO provider_cache_stats
+    (provider, input_tokens, cached_tokens, cache_write_tokens)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (provider) DO UPDATE SET
+    input_tokens = input_tokens + excluded.input_tokens,
+    cached_tokens = cached_tokens + excluded.cached_tokens,
+    cache_write_tokens = cache_write_tokens + excluded.cache_write_tokens;
+
+
 -- name: get_provider_stats
 SELECT 
-    *
-FROM provider_stats
-ORDER BY total_messages DESC;
+    p.*,
+    COALESCE(c.input_tokens, 0) as reported_input_tokens,
+    COALESCE(c.cached_tokens, 0) as cached_tokens,
+    COALESCE(c.cache_write_tokens, 0) as cache_write_tokens
+FROM provider_stats as p
+LEFT JOIN provider_cache_stats as c ON
+    c.provider = p.provider
+ORDER BY p.total_messages DESC;
 
 
 -- name: get_daily_stats
@@ -122,6 +137,44 @@ ORDER BY last_active_at DESC
 LIMIT ?;
 
 
+-- name: get_users_page_next
+SELECT 
+    user_id, username, first_name, last_name, 
+    access_level, remaining_free_queries, total_queries,
+    registered_at, last_active_at
+FROM users
+WHERE (? = 'all' OR access_level = ?)
+    AND (last_active_at, user_id) < (?, ?)
+ORDER BY last_active_at DESC, user_id DESC
+LIMIT ?;
+
+
+-- name: get_users_page_prev
+SELECT 
+    user_id, username, first_name, last_name, 
+    access_level, remaining_free_queries, total_queries,
+    registered_at, last_active_at
+FROM users
+WHERE (? = 'all' OR access_level = ?)
+    AND (last_active_at, user_id) > (?, ?)
+ORDER BY last_active_at ASC, user_id ASC
+LIMIT ?;
+
+
+-- name: export_users
+SELECT 
+    *
+FROM users
+ORDER BY user_id;
+
+
+-- name: export_messages
+SELECT 
+    *
+FROM messages
+ORDER BY message_id;
+
+
 -- name: admin_change_user_role
 UPDATE users SET 
     access_level = ? 
@@ -131,4 +184,142 @@ WHERE user_id = ?;
 -- name: admin_add_credit
 UPDATE users SET 
     remaining_free_queries = ? 
-WHERE user_id = ?;
\ No newline at end of file
+WHERE user_id = ?;
+
+
+-- name: find_existing_users
+SELECT 
+    user_id 
+FROM users 
+WHERE user_id IN (SELECT value FROM json_each(?));
+
+
+-- name: find_inactive_free_users
+SELECT 
+    user_id 
+FROM users 
+WHERE access_level = 'free'
+    AND last_active_at < datetime('now', ?);
+
+
+-- name: admin_bulk_add_credit
+UPDATE users SET 
+    remaining_free_queries = remaining_free_queries + ? 
+WHERE user_id = ?;
+
+
+-- name: refill_free_quota
+UPDATE users SET 
+    remaining_free_queries = MAX(remaining_free_queries, ?) 
+WHERE access_level = 'free';
+
+
+-- name: refresh_provider_stats
+INSERT OR REPLACE INTO provider_stats
+    (provider, total_messages, total_input_tokens, total_output_tokens, total_tokens, total_cost)
+SELECT
+    provider,
+    COUNT(*),
+    SUM(input_tokens),
+    SUM(output_tokens),
+    SUM(input_tokens + output_tokens),
+    SUM(query_cost)
+FROM messages
+GROUP BY provider;
+
+
+-- name: analyze_db
+ANALYZE;
+
+
+-- name: optimize_db
+PRAGMA optimize;
+
+
+-- name: wal_checkpoint
+PRAGMA wal_checkpoint(TRUNCATE);
+
+
+-- name: get_month_spend
+SELECT
+    m.user_id,
+    u.access_level,
+    m.provider,
+    date(m.created_at) = date('now') as is_today,
+    SUM(m.query_cost) as cost
+FROM messages as m
+LEFT JOIN users as u ON
+    u.user_id = m.user_id
+WHERE m.created_at >= date('now', 'start of month')
+GROUP BY m.user_id, m.provider, is_today;
+
+
+-- name: store_cached_prompt
+INSERT OR REPLACE INTO prompt_cache
+    (model_id, fingerprint, response, created_at)
+VALUES (?, ?, ?, ?);
+
+
+-- name: load_cached_prompts
+SELECT 
+    model_id, fingerprint, response, created_at
+FROM prompt_cache
+WHERE created_at >= ?
+ORDER BY created_at;
+
+
+-- name: prune_cached_prompts
+DELETE FROM prompt_cache
+WHERE created_at < ?;
+
+
+-- name: get_sketch
+SELECT 
+    sketch
+FROM metric_sketches
+WHERE provider = ? AND model_id = ? AND metric = ?;
+
+
+-- name: upsert_sketch
+INSERT OR REPLACE INTO metric_sketches
+    (provider, model_id, metric, sketch, updated_at)
+VALUES (?, ?, ?, ?, ?);
+
+
+-- name: load_sketches
+SELECT 
+    provider, model_id, metric, sketch
+FROM metric_sketches
+ORDER BY provider, model_id;
+
+
+-- name: claim_update
+INSERT OR IGNORE INTO processed_updates
+    (chat_id, message_id, update_id, created_at)
+VALUES (?, ?, ?, ?);
+
+
+-- name: get_update_reply
+SELECT 
+    status, reply
+FROM processed_updates
+WHERE chat_id = ? AND message_id = ?;
+
+
+-- name: complete_update
+UPDATE processed_updates SET 
+    status = 'done',
+    reply = ?
+WHERE chat_id = ? AND message_id = ?;
+
+
+-- name: get_committed_update_id
+SELECT 
+    MAX(update_id) as update_id
+FROM processed_updates
+WHERE status = 'done';
+
+
+-- name: prune_processed_updates
+DELETE FROM processed_updates
+WHERE created_at < ?;
\ No newline at end of file
@@ -1,3 +1,6 @@
+-- Write-ahead logging so readers don't block the writer (checkpointed by the maintenance job)
+PRAGMA journal_mode = WAL;
+
 -- Users table with access levels and usage tracking
 CREATE TABLE IF NOT EXISTS users (
     user_id INTEGER PRIMARY KEY,
@@ -11,6 +14,9 @@ CREATE TABLE IF NOT EXISTS users (
     last_active_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Keyset pagination on recent activity (admin user browsing)
+CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active_at, user_id);
+
 -- Messages table to track all interactions
 CREATE TABLE IF NOT EXISTS messages (
     message_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -25,6 +31,9 @@ CREATE TABLE IF NOT EXISTS messages (
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
 
+-- Date-range scans (daily stats, budget seeding)
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at);
+
 -- Provider statistics
 CREATE TABLE IF NOT EXISTS provider_stats (
     provider TEXT PRIMARY KEY,
@@ -35,9 +44,52 @@ CREATE TABLE IF NOT EXISTS provider_stats (
     total_cost REAL NOT NULL DEFAULT 0
 );
 
+-- Provider-side prompt caching, from the token counts providers report (input_tokens includes the cached ones)
+CREATE TABLE IF NOT EXISTS provider_cache_stats (
+    provider TEXT PRIMARY KEY,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_write_tokens INTEGER NOT NULL DEFAULT 0
+);
+
+-- Near-duplicate prompt cache (SimHash fingerprints stored as signed 64-bit, created_at as epoch seconds)
+CREATE TABLE IF NOT EXISTS prompt_cache (
+    model_id TEXT NOT NULL,
+    fingerprint INTEGER NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (model_id, fingerprint)
+);
+
+CREATE INDEX IF NOT EXISTS idx_prompt_cache_created_at ON prompt_cache (created_at);
+
+-- Quantile sketches per provider/model and metric (DDSketch as JSON, merged in by every process)
+CREATE TABLE IF NOT EXISTS metric_sketches (
+    provider TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    sketch TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (provider, model_id, metric)
+);
+
+-- Message updates already handled, so a redelivered update isn't answered (and billed) twice
+CREATE TABLE IF NOT EXISTS processed_updates (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    update_id INTEGER NOT NULL,
+    status TEXT CHECK (status IN ('claimed', 'done')) NOT NULL DEFAULT 'claimed',
+    reply TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_updates_created_at ON processed_updates (created_at);
+
 -- Initialize the providers
 INSERT OR IGNORE INTO provider_stats (provider, total_messages, total_input_tokens, total_output_tokens, total_tokens, total_cost)
 VALUES 
     ('claude', 0, 0, 0, 0, 0.0),
     ('deepseek', 0, 0, 0, 0, 0.0),
-    ('chatgpt', 0, 0, 0, 0, 0.0);
\ No newline at end of file
+    ('chatgpt', 0, 0, 0, 0, 0.0),
+    ('perplexity', 0, 0, 0, 0, 0.0);
\ No newline at end of file
@@ -0,0 +1,44 @@
+-- Durable work queue shared by the Telegram process and the worker processes
+PRAGMA journal_mode = WAL;
+
+-- Jobs: queued -> running -> done / failed, a running job whose visible_at has passed can be claimed again
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 2,
+    payload TEXT NOT NULL,
+    status TEXT CHECK (status IN ('queued', 'running', 'done', 'failed')) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    visible_at REAL NOT NULL,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    delivered_at REAL
+);
+
+-- Claim scan (next visible job by priority) and result delivery scan
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, job_id);
+CREATE INDEX IF NOT EXISTS idx_jobs_delivery ON jobs (delivered_at, status);
+
+-- Jobs whose usage was recorded, so a job run again after its worker died is billed once
+CREATE TABLE IF NOT EXISTS job_charges (
+    job_id INTEGER PRIMARY KEY,
+    charged_at REAL NOT NULL
+);
+
+-- Cancels asked for while a job was running, the call is billed and settled when it ends but its answer dropped
+CREATE TABLE IF NOT EXISTS job_cancels (
+    job_id INTEGER PRIMARY KEY,
+    requested_at REAL NOT NULL
+);
+
+-- Worker heartbeats
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    jobs_done INTEGER NOT NULL DEFAULT 0,
+    jobs_failed INTEGER NOT NULL DEFAULT 0
+);
@@ -0,0 +1,218 @@
+-- name: enqueue_job
+INSERT INTO jobs
+    (kind, priority, payload, status, visible_at, created_at, updated_at)
+VALUES (?, ?, ?, 'queued', ?, ?, ?);
+
+
+-- name: claim_job
+UPDATE jobs
+SET
+    status = 'running',
+    worker_id = ?,
+    attempts = attempts + 1,
+    visible_at = ?,
+    updated_at = ?
+WHERE job_id = (
+    SELECT job_id
+    FROM jobs
+    WHERE status IN ('queued', 'running')
+        AND visible_at <= ?
+        AND attempts < ?
+    ORDER BY priority, job_id
+    LIMIT 1
+)
+RETURNING job_id, kind, payload, attempts;
+
+
+-- name: fail_exhausted_jobs
+UPDATE jobs
+SET
+    status = 'failed',
+    result = ?,
+    updated_at = ?
+WHERE status = 'running'
+    AND visible_at <= ?
+    AND (attempts >= ? OR job_id IN (SELECT job_id FROM job_cancels));
+
+
+-- name: claim_job_charge
+INSERT OR IGNORE INTO job_charges
+    (job_id, charged_at)
+VALUES (?, ?);
+
+
+-- name: extend_visibility
+UPDATE jobs
+SET visible_at = ?
+WHERE worker_id = ?
+    AND status = 'running'
+    AND updated_at >= ?;
+
+
+-- name: fail_overdue_jobs
+UPDATE jobs
+SET
+    status = 'failed',
+    result = ?,
+    updated_at = ?
+WHERE worker_id = ?
+    AND status = 'running'
+    AND updated_at < ?;
+
+
+-- name: complete_job
+UPDATE jobs
+SET
+    status = 'done',
+    result = ?,
+    updated_at = ?
+WHERE job_id = ?
+    AND worker_id = ?
+    AND status = 'running';
+
+
+-- name: retry_job
+UPDATE jobs
+SET
+    status = 'queued',
+    worker_id = NULL,
+    result = ?,
+    visible_at = ?,
+    updated_at = ?
+WHERE job_id = ?
+    AND worker_id = ?
+    AND status = 'running'
+    AND job_id NOT IN (SELECT job_id FROM job_cancels);
+
+
+-- name: fail_job
+UPDATE jobs
+SET
+    status = 'failed',
+    result = ?,
+    updated_at = ?
+WHERE job_id = ?
+    AND worker_id = ?
+    AND status = 'running';
+
+
+-- name: fetch_finished_jobs
+SELECT
+    job_id, kind, payload, status, attempts, result,
+    job_id IN (SELECT job_id FROM job_cancels) as cancel_requested
+FROM jobs
+WHERE delivered_at IS NULL
+    AND status IN ('done', 'failed')
+ORDER BY job_id
+LIMIT ?;
+
+
+-- name: mark_job_delivered
+UPDATE jobs
+SET delivered_at = ?
+WHERE job_id = ?;
+
+
+-- name: purge_delivered_jobs
+DELETE FROM jobs
+WHERE delivered_at IS NOT NULL
+    AND delivered_at < ?;
+
+
+-- name: purge_job_charges
+DELETE FROM job_charges
+WHERE job_id NOT IN (SELECT job_id FROM jobs);
+
+
+-- name: purge_job_cancels
+DELETE FROM job_cancels
+WHERE job_id NOT IN (SELECT job_id FROM jobs);
+
+
+-- name: count_jobs_by_status
+SELECT
+    status,
+    COUNT(*) as count
+FROM jobs
+WHERE delivered_at IS NULL
+GROUP BY status;
+
+
+-- name: heartbeat_worker
+INSERT INTO workers
+    (worker_id, pid, started_at, heartbeat_at)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (worker_id) DO UPDATE SET
+    pid = excluded.pid,
+    heartbeat_at = excluded.heartbeat_at;
+
+
+-- name: restart_worker
+INSERT OR REPLACE INTO workers
+    (worker_id, pid, started_at, heartbeat_at, jobs_done, jobs_failed)
+VALUES (?, ?, ?, ?, 0, 0);
+
+
+-- name: count_worker_job
+UPDATE workers
+SET
+    jobs_done = jobs_done + ?,
+    jobs_failed = jobs_failed + ?
+WHERE worker_id = ?;
+
+
+-- name: list_workers
+SELECT
+    worker_id, pid, started_at, heartbeat_at, jobs_done, jobs_failed
+FROM workers
+ORDER BY worker_id;
+
+
+-- name: list_user_jobs
+SELECT
+    job_id,
+    status,
+    attempts,
+    created_at,
+    json_extract(payload, '$.provider') as provider,
+    json_extract(payload, '$.model_id') as model_id,
+    job_id IN (SELECT job_id FROM job_cancels) as cancel_requested
+FROM jobs
+WHERE delivered_at IS NULL
+    AND status IN ('queued', 'running')
+    AND json_extract(payload, '$.user_id') = ?
+    AND COALESCE(json_extract(payload, '$.tenant'), 'default') = ?
+ORDER BY job_id;
+
+
+-- name: cancel_job
+UPDATE jobs
+SET
+    status = 'failed',
+    result = '{"error": "cancelled"}',
+    delivered_at = ?,
+    updated_at = ?
+WHERE job_id = ?
+    AND delivered_at IS NULL
+    AND status = 'queued'
+    AND json_extract(payload, '$.user_id') = ?
+    AND COALESCE(json_extract(payload, '$.tenant'), 'default') = ?;
+
+
+-- name: request_job_cancel
+INSERT OR REPLACE INTO job_cancels
+    (job_id, requested_at)
+SELECT job_id, ?
+FROM jobs
+WHERE job_id = ?
+    AND delivered_at IS NULL
+    AND status = 'running'
+    AND json_extract(payload, '$.user_id') = ?
+    AND COALESCE(json_extract(payload, '$.tenant'), 'default') = ?;
+
+
+-- name: list_worker_running_jobs
+SELECT job_id
+FROM jobs
+WHERE worker_id = ?
+    AND status = 'running';
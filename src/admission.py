@@ -0,0 +1,139 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+
+from contextlib import asynccontextmanager
+
+from src.metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+admission = None
+
+# Lower value is served first
+PRIORITIES: dict[str, int] = {"admin": 0, "premium": 1, "free": 2}
+
+QUEUE_WAIT = Histogram("admission_wait_seconds", "Time spent queued for an LLM slot", ("tier",))
+QUEUE_DEPTH = Gauge("admission_queue_depth", "Requests waiting for an LLM slot", ())
+REJECTED = Counter("admission_rejected_total", "Requests shed by admission control", ("tier", "reason"))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """Bounded pool of LLM slots handed out by access-level priority.
+
+    When all slots are busy requests wait in a priority queue (FIFO within a tier). A full queue sheds
+    its lowest-priority waiter if the newcomer outranks it, otherwise the newcomer is rejected. Each tier
+    has a max wait after which it gives up with a "busy" reply.
+    """
+
+    def __init__(self, max_active: int, max_queue: int, max_wait: dict[str, float | None]) -> None:
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        # Entries are [priority, seq, future], finished futures are dropped lazily
+        self.waiters: list[list] = []
+        self._seq = itertools.count()
+
+    def _queued(self) -> int:
+        return sum(1 for entry in self.waiters if not entry[2].done())
+
+    def _shed_lowest(self, priority: int) -> bool:
+        pending = [entry for entry in self.waiters if not entry[2].done()]
+        if not pending:
+            return False
+
+        # Lowest priority, newest first
+        lowest = max(pending, key=lambda entry: (entry[0], entry[1]))
+        if lowest[0] <= priority:
+            return False
+
+        lowest[2].set_exception(AdmissionRejected("shed"))
+        return True
+
+    async def acquire(self, access_level: str) -> None:
+        tier = access_level if access_level in PRIORITIES else "free"
+        priority = PRIORITIES[tier]
+        start_time = time.monotonic()
+
+        if self.active < self.max_active and not self._queued():
+            self.active += 1
+            QUEUE_WAIT.observe(0.0, tier=tier)
+            return
+
+        if self._queued() >= self.max_queue and not self._shed_lowest(priority):
+            REJECTED.inc(tier=tier, reason="queue_full")
+            raise AdmissionRejected("queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, [priority, next(self._seq), future])
+        QUEUE_DEPTH.set(self._queued())
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait.get(tier))
+
+        except asyncio.TimeoutError:
+            # The slot may have been handed over right as the timeout fired
+            if future.done() and not future.cancelled() and future.exception() is None:
+                QUEUE_WAIT.observe(time.monotonic() - start_time, tier=tier)
+                return
+
+            future.cancel()
+            REJECTED.inc(tier=tier, reason="timeout")
+            raise AdmissionRejected("timeout")
+
+        except AdmissionRejected:
+            REJECTED.inc(tier=tier, reason="shed")
+            raise
+
+        except asyncio.CancelledError:
+            # Handler cancelled while queued, give back the slot if it was already granted
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            future.cancel()
+            raise
+
+        finally:
+            QUEUE_DEPTH.set(self._queued())
+
+        QUEUE_WAIT.observe(time.monotonic() - start_time, tier=tier)
+
+    def release(self) -> None:
+        while self.waiters:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                # Slot passes straight to the next waiter, active count is unchanged
+                future.set_result(True)
+                return
+
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, access_level: str):
+        await self.acquire(access_level)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# Global Function to initalise AdmissionController
+def init_admission(config: dict) -> AdmissionController:
+    global admission
+    if admission is None:
+        admission = AdmissionController(config["max_active"], config["max_queue"], config["max_wait"])
+
+    return admission
+
+
+def get_admission() -> AdmissionController:
+    if admission is None:
+        raise RuntimeError("AdmissionController is not initialised")
+    return admission
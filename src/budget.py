@@ -0,0 +1,180 @@
+import logging
+import threading
+
+from datetime import datetime, timezone
+
+from src.utils import count_token, pricing_table
+from config import MAX_TOKENS, MODEL_CHOICES, SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
+budget_engine = None
+
+
+class BudgetDecision:
+    def __init__(
+        self, allowed: bool, provider: str, model_id: str, reserved: float = 0.0, keys: list | None = None, reason: str = ""
+    ) -> None:
+        self.allowed = allowed
+        self.provider = provider
+        self.model_id = model_id
+        self.reserved = reserved
+        self.keys = keys or []
+        self.reason = reason
+
+
+class BudgetEngine:
+    """In-memory rolling spend per user, access level and provider, checked against daily/monthly caps.
+
+    Spend is kept per calendar day/month (UTC). A request reserves its worst-case cost up front, the
+    reservation is replaced by the actual cost once the reply is priced, so concurrent requests can't
+    overshoot a cap together.
+    """
+
+    def __init__(self, caps: dict[str, dict[str, dict[str, float | None]]], allow_downgrade: bool = True) -> None:
+        self.caps = caps
+        self.allow_downgrade = allow_downgrade
+        # (scope, name) -> [day, day_spend, month, month_spend]
+        self.spend: dict[tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _periods(now: datetime | None = None) -> tuple[str, str]:
+        now = now or datetime.now(timezone.utc)
+        return now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+
+    def _entry(self, key: tuple[str, str], day: str, month: str) -> list:
+        entry = self.spend.get(key)
+        if entry is None:
+            entry = self.spend[key] = [day, 0.0, month, 0.0]
+
+        if entry[0] != day:
+            entry[0], entry[1] = day, 0.0
+        if entry[2] != month:
+            entry[2], entry[3] = month, 0.0
+
+        return entry
+
+    def _add(self, keys: list[tuple[str, str]], amount: float, day_amount: float | None = None) -> None:
+        day, month = self._periods()
+        for key in keys:
+            entry = self._entry(key, day, month)
+            entry[1] += amount if day_amount is None else day_amount
+            entry[3] += amount
+
+    def seed(self, rows: list[dict]) -> None:
+        """Rows of (user_id, access_level, provider, is_today, cost) aggregated from messages this month"""
+        with self._lock:
+            self.spend.clear()
+            for row in rows:
+                cost = row["cost"] or 0.0
+                day_cost = cost if row["is_today"] else 0.0
+                self._add(self._keys(row["user_id"], row["access_level"] or "free", row["provider"]), cost, day_cost)
+
+        logger.info(f"Seeded budget engine with {len(self.spend)} spend counters")
+
+    @staticmethod
+    def _keys(user_id: int, access_level: str, provider: str) -> list[tuple[str, str]]:
+        return [("user", str(user_id)), ("access_level", access_level), ("provider", provider.lower())]
+
+    def _cap(self, key: tuple[str, str], access_level: str, period: str) -> float | None:
+        scope, name = key
+        scope_caps = self.caps.get(scope, {})
+        # User caps are configured per access level rather than per user
+        limits = scope_caps.get(access_level if scope == "user" else name, {})
+        return limits.get(period)
+
+    def _headroom(self, keys: list[tuple[str, str]], access_level: str) -> tuple[float, str]:
+        day, month = self._periods()
+        headroom, reason = float("inf"), ""
+
+        for key in keys:
+            entry = self._entry(key, day, month)
+            for period, spent in (("daily", entry[1]), ("monthly", entry[3])):
+                cap = self._cap(key, access_level, period)
+                if cap is not None and cap - spent < headroom:
+                    headroom, reason = cap - spent, f"{period} {key[0].replace('_', ' ')} budget"
+
+        return headroom, reason
+
+    @staticmethod
+    def worst_case_cost(model_id: str, prompt: str, image_tokens: int = 0) -> float | None:
+        price = pricing_table.get(model_id)
+        if price is None:
+            return None
+
+        input_cost, output_cost, search_cost, _, cache_write_cost = price
+        # The system prompt goes out with every request, at worst as a fresh cache write
+        system_cost = max(input_cost, cache_write_cost) * (count_token(SYSTEM_PROMPT) or 0)
+        return (
+            input_cost * ((count_token(prompt) or 0) + image_tokens)
+            + system_cost
+            + output_cost * MAX_TOKENS
+            + search_cost
+        )
+
+    def _downgrade_candidates(
+        self, provider: str, model_id: str, prompt: str, image_tokens: int = 0
+    ) -> list[tuple[float, str]]:
+        candidates = []
+        for model in MODEL_CHOICES.get(provider, []):
+            # A request with images can only fall back to another vision model
+            if image_tokens and not model.get("vision"):
+                continue
+            cost = self.worst_case_cost(model["id"], prompt, image_tokens)
+            if model["id"] != model_id and cost is not None:
+                candidates.append((cost, model["id"]))
+
+        # Most capable (most expensive) affordable model first
+        return sorted(candidates, reverse=True)
+
+    def reserve(
+        self, user_id: int, access_level: str, provider: str, model_id: str, prompt: str, image_tokens: int = 0
+    ) -> BudgetDecision:
+        keys = self._keys(user_id, access_level, provider)
+        worst_case = self.worst_case_cost(model_id, prompt, image_tokens)
+        if worst_case is None:
+            # No pricing means nothing to enforce, still let the request through
+            return BudgetDecision(True, provider, model_id)
+
+        with self._lock:
+            headroom, reason = self._headroom(keys, access_level)
+
+            chosen = model_id if worst_case <= headroom else None
+            if chosen is None and self.allow_downgrade:
+                for cost, candidate in self._downgrade_candidates(provider, model_id, prompt, image_tokens):
+                    if cost <= headroom:
+                        chosen, worst_case = candidate, cost
+                        break
+
+            if chosen is None:
+                return BudgetDecision(False, provider, model_id, reason=reason)
+
+            self._add(keys, worst_case)
+
+        return BudgetDecision(True, provider, chosen, reserved=worst_case, keys=keys)
+
+    def settle(self, decision: BudgetDecision, actual_cost: float) -> None:
+        """Swap the worst-case reservation for the real cost (0 if the request failed)"""
+        if not decision.keys:
+            return
+
+        with self._lock:
+            self._add(decision.keys, actual_cost - decision.reserved)
+
+        decision.keys = []
+
+
+# Global Function to initalise BudgetEngine
+def init_budget(caps: dict, allow_downgrade: bool, spend_rows: list[dict]) -> BudgetEngine:
+    global budget_engine
+    if budget_engine is None:
+        budget_engine = BudgetEngine(caps, allow_downgrade)
+        budget_engine.seed(spend_rows)
+
+    return budget_engine
+
+
+def get_budget() -> BudgetEngine:
+    if budget_engine is None:
+        raise RuntimeError("BudgetEngine is not initialised")
+    return budget_engine
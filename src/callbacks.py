@@ -0,0 +1,70 @@
+import re
+import logging
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Payloads look like "1|m|3|0|2": version, action code, then integer args (indices, never model IDs)
+CALLBACK_VERSION = "1"
+SEPARATOR = "|"
+MAX_CALLBACK_BYTES = 64
+
+
+def pack(action: str, *args) -> str:
+    data = SEPARATOR.join((CALLBACK_VERSION, action, *(str(arg) for arg in args)))
+    if len(data.encode("utf-8")) > MAX_CALLBACK_BYTES:
+        raise ValueError(f"callback_data over {MAX_CALLBACK_BYTES} bytes: {data}")
+    return data
+
+
+def callback_pattern(*actions: str, legacy_prefixes: tuple[str, ...] = ()) -> re.Pattern:
+    """Regex for CallbackQueryHandler matching the given action codes (any version) and old-style prefixes"""
+    alternatives = [rf"\d+\|(?:{'|'.join(map(re.escape, actions))})(?:\||$)"]
+    alternatives += [re.escape(prefix) for prefix in legacy_prefixes]
+    return re.compile(f"^(?:{'|'.join(alternatives)})")
+
+
+class CallbackRouter:
+    """Dispatch table from action code to (handler(update, context, *int_args), arg count).
+
+    Payloads from another version (or the pre-versioned format) go to the stale handler, which
+    should redraw the menu so the user gets fresh buttons.
+    """
+
+    def __init__(self, name: str, legacy_prefixes: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.legacy_prefixes = legacy_prefixes
+        self.routes: dict[str, tuple[callable, int]] = {}
+        self.stale_handler = None
+
+    def route(self, action: str):
+        def decorator(func):
+            if action in self.routes:
+                raise ValueError(f"Duplicate callback action {action} in {self.name}")
+            self.routes[action] = (func, func.__code__.co_argcount - 2)
+            return func
+
+        return decorator
+
+    def stale(self, func):
+        self.stale_handler = func
+        return func
+
+    @property
+    def pattern(self) -> re.Pattern:
+        return callback_pattern(*self.routes, legacy_prefixes=self.legacy_prefixes)
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        version, _, rest = update.callback_query.data.partition(SEPARATOR)
+        action, *args = rest.split(SEPARATOR) if rest else ("",)
+
+        route = self.routes.get(action) if version == CALLBACK_VERSION else None
+        if route is not None and len(args) == route[1] and all(arg.isdigit() for arg in args):
+            await route[0](update, context, *map(int, args))
+            return
+
+        logger.debug(f"Stale {self.name} callback {update.callback_query.data!r}")
+        if self.stale_handler is not None:
+            await self.stale_handler(update, context)
@@ -1,31 +1,103 @@
 import os
+import json
+import time
+import zlib
+import heapq
 import logging
 import sqlite3
+import itertools
 
 from datetime import datetime
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import instrument_methods
+from src.query_profiler import ProfiledCursor, profiler
+from src.sketches import DDSketch
+from config import DB_SHARDS
 
 logger = logging.getLogger(__name__)
 user_mgr = None
 
+# Set per update / job in multi-tenant mode (src/tenants.py), unset means the default database
+current_user_mgr: ContextVar["UserManager | None"] = ContextVar("current_user_mgr", default=None)
+
+
+def shard_index(user_id: int, shards: int) -> int:
+    """Stable across processes and restarts, unlike hash() on str, and spreads sequential IDs evenly"""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def shard_fpaths(db_path: str, shards: int) -> list[str]:
+    """data/master.db -> [data/master.shard0.db, ...], empty when not sharded"""
+    root, ext = os.path.splitext(db_path)
+    return [f"{root}.shard{index}{ext}" for index in range(shards)]
+
 
 class UserManager:
-    def __init__(self, db_path: str, query_path: str) -> None:
+    """users and messages (with the provider rollups written alongside them) live in the shard picked by
+    user_id when `shards` > 0, everything else (prompt cache, sketches, processed updates) stays in db_path.
+    Per-user calls open a single shard, admin aggregates query every shard in parallel and merge the rows.
+    """
+
+    def __init__(self, db_path: str, query_path: str, free_queries: int = 30, shards: int = 0) -> None:
         self.db_path: str = db_path
         self.query_path: str = query_path
+        self.free_queries: int = free_queries
         self.ini_sql_file: str = "init_db.sql"
         self.common_sql_file: str = "common.sql"
         self.queries: dict[str, str] = {}
 
-        self._check_db()
+        # Unsharded is a single shard that is also the main database
+        self.shard_paths: list[str] = shard_fpaths(db_path, shards) or [db_path]
+        self.all_paths: list[str] = list(dict.fromkeys([db_path, *self.shard_paths]))
+        self.shard_pool = ThreadPoolExecutor(shards, thread_name_prefix="db-shard") if shards > 1 else None
+
+        for path in self.all_paths:
+            self._check_db(path)
         self._store_queries()
 
-    def _connect_db(self):
-        conn = sqlite3.connect(self.db_path)
+    def _connect_db(self, db_path: str | None = None):
+        conn = sqlite3.connect(db_path or self.db_path)
         conn.row_factory = sqlite3.Row
         return conn
 
-    def _check_db(self):
-        conn = self._connect_db()
+    def _connect_user(self, user_id: int):
+        return self._connect_db(self._shard_path(user_id))
+
+    def _shard_path(self, user_id: int) -> str:
+        return self.shard_paths[shard_index(user_id, len(self.shard_paths))]
+
+    def _fan_out(self, func, db_paths: list[str] | None = None) -> list:
+        """func(conn) on every shard (or db_paths), in parallel threads as sqlite3 releases the GIL while querying"""
+
+        def run(db_path: str):
+            conn = self._connect_db(db_path)
+            try:
+                return func(conn)
+            finally:
+                conn.close()
+
+        db_paths = db_paths or self.shard_paths
+        if self.shard_pool is None or len(db_paths) == 1:
+            return [run(db_path) for db_path in db_paths]
+        return list(self.shard_pool.map(run, db_paths))
+
+    @staticmethod
+    def _sum_rows(shard_rows: list[list[dict]], key: str) -> list[dict]:
+        """Add up the numeric columns of rows sharing `key` across shards"""
+        merged: dict = {}
+        for rows in shard_rows:
+            for row in rows:
+                total = merged.setdefault(row[key], {column: 0 for column in row} | {key: row[key]})
+                for column, value in row.items():
+                    if column != key:
+                        total[column] += value or 0
+
+        return list(merged.values())
+
+    def _check_db(self, db_path: str):
+        conn = self._connect_db(db_path)
         init_query_path = os.path.join(self.query_path, self.ini_sql_file)
 
         with open(init_query_path, "r") as file:
@@ -35,10 +107,25 @@ class UserManager:
             conn.executescript(query)
             conn.commit()
         except Exception as e:
-            logger.error(f"Error initialising database: {e}")
+            logger.error(f"Error initialising database {db_path}: {e}")
         finally:
             conn.close()
 
+    def _execute(self, conn: sqlite3.Connection, name: str, params=()) -> ProfiledCursor:
+        """Run a named query from common.sql through the query profiler"""
+        sql = self.queries[name]
+        started = time.perf_counter()
+        cursor = conn.execute(sql, params)
+        return ProfiledCursor(profiler, name, cursor, sql, params, time.perf_counter() - started)
+
+    def _executemany(self, conn: sqlite3.Connection, name: str, seq_params: list) -> ProfiledCursor:
+        sql = self.queries[name]
+        started = time.perf_counter()
+        cursor = conn.executemany(sql, seq_params)
+        # The first parameter set stands in for all of them in the slow query log
+        first_params = seq_params[0] if seq_params else ()
+        return ProfiledCursor(profiler, name, cursor, sql, first_params, time.perf_counter() - started)
+
     def _store_queries(self) -> None:
         fpath = os.path.join(self.query_path, self.common_sql_file)
         with open(fpath, "r") as file:
@@ -55,40 +142,43 @@ class UserManager:
     def register_user(
         self, user_id: int, username: str | None = None, first_name: str | None = None, last_name: str | None = None
     ):
-        conn = self._connect_db()
+        conn = self._connect_user(user_id)
 
         try:
-            user = conn.execute(
-                self.queries["find_user"],
+            user = self._execute(
+                conn,
+                "find_user",
                 (user_id,),
             ).fetchone()
 
             if user:
-                conn.execute(
-                    self.queries["update_existing_user"],
+                self._execute(
+                    conn,
+                    "update_existing_user",
                     (username, first_name, last_name, user_id),
                 )
 
             else:
-                conn.execute(
-                    self.queries["add_new_user"],
-                    (user_id, username, first_name, last_name),
+                self._execute(
+                    conn,
+                    "add_new_user",
+                    (user_id, username, first_name, last_name, self.free_queries),
                 )
             conn.commit()
 
         except Exception as e:
             logger.error(f"Error registering user {user_id}: {e}")
             conn.rollback()
-            return {"user_id": user_id, "access_level": "free", "remaining_free_queries": 30}
+            return {"user_id": user_id, "access_level": "free", "remaining_free_queries": self.free_queries}
 
         finally:
             conn.close()
 
     def validate_user(self, user_id: int) -> tuple[bool, str]:
-        conn = self._connect_db()
+        conn = self._connect_user(user_id)
 
         try:
-            user = conn.execute(self.queries["validate_user"], (user_id,)).fetchone()
+            user = self._execute(conn, "validate_user", (user_id,)).fetchone()
 
             access_level = user["access_level"]
             remaining = user["remaining_free_queries"]
@@ -112,12 +202,21 @@ class UserManager:
             conn.close()
 
     def record_msg(
-        self, user_id: int, provider: str, model_id: str, input_tokens: int, output_tokens: int, query_cost: float
+        self,
+        user_id: int,
+        provider: str,
+        model_id: str,
+        input_tokens: int,
+        output_tokens: int,
+        query_cost: float,
+        cached_tokens: int | None = None,
+        cache_write_tokens: int = 0,
     ):
-        conn = self._connect_db()
+        """cached_tokens is None unless the provider reported its usage, those calls count for the cache hit ratio"""
+        conn = self._connect_user(user_id)
 
         try:
-            user = conn.execute(self.queries["validate_user"], (user_id,)).fetchone()
+            user = self._execute(conn, "validate_user", (user_id,)).fetchone()
 
             if not user:
                 logger.info(f"User {user_id} has no free queries available.")
@@ -127,24 +226,34 @@ class UserManager:
             if user["access_level"] == "free" and user["remaining_free_queries"] > 0:
                 logger.info(f"User {user_id} - {user['access_level']} - Remaining: {user['remaining_free_queries']}")
 
-                conn.execute(self.queries["minus_free_query"], (user_id,))
+                self._execute(conn, "minus_free_query", (user_id,))
 
-            conn.execute(
-                self.queries["add_query_count"],
+            self._execute(
+                conn,
+                "add_query_count",
                 (user_id,),
             )
 
-            conn.execute(
-                self.queries["register_msg"],
+            self._execute(
+                conn,
+                "register_msg",
                 (user_id, provider, model_id, input_tokens, output_tokens, query_cost),
             )
 
             total_tokens = input_tokens + output_tokens
-            conn.execute(
-                self.queries["update_provider_stats"],
+            self._execute(
+                conn,
+                "update_provider_stats",
                 (input_tokens, output_tokens, total_tokens, query_cost, provider),
             )
 
+            if cached_tokens is not None:
+                self._execute(
+                    conn,
+                    "update_provider_cache_stats",
+                    (provider, input_tokens, cached_tokens, cache_write_tokens),
+                )
+
             conn.commit()
             return True
 
@@ -157,10 +266,10 @@ class UserManager:
             conn.close()
 
     def get_user(self, user_id: int) -> dict | None:
-        conn = self._connect_db()
+        conn = self._connect_user(user_id)
 
         try:
-            user = conn.execute(self.queries["find_user"], (user_id,)).fetchone()
+            user = self._execute(conn, "find_user", (user_id,)).fetchone()
             return dict(user) if user else None
 
         except Exception as e:
@@ -171,151 +280,495 @@ class UserManager:
             conn.close()
 
     def get_user_count(self) -> dict[str, int]:
-        conn = self._connect_db()
         try:
-            result = conn.execute(self.queries["get_users_count"]).fetchone()
-            return dict(result)
+            counts = {"total": 0, "free": 0, "premium": 0, "admin": 0}
+            for result in self._fan_out(lambda conn: self._execute(conn, "get_users_count").fetchone()):
+                for level in counts:
+                    counts[level] += result[level] or 0
+            return counts
 
         except Exception as e:
             logging.error(f"Error getting user count: {e}")
             return {"total": 0, "free": 0, "premium": 0, "admin": 0}
 
-        finally:
-            conn.close()
-
     def get_active_users(self, days: int = 7) -> int:
-        conn = self._connect_db()
         try:
-            result = conn.execute(
-                self.queries["get_active_users_count"],
-                (f"-{days} days",),
-            ).fetchone()
+            results = self._fan_out(
+                lambda conn: self._execute(
+                    conn,
+                    "get_active_users_count",
+                    (f"-{days} days",),
+                ).fetchone()
+            )
 
-            return result["count"]
+            # A user lives in a single shard, so per-shard distinct counts add up
+            return sum(result["count"] for result in results)
 
         except Exception as e:
             logging.error(f"Error getting active users: {e}")
             return 0
 
+    def get_total_cost(self) -> float:
+        try:
+            results = self._fan_out(lambda conn: self._execute(conn, "get_total_cost").fetchone())
+            return sum(result["cost"] or 0.0 for result in results)
+
+        except Exception as e:
+            logging.error(f"Error getting total cost: {e}")
+            return 0.0
+
+    def get_provider_stats(self) -> list[dict]:
+        try:
+            shard_rows = self._fan_out(
+                lambda conn: [dict(row) for row in self._execute(conn, "get_provider_stats").fetchall()]
+            )
+            rows = self._sum_rows(shard_rows, "provider")
+            return sorted(rows, key=lambda row: row["total_messages"], reverse=True)
+
+        except Exception as e:
+            logging.error(f"Error getting provider stats: {e}")
+            return []
+
+    def get_daily_stats(self, days: int = 7) -> list[dict]:
+        try:
+            shard_rows = self._fan_out(
+                lambda conn: [
+                    dict(row)
+                    for row in self._execute(
+                        conn,
+                        "get_daily_stats",
+                        (f"-{days} days",),
+                    ).fetchall()
+                ]
+            )
+            rows = self._sum_rows(shard_rows, "date")
+            return sorted(rows, key=lambda row: row["date"], reverse=True)
+
+        except Exception as e:
+            logging.error(f"Error getting daily stats: {e}")
+            return []
+
+    def _recent_users(self, query_name: str, limit: int) -> list[dict]:
+        """The `limit` most recently active users over all shards, each shard returns its own top `limit`"""
+        shard_rows = self._fan_out(
+            lambda conn: [dict(row) for row in self._execute(conn, query_name, (limit,)).fetchall()]
+        )
+        merged = heapq.merge(*shard_rows, key=lambda row: row["last_active_at"], reverse=True)
+        return list(itertools.islice(merged, limit))
+
+    def list_users(self, limit: int = 10) -> list[dict]:
+        try:
+            return self._recent_users("get_recent_users", limit)
+
+        except Exception as e:
+            logging.error(f"Error listing users: {e}")
+            return []
+
+    def list_free_user(self, limit: int = 5) -> list[dict]:
+        try:
+            return self._recent_users("get_free_users", limit)
+
+        except Exception as e:
+            logging.error(f"Error listing users: {e}")
+            return []
+
+    def list_users_page(
+        self,
+        access_level: str = "all",
+        cursor: tuple[str, int] | None = None,
+        direction: str = "next",
+        limit: int = 10,
+    ) -> list[dict]:
+        """Keyset page ordered by (last_active_at, user_id) DESC, cursor is the boundary row of the current page"""
+        if direction not in ("next", "prev"):
+            logger.error(f"Invalid page direction: {direction}")
+            return []
+
+        if cursor is None:
+            # Sentinel that sorts after every timestamp, i.e. start from the most recent user
+            cursor = ("9999-12-31 23:59:59", 0)
+
+        try:
+            shard_rows = self._fan_out(
+                lambda conn: [
+                    dict(row)
+                    for row in self._execute(
+                        conn,
+                        f"get_users_page_{direction}",
+                        (access_level, access_level, cursor[0], cursor[1], limit),
+                    ).fetchall()
+                ]
+            )
+
+            # Previous page is fetched ascending from the cursor, flip it back to display order
+            merged = heapq.merge(
+                *shard_rows, key=lambda row: (row["last_active_at"], row["user_id"]), reverse=direction == "next"
+            )
+            rows = list(itertools.islice(merged, limit))
+            if direction == "prev":
+                rows.reverse()
+
+            return rows
+
+        except Exception as e:
+            logging.error(f"Error paging users: {e}")
+            return []
+
+    def iter_export_rows(self, table: str, batch_size: int = 500):
+        """Yield the header then every row of the table, fetching in batches to keep memory bounded.
+
+        Sharded tables are exported one shard after the other (message_id is only unique within a shard).
+        """
+        if table not in ("users", "messages"):
+            raise ValueError(f"Table {table} is not exportable")
+
+        for index, db_path in enumerate(self.shard_paths):
+            conn = self._connect_db(db_path)
+            try:
+                cursor = self._execute(conn, f"export_{table}")
+                if index == 0:
+                    yield [col[0] for col in cursor.description]
+
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+
+                    for row in rows:
+                        yield tuple(row)
+
+            finally:
+                conn.close()
+
+    def update_user_access(self, user_id: int, access_level: str) -> bool:
+        if access_level not in ("free", "premium", "admin"):
+            logger.error(f"Invalid access level: {access_level}")
+            return False
+
+        conn = self._connect_user(user_id)
+        try:
+            self._execute(conn, "admin_change_user_role", (access_level, user_id))
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error updating user access for {user_id}: {e}")
+            conn.rollback()
+            return False
+
         finally:
             conn.close()
 
-    def get_total_cost(self) -> float:
+    def reset_free_queries(self, user_id: int, count: int = 30) -> bool:
+        conn = self._connect_user(user_id)
+        try:
+            self._execute(conn, "admin_add_credit", (count, user_id))
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logging.error(f"Error resetting free queries for {user_id}: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def find_inactive_free_users(self, days: int = 30) -> list[int]:
+        try:
+            shard_ids = self._fan_out(
+                lambda conn: [
+                    row["user_id"]
+                    for row in self._execute(conn, "find_inactive_free_users", (f"-{days} days",)).fetchall()
+                ]
+            )
+            return list(itertools.chain.from_iterable(shard_ids))
+
+        except Exception as e:
+            logging.error(f"Error finding inactive free users: {e}")
+            return []
+
+    def _bulk_apply(self, query_name: str, user_ids: list[int], value: str | int) -> dict[str, int | list[int]]:
+        """Validate user IDs with one set-based lookup per shard, then apply the update to existing ones in one
+        transaction per shard"""
+        unique_ids = list(dict.fromkeys(user_ids))
+        result: dict[str, int | list[int]] = {"updated": 0, "missing": [], "failed": 0}
+
+        ids_by_shard: dict[str, list[int]] = {}
+        for user_id in unique_ids:
+            ids_by_shard.setdefault(self._shard_path(user_id), []).append(user_id)
+
+        for db_path, shard_ids in ids_by_shard.items():
+            missing = []
+            conn = self._connect_db(db_path)
+            try:
+                rows = self._execute(conn, "find_existing_users", (json.dumps(shard_ids),)).fetchall()
+                existing = {row["user_id"] for row in rows}
+
+                to_update = [user_id for user_id in shard_ids if user_id in existing]
+                missing = [user_id for user_id in shard_ids if user_id not in existing]
+
+                self._executemany(conn, query_name, [(value, user_id) for user_id in to_update])
+                conn.commit()
+
+                result["updated"] += len(to_update)
+
+            except Exception as e:
+                logger.error(f"Error applying bulk {query_name} on {db_path}: {e}")
+                conn.rollback()
+                result["failed"] += len(shard_ids) - len(missing)
+
+            finally:
+                conn.close()
+
+            result["missing"].extend(missing)
+
+        return result
+
+    def bulk_update_access(self, user_ids: list[int], access_level: str) -> dict[str, int | list[int]]:
+        if access_level not in ("free", "premium", "admin"):
+            logger.error(f"Invalid access level: {access_level}")
+            return {"updated": 0, "missing": [], "failed": len(user_ids)}
+
+        return self._bulk_apply("admin_change_user_role", user_ids, access_level)
+
+    def bulk_add_credits(self, user_ids: list[int], credits: int) -> dict[str, int | list[int]]:
+        return self._bulk_apply("admin_bulk_add_credit", user_ids, credits)
+
+    def refill_free_quota(self, amount: int = 30) -> int:
+        """Top up every free user to at least `amount` queries in one UPDATE per shard, returns the rows touched"""
+
+        def refill(conn: sqlite3.Connection) -> int:
+            cursor = self._execute(conn, "refill_free_quota", (amount,))
+            conn.commit()
+            return cursor.rowcount
+
+        try:
+            return sum(self._fan_out(refill))
+
+        except Exception as e:
+            logger.error(f"Error refilling free quota: {e}")
+            return 0
+
+    def refresh_rollups(self) -> bool:
+        """Rebuild provider_stats from messages so the running totals can't drift (per shard, summed on read)"""
+
+        def refresh(conn: sqlite3.Connection) -> None:
+            self._execute(conn, "refresh_provider_stats")
+            conn.commit()
+
+        try:
+            self._fan_out(refresh)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error refreshing rollups: {e}")
+            return False
+
+    def optimize_db(self) -> bool:
+        def optimize(conn: sqlite3.Connection) -> None:
+            self._execute(conn, "analyze_db")
+            self._execute(conn, "optimize_db")
+
+        try:
+            self._fan_out(optimize, self.all_paths)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error optimising database: {e}")
+            return False
+
+    def checkpoint_wal(self) -> tuple[int, int, int] | None:
+        """Returns (busy, wal pages, checkpointed pages) from PRAGMA wal_checkpoint, summed over all files"""
+        try:
+            results = self._fan_out(
+                lambda conn: tuple(self._execute(conn, "wal_checkpoint").fetchone()), self.all_paths
+            )
+            return tuple(sum(values) for values in zip(*results))
+
+        except Exception as e:
+            logger.error(f"Error checkpointing WAL: {e}")
+            return None
+
+    def get_month_spend(self) -> list[dict]:
+        """Spend this calendar month grouped by user and provider, split into today / earlier"""
+        try:
+            shard_rows = self._fan_out(
+                lambda conn: [dict(row) for row in self._execute(conn, "get_month_spend").fetchall()]
+            )
+            return list(itertools.chain.from_iterable(shard_rows))
+
+        except Exception as e:
+            logging.error(f"Error getting monthly spend: {e}")
+            return []
+
+    def store_cached_prompt(self, model_id: str, fingerprint: int, response: str, created_at: float) -> bool:
         conn = self._connect_db()
         try:
-            result = conn.execute(self.queries["get_total_cost"]).fetchone()
-            return result["cost"]
+            self._execute(conn, "store_cached_prompt", (model_id, fingerprint, response, created_at))
+            conn.commit()
+            return True
 
         except Exception as e:
-            logging.error(f"Error getting total cost: {e}")
-            return 0.0
+            logger.error(f"Error storing cached prompt for {model_id}: {e}")
+            conn.rollback()
+            return False
 
         finally:
             conn.close()
 
-    def get_provider_stats(self) -> list[dict]:
+    def load_cached_prompts(self, since: float) -> list[dict]:
         conn = self._connect_db()
         try:
-            cursor = conn.execute(self.queries["get_provider_stats"])
+            cursor = self._execute(conn, "load_cached_prompts", (since,))
             return [dict(row) for row in cursor.fetchall()]
 
         except Exception as e:
-            logging.error(f"Error getting provider stats: {e}")
+            logger.error(f"Error loading cached prompts: {e}")
             return []
 
         finally:
             conn.close()
 
-    def get_daily_stats(self, days: int = 7) -> list[dict]:
+    def prune_cached_prompts(self, before: float) -> int:
         conn = self._connect_db()
         try:
-            cursor = conn.execute(
-                self.queries["get_daily_stats"],
-                (f"-{days} days",),
-            )
-            return [dict(row) for row in cursor.fetchall()]
+            cursor = self._execute(conn, "prune_cached_prompts", (before,))
+            conn.commit()
+            return cursor.rowcount
 
         except Exception as e:
-            logging.error(f"Error getting daily stats: {e}")
-            return []
+            logger.error(f"Error pruning cached prompts: {e}")
+            conn.rollback()
+            return 0
 
         finally:
             conn.close()
 
-    def list_users(self, limit: int = 10) -> list[dict]:
+    def merge_sketches(self, deltas: dict[tuple[str, str, str], DDSketch]) -> bool:
+        """Merge (provider, model_id, metric) sketches into the stored ones, locked against other processes"""
         conn = self._connect_db()
         try:
-            cursor = conn.execute(
-                self.queries["get_recent_users"],
-                (limit,),
-            )
-            return [dict(row) for row in cursor.fetchall()]
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            for (provider, model_id, metric), delta in deltas.items():
+                row = self._execute(conn, "get_sketch", (provider, model_id, metric)).fetchone()
+                sketch = DDSketch.from_json(row["sketch"]) if row else DDSketch()
+                if sketch.gamma != delta.gamma:
+                    # Relative accuracy changed in config, older data can't be merged
+                    sketch = DDSketch()
+                sketch.merge(delta)
+                self._execute(conn, "upsert_sketch", (provider, model_id, metric, sketch.to_json(), now))
+
+            conn.commit()
+            return True
 
         except Exception as e:
-            logging.error(f"Error listing users: {e}")
-            return []
+            logger.error(f"Error merging metric sketches: {e}")
+            conn.rollback()
+            return False
 
         finally:
             conn.close()
 
-    def list_free_user(self, limit: int = 5) -> list[dict]:
+    def load_sketches(self) -> list[dict]:
         conn = self._connect_db()
         try:
-            cursor = conn.execute(
-                self.queries["get_free_users"],
-                (limit,),
-            )
+            cursor = self._execute(conn, "load_sketches")
             return [dict(row) for row in cursor.fetchall()]
 
         except Exception as e:
-            logging.error(f"Error listing users: {e}")
+            logger.error(f"Error loading metric sketches: {e}")
             return []
 
         finally:
             conn.close()
 
-    def update_user_access(self, user_id: int, access_level: str) -> bool:
-        if access_level not in ("free", "premium", "admin"):
-            logger.error(f"Invalid access level: {access_level}")
-            return False
+    def claim_update(self, chat_id: int, message_id: int, update_id: int) -> bool | None:
+        """True if the message wasn't handled before, False if it was, None if the database couldn't tell"""
+        conn = self._connect_db()
+        try:
+            cursor = self._execute(conn, "claim_update", (chat_id, message_id, update_id, time.time()))
+            conn.commit()
+            return cursor.rowcount == 1
+
+        except Exception as e:
+            logger.error(f"Error claiming update {update_id}: {e}")
+            conn.rollback()
+            return None
+
+        finally:
+            conn.close()
 
+    def get_update_reply(self, chat_id: int, message_id: int) -> str | None:
         conn = self._connect_db()
         try:
-            conn.execute(self.queries["admin_change_user_role"], (access_level, user_id))
+            cursor = self._execute(conn, "get_update_reply", (chat_id, message_id))
+            row = cursor.fetchone()
+            return row["reply"] if row else None
+
+        except Exception as e:
+            logger.error(f"Error getting stored reply of message {chat_id}/{message_id}: {e}")
+            return None
+
+        finally:
+            conn.close()
+
+    def complete_update(self, chat_id: int, message_id: int, reply: str | None) -> bool:
+        conn = self._connect_db()
+        try:
+            self._execute(conn, "complete_update", (reply, chat_id, message_id))
             conn.commit()
             return True
 
         except Exception as e:
-            logger.error(f"Error updating user access for {user_id}: {e}")
+            logger.error(f"Error completing message {chat_id}/{message_id}: {e}")
             conn.rollback()
             return False
 
         finally:
             conn.close()
 
-    def reset_free_queries(self, user_id: int, count: int = 30) -> bool:
+    def get_committed_update_id(self) -> int | None:
+        """Highest update_id whose reply was sent"""
         conn = self._connect_db()
         try:
-            conn.execute(self.queries["admin_add_credit"], (count, user_id))
+            cursor = self._execute(conn, "get_committed_update_id")
+            return cursor.fetchone()["update_id"]
+
+        except Exception as e:
+            logger.error(f"Error getting committed update id: {e}")
+            return None
+
+        finally:
+            conn.close()
+
+    def prune_processed_updates(self, before: float) -> int:
+        conn = self._connect_db()
+        try:
+            cursor = self._execute(conn, "prune_processed_updates", (before,))
             conn.commit()
-            return True
+            return cursor.rowcount
 
         except Exception as e:
-            logging.error(f"Error resetting free queries for {user_id}: {e}")
+            logger.error(f"Error pruning processed updates: {e}")
             conn.rollback()
-            return False
+            return 0
 
         finally:
             conn.close()
 
 
+instrument_methods(UserManager)
+
+
 # Global Function to initalise UserManager
 def init_user_mgr(db_path: str, query_path: str) -> UserManager | None:
     global user_mgr
     if user_mgr is None:
         try:
-            user_mgr = UserManager(db_path, query_path)
-            logger.info("Initalised UserManager")
+            user_mgr = UserManager(db_path, query_path, shards=DB_SHARDS)
+            logger.info(f"Initalised UserManager ({DB_SHARDS} shards)")
             return user_mgr
 
         except Exception as e:
@@ -324,7 +777,10 @@ def init_user_mgr(db_path: str, query_path: str) -> UserManager | None:
     return user_mgr
 
 
-def get_user_mgr() -> UserManager | None:
+def get_user_mgr(shared: bool = False) -> UserManager | None:
+    """The current tenant's database, `shared` gives the default one that holds process wide data (sketches)"""
     if user_mgr is None:
         raise RuntimeError("UserManager is not initialised")
-    return user_mgr
+    if shared:
+        return user_mgr
+    return current_user_mgr.get() or user_mgr
@@ -0,0 +1,72 @@
+import logging
+
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.error import TelegramError
+
+from src.tenants import current_tenant
+from config import UPDATE_DEDUP
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateLedger:
+    """Messages this process has claimed, in front of each tenant's processed_updates table.
+
+    Telegram redelivers every update it hasn't seen confirmed, so after a crash or restart a message can
+    arrive again. The first handler to claim (chat_id, message_id) owns it; a replay gets the stored reply if
+    the first one finished and is dropped otherwise, answering twice is worse than not billing twice.
+    """
+
+    def __init__(self, memory_size: int) -> None:
+        self.memory_size = memory_size
+        # (tenant, chat_id, message_id) of recent claims, oldest first
+        self.recent: OrderedDict[tuple[str, int, int], None] = OrderedDict()
+
+    def claim(self, user_mgr, update: Update) -> tuple[bool, str | None]:
+        """(True, None) if the caller now owns the message, else (False, stored reply or None)"""
+        message = update.effective_message
+        key = (current_tenant.get(), message.chat_id, message.message_id)
+        if key in self.recent:
+            return False, user_mgr.get_update_reply(message.chat_id, message.message_id)
+
+        self.recent[key] = None
+        if len(self.recent) > self.memory_size:
+            self.recent.popitem(last=False)
+
+        # None means the database couldn't tell, the in-memory window still covers this process
+        claimed = user_mgr.claim_update(message.chat_id, message.message_id, update.update_id)
+        if claimed is False:
+            return False, user_mgr.get_update_reply(message.chat_id, message.message_id)
+        return True, None
+
+    def complete(self, user_mgr, chat_id: int, message_id: int, reply: str | None = None) -> None:
+        """Called once the reply was sent, a replay is answered with `reply` (None: skipped)"""
+        user_mgr.complete_update(chat_id, message_id, reply)
+
+
+ledger = UpdateLedger(UPDATE_DEDUP["memory_size"])
+
+
+async def confirm_processed_updates(application: Application) -> None:
+    """Confirm everything up to the last answered update before polling starts.
+
+    PTB confirms a batch of updates when it fetches the next one, before they are answered. The offset that
+    matters after a restart is the one stored with the replies: updates past it are fetched again and go
+    through the ledger, everything before it is acknowledged here so Telegram stops redelivering it.
+    """
+    tenant = application.bot_data.get("tenant")
+    if tenant is None:
+        return
+
+    update_id = tenant.user_mgr.get_committed_update_id()
+    if update_id is None:
+        return
+
+    try:
+        await application.bot.get_updates(offset=update_id + 1, limit=1, timeout=0)
+        logger.info(f"Confirmed updates of {tenant.name} up to {update_id}")
+    except TelegramError as e:
+        logger.warning(f"Couldn't confirm processed updates of {tenant.name}: {e}")
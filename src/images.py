@@ -0,0 +1,110 @@
+import io
+import base64
+import asyncio
+import logging
+import importlib.util
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+from config import VISION_PROCESS_WORKERS, VISION_JPEG_QUALITY
+
+logger = logging.getLogger(__name__)
+image_pool = None
+
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+# Formats every vision provider takes as they are
+PASSTHROUGH_TYPES: tuple[str, ...] = ("image/jpeg", "image/png", "image/gif", "image/webp")
+
+MIN_JPEG_QUALITY = 40
+MAX_ENCODE_ATTEMPTS = 8
+
+
+class ImageInput:
+    """Encoded image within a provider's limits, with its size in pixels for pricing"""
+
+    def __init__(self, data: bytes, media_type: str, width: int, height: int) -> None:
+        self.data = data
+        self.media_type = media_type
+        self.width = width
+        self.height = height
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("ascii")
+
+
+def encode_image(fpath: str, max_edge: int, max_bytes: int, quality: int) -> tuple[bytes, int, int]:
+    """Runs in the image pool, returns (jpeg bytes, width, height) fitted into max_edge and max_bytes.
+
+    Too large an encoding is retried at lower quality first, then at half the size.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(fpath) as source:
+        # Phone photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    for _ in range(MAX_ENCODE_ATTEMPTS):
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue(), image.width, image.height
+
+        if quality > MIN_JPEG_QUALITY:
+            quality = max(MIN_JPEG_QUALITY, quality - 15)
+        else:
+            image = image.resize((max(1, image.width // 2), max(1, image.height // 2)), Image.Resampling.LANCZOS)
+
+    raise ValueError(f"Unable to encode {fpath} under {max_bytes} bytes")
+
+
+def _read_file(fpath: str) -> bytes:
+    with open(fpath, "rb") as file:
+        return file.read()
+
+
+async def prepare_image(
+    fpath: str,
+    media_type: str,
+    max_edge: int,
+    max_bytes: int,
+    width: int | None = None,
+    height: int | None = None,
+) -> ImageInput:
+    """Bring a downloaded image within the provider's limits without blocking the event loop.
+
+    With Pillow the image is resized and re-encoded in the image pool. Without it only files already within
+    the limits whose size is known (Telegram photos) are sent as they are, anything else raises ImportError.
+    """
+    if PILLOW_AVAILABLE:
+        data, width, height = await asyncio.get_running_loop().run_in_executor(
+            get_image_pool(), encode_image, fpath, max_edge, max_bytes, VISION_JPEG_QUALITY
+        )
+        return ImageInput(data, "image/jpeg", width, height)
+
+    if width is None or height is None or max(width, height) > max_edge or media_type not in PASSTHROUGH_TYPES:
+        raise ImportError("Pillow is needed to resize this image")
+
+    data = await asyncio.to_thread(_read_file, fpath)
+    if len(data) > max_bytes:
+        raise ImportError("Pillow is needed to re-encode this image")
+    return ImageInput(data, media_type, width, height)
+
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """Created on first use, spawned like the worker processes so no event loop state is forked"""
+    global image_pool
+    if image_pool is None:
+        image_pool = ProcessPoolExecutor(VISION_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Started image pool with {VISION_PROCESS_WORKERS} processes")
+
+    return image_pool
+
+
+def shutdown_image_pool() -> None:
+    global image_pool
+    if image_pool is not None:
+        image_pool.shutdown(cancel_futures=True)
+        image_pool = None
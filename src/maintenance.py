@@ -0,0 +1,162 @@
+import time
+import asyncio
+import logging
+import functools
+
+from telegram.ext import ContextTypes, JobQueue
+
+from src.database import get_user_mgr
+from src.prompt_cache import get_prompt_cache
+from src.sketches import sketches
+from src.tenants import DEFAULT_TENANT, use_tenant
+from config import (
+    FREE_QUOTA_REFILL,
+    DB_OPTIMIZE_TIME,
+    WAL_CHECKPOINT_INTERVAL,
+    ROLLUP_REFRESH_INTERVAL,
+    PROMPT_CACHE_PRUNE_INTERVAL,
+    UPDATE_DEDUP,
+    UPDATE_DEDUP_PRUNE_INTERVAL,
+    SKETCH_FLUSH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Names of jobs currently executing, a job that is still running when it fires again is skipped
+running_jobs: set[str] = set()
+
+# Passed to APScheduler so a late job is coalesced instead of stacking up runs
+JOB_KWARGS: dict = {"max_instances": 1, "coalesce": True, "misfire_grace_time": 60}
+
+
+def maintenance_job(name: str):
+    """Run the blocking job body in a worker thread with overlap protection and run-time logging.
+
+    The body sees the database of the tenant whose Application scheduled the job.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(context: ContextTypes.DEFAULT_TYPE) -> None:
+            tenant = context.bot_data.get("tenant")
+            job_name = name if tenant is None or tenant.name == DEFAULT_TENANT else f"{name}[{tenant.name}]"
+            if job_name in running_jobs:
+                logger.warning(f"Maintenance job {job_name} is still running, skipping this run")
+                return
+
+            running_jobs.add(job_name)
+            start_time = time.perf_counter()
+            try:
+                with use_tenant(tenant):
+                    result = await asyncio.to_thread(func, context.job.data)
+                logger.info(
+                    f"Maintenance job {job_name} finished in {time.perf_counter() - start_time:.2f}s: {result}"
+                )
+
+            except Exception as e:
+                logger.error(f"Maintenance job {job_name} failed after {time.perf_counter() - start_time:.2f}s: {e}")
+
+            finally:
+                running_jobs.discard(job_name)
+
+        return wrapper
+
+    return decorator
+
+
+@maintenance_job("free_quota_refill")
+def refill_free_quota(amount: int) -> str:
+    updated = get_user_mgr().refill_free_quota(amount)
+    return f"{updated} free users topped up to {amount}"
+
+
+@maintenance_job("db_optimize")
+def optimize_db(data) -> str:
+    return "ok" if get_user_mgr().optimize_db() else "failed"
+
+
+@maintenance_job("wal_checkpoint")
+def checkpoint_wal(data) -> str:
+    result = get_user_mgr().checkpoint_wal()
+    if result is None:
+        return "failed"
+
+    busy, wal_pages, checkpointed = result
+    return f"busy={busy} wal_pages={wal_pages} checkpointed={checkpointed}"
+
+
+@maintenance_job("rollup_refresh")
+def refresh_rollups(data) -> str:
+    return "ok" if get_user_mgr().refresh_rollups() else "failed"
+
+
+@maintenance_job("prompt_cache_prune")
+def prune_prompt_cache(data) -> str:
+    prompt_cache = get_prompt_cache()
+    removed = prompt_cache.prune()
+    deleted = get_user_mgr().prune_cached_prompts(time.time() - prompt_cache.ttl_seconds)
+    return f"{removed} in memory, {deleted} rows deleted"
+
+
+@maintenance_job("processed_updates_prune")
+def prune_processed_updates(data) -> str:
+    deleted = get_user_mgr().prune_processed_updates(time.time() - UPDATE_DEDUP["window_hours"] * 3600)
+    return f"{deleted} rows deleted"
+
+
+@maintenance_job("sketch_flush")
+def flush_sketches(data) -> str:
+    return f"{sketches.flush(get_user_mgr(shared=True))} sketches merged"
+
+
+def schedule_maintenance_jobs(
+    job_queue: JobQueue | None, refill_amount: int = FREE_QUOTA_REFILL["amount"], shared: bool = True
+) -> None:
+    """Database upkeep for the job queue's tenant, `shared` adds the jobs that run once per process"""
+    if job_queue is None:
+        logger.warning("JobQueue unavailable (install python-telegram-bot[job-queue]), maintenance jobs disabled")
+        return
+
+    schedule = FREE_QUOTA_REFILL.get("schedule")
+    if schedule == "monthly":
+        job_queue.run_monthly(
+            refill_free_quota,
+            when=FREE_QUOTA_REFILL["time"],
+            day=FREE_QUOTA_REFILL["day"],
+            data=refill_amount,
+            name="free_quota_refill",
+            job_kwargs=JOB_KWARGS,
+        )
+    elif schedule == "weekly":
+        job_queue.run_daily(
+            refill_free_quota,
+            time=FREE_QUOTA_REFILL["time"],
+            days=(FREE_QUOTA_REFILL["day"],),
+            data=refill_amount,
+            name="free_quota_refill",
+            job_kwargs=JOB_KWARGS,
+        )
+
+    job_queue.run_daily(optimize_db, time=DB_OPTIMIZE_TIME, name="db_optimize", job_kwargs=JOB_KWARGS)
+    job_queue.run_repeating(
+        checkpoint_wal, interval=WAL_CHECKPOINT_INTERVAL, name="wal_checkpoint", job_kwargs=JOB_KWARGS
+    )
+    job_queue.run_repeating(
+        refresh_rollups, interval=ROLLUP_REFRESH_INTERVAL, first=10, name="rollup_refresh", job_kwargs=JOB_KWARGS
+    )
+    job_queue.run_repeating(
+        prune_prompt_cache, interval=PROMPT_CACHE_PRUNE_INTERVAL, name="prompt_cache_prune", job_kwargs=JOB_KWARGS
+    )
+    job_queue.run_repeating(
+        prune_processed_updates,
+        interval=UPDATE_DEDUP_PRUNE_INTERVAL,
+        name="processed_updates_prune",
+        job_kwargs=JOB_KWARGS,
+    )
+    if shared:
+        # Sketches are per provider/model, not per bot, they all go to the default database
+        job_queue.run_repeating(
+            flush_sketches, interval=SKETCH_FLUSH_INTERVAL, name="sketch_flush", job_kwargs=JOB_KWARGS
+        )
+
+    logger.info(f"Scheduled maintenance jobs: {[job.name for job in job_queue.jobs()]}")
@@ -0,0 +1,95 @@
+import logging
+
+from contextvars import ContextVar
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from src.callbacks import pack
+from config import MODEL_CHOICES
+
+logger = logging.getLogger(__name__)
+
+BACK_TO_MAIN = InlineKeyboardButton("◀️ Back to Main Menu", callback_data=pack("mm"))
+SELECT_MODEL_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("Select Model", callback_data=pack("mm"))]])
+
+
+class ModelMenus:
+    """Keyboards derived from MODEL_CHOICES, rebuilt as a whole on startup and on every catalog reload.
+
+    Buttons carry provider/model indices plus the generation they were built for, so a button from
+    before a reload is recognised as outdated instead of selecting whatever now sits at that index.
+    """
+
+    def __init__(self) -> None:
+        self.generation = 0
+        self.providers: list[str] = []
+        self.models: list[list[dict]] = []
+        self.main_markup: InlineKeyboardMarkup = InlineKeyboardMarkup([])
+        self.provider_markups: list[InlineKeyboardMarkup] = []
+        # Flat (provider, model) list for compare mode, with the unticked / ticked button of each entry
+        self.flat: list[tuple[str, dict]] = []
+        self.compare_buttons: list[tuple[InlineKeyboardButton, InlineKeyboardButton]] = []
+
+    def build(self, model_choices: dict[str, list[dict]]) -> None:
+        generation = self.generation + 1
+        providers = list(model_choices)
+        models = [list(model_choices[provider]) for provider in providers]
+
+        main_rows = [[InlineKeyboardButton(p, callback_data=pack("p", generation, i))] for i, p in enumerate(providers)]
+        main_rows.append([InlineKeyboardButton("⚖️ Compare Models", callback_data=pack("c"))])
+        main_rows.append([InlineKeyboardButton("Surprise Me!", callback_data=pack("r"))])
+
+        provider_markups = []
+        for p_idx, provider_models in enumerate(models):
+            rows = [
+                [InlineKeyboardButton(model["name"], callback_data=pack("m", generation, p_idx, m_idx))]
+                for m_idx, model in enumerate(provider_models)
+            ]
+            rows.append([BACK_TO_MAIN])
+            provider_markups.append(InlineKeyboardMarkup(rows))
+
+        flat = [(provider, model) for provider, provider_models in zip(providers, models) for model in provider_models]
+        compare_buttons = [
+            (
+                InlineKeyboardButton(f"{provider} - {model['name']}", callback_data=pack("ct", generation, idx)),
+                InlineKeyboardButton(f"✅ {provider} - {model['name']}", callback_data=pack("ct", generation, idx)),
+            )
+            for idx, (provider, model) in enumerate(flat)
+        ]
+
+        # Swap everything in one go so a tap never sees half of a rebuild
+        self.providers, self.models, self.flat, self.compare_buttons = providers, models, flat, compare_buttons
+        self.main_markup = InlineKeyboardMarkup(main_rows)
+        self.provider_markups = provider_markups
+        self.generation = generation
+
+        logger.info(f"Built model menus (generation {generation}, {len(flat)} models)")
+
+    def provider(self, generation: int, p_idx: int) -> int | None:
+        if generation != self.generation or not 0 <= p_idx < len(self.providers):
+            return None
+        return p_idx
+
+    def model(self, generation: int, p_idx: int, m_idx: int) -> tuple[str, dict] | None:
+        if self.provider(generation, p_idx) is None or not 0 <= m_idx < len(self.models[p_idx]):
+            return None
+        return self.providers[p_idx], self.models[p_idx][m_idx]
+
+    def flat_model(self, generation: int, idx: int) -> tuple[str, dict] | None:
+        if generation != self.generation or not 0 <= idx < len(self.flat):
+            return None
+        return self.flat[idx]
+
+
+menus = ModelMenus()
+
+# Set per update in multi-tenant mode (src/tenants.py), unset means the full catalog above
+current_menus: ContextVar[ModelMenus | None] = ContextVar("current_menus", default=None)
+
+
+def get_menus() -> ModelMenus:
+    return current_menus.get() or menus
+
+
+def build_menus() -> None:
+    """Catalog reload hook"""
+    menus.build(MODEL_CHOICES)
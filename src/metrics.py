@@ -0,0 +1,224 @@
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind: str = ""
+
+    def __init__(self, name: str, description: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+        registry.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, description: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+        # key -> [bucket counts..., sum, count]
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+registry: list[Metric] = []
+
+LLM_LATENCY = Histogram("llm_request_seconds", "Latency of AllModels.query_model", ("provider", "model"))
+DB_LATENCY = Histogram("db_method_seconds", "Duration of UserManager methods", ("method",))
+HANDLER_LATENCY = Histogram("handler_seconds", "Duration of Telegram update handlers", ("handler",))
+
+ERRORS = Counter("errors_total", "Errors by source", ("source", "name"))
+TOKENS = Counter("llm_tokens_total", "Estimated tokens processed", ("provider", "model", "direction"))
+COST = Counter("llm_cost_usd_total", "Estimated API cost in USD", ("provider", "model"))
+
+IN_FLIGHT = Gauge("in_flight_requests", "Requests currently being processed", ("kind",))
+
+# Flipped by the bot once the Application is initialised, reported by /healthz
+ready: bool = False
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed_handler(name: str):
+    """Record duration, in-flight count and unhandled errors of a Telegram handler"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with IN_FLIGHT.track_inprogress(kind="handler"), HANDLER_LATENCY.time(handler=name):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    ERRORS.inc(source="handler", name=name)
+                    raise
+
+        return wrapper
+
+    return decorator
+
+
+def instrument_methods(cls, histogram: Histogram = DB_LATENCY):
+    """Wrap every public method of the class (generators excluded) with a duration histogram"""
+    for attr_name, attr in list(vars(cls).items()):
+        if attr_name.startswith("_") or not inspect.isfunction(attr) or inspect.isgeneratorfunction(attr):
+            continue
+
+        def make_wrapper(method, method_name):
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                with histogram.time(method=method_name):
+                    return method(*args, **kwargs)
+
+            return wrapper
+
+        setattr(cls, attr_name, make_wrapper(attr, attr_name))
+
+    return cls
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain headers, the body is never used
+        while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?")[0] if len(parts) > 1 else ""
+
+        if path == "/metrics":
+            status, body = "200 OK", render_metrics()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/healthz":
+            status, body = ("200 OK", "ok\n") if ready else ("503 Service Unavailable", "not ready\n")
+            content_type = "text/plain; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", "not found\n", "text/plain; charset=utf-8"
+
+        payload = body.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+
+    except Exception as e:
+        logger.debug(f"Metrics request failed: {e}")
+
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.Server:
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
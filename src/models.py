@@ -1,27 +1,109 @@
+import os
+import json
+import math
+import time
+import asyncio
 import requests
 import logging
 from abc import ABC
 
-from config import MAX_TOKENS
+from src.metrics import LLM_LATENCY, IN_FLIGHT, ERRORS
+from src.sketches import sketches
+from src.images import ImageInput
+from config import (
+    MAX_TOKENS,
+    MODEL_CHOICES,
+    MODEL_PRICING,
+    PROVIDER_CONCURRENCY,
+    PROVIDER_REQUEST_TIMEOUT,
+    LONG_RUNNING_REQUEST_TIMEOUT,
+    SYSTEM_PROMPT,
+)
 
 logger = logging.getLogger(__name__)
+llm_models = None
+
+# Prefixes of the messages returned instead of an answer when a query fails
+ERROR_PREFIXES: tuple[str, ...] = ("Error communicating with", "Model not found")
+
+
+def is_error_response(text: str | None) -> bool:
+    return not text or text.startswith(ERROR_PREFIXES)
+
+
+class Usage:
+    """Token counts reported by the provider, input_tokens includes the cached and cache-written ones"""
+
+    def __init__(self, input_tokens: int, output_tokens: int, cached_tokens: int = 0, cache_write_tokens: int = 0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+        self.cache_write_tokens = cache_write_tokens
+
+
+class ModelResponse(str):
+    """Answer text carrying the provider's token usage, a plain str to everything else"""
+
+    def __new__(cls, text: str, usage: Usage | None = None) -> "ModelResponse":
+        response = super().__new__(cls, text)
+        response.usage = usage
+        return response
+
+
+def response_usage(text: str | None) -> Usage | None:
+    return getattr(text, "usage", None)
+
+
+def _openai_messages(content) -> list[dict]:
+    # System prompt first and byte-identical every time, so the prefix can be served from the provider's cache
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] if SYSTEM_PROMPT else []
+    messages.append({"role": "user", "content": content})
+    return messages
+
+
+def _openai_usage(response_json: dict) -> Usage | None:
+    """Usage of OpenAI compatible APIs (OpenAI reports cached tokens in details, DeepSeek as cache hits)"""
+    usage = response_json.get("usage")
+    if not usage:
+        return None
+
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+    return Usage(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), cached_tokens)
 
 
 class BaseModelLLM(ABC):
-    def __init__(self, api_key: str, model_id: str, model_name: str) -> None:
+    # Longest edge (pixels) and encoded size images are brought down to, None if the API takes no images
+    image_max_edge: int | None = None
+    image_max_bytes: int = 5 * 1024 * 1024
+
+    def __init__(
+        self, api_key: str, model_id: str, model_name: str, request_timeout: float = PROVIDER_REQUEST_TIMEOUT
+    ) -> None:
         self.api_key = api_key
         self.model_id = model_id
         self.model_name = model_name
+        self.request_timeout = request_timeout
 
-    async def query(self, message: str) -> str | None:
+    async def query(self, message: str, images: list[ImageInput] | None = None) -> str | None:
         raise NotImplementedError("Every model should have their own query functions")
 
+    def image_tokens(self, width: int, height: int) -> int:
+        """Input tokens the provider bills for an image of this size"""
+        return 0
+
 
 class ClaudeModel(BaseModelLLM):
-    def __init__(self, api_key: str, model_id: str, model_name: str) -> None:
-        super().__init__(api_key, model_id, model_name)
+    # Larger images are downscaled by the API anyway, at the same token cost
+    image_max_edge = 1568
+    image_max_bytes = 5 * 1024 * 1024
 
-    async def query(self, message: str) -> str | None:
+    def __init__(
+        self, api_key: str, model_id: str, model_name: str, request_timeout: float = PROVIDER_REQUEST_TIMEOUT
+    ) -> None:
+        super().__init__(api_key, model_id, model_name, request_timeout)
+
+    async def query(self, message: str, images: list[ImageInput] | None = None) -> str | None:
         try:
             headers = {
                 "x-api-key": self.api_key,
@@ -29,24 +111,62 @@ class ClaudeModel(BaseModelLLM):
                 "anthropic-version": "2023-06-01",
             }
 
+            content = message
+            if images:
+                content = [
+                    {
+                        "type": "image",
+                        "source": {"type": "base64", "media_type": image.media_type, "data": image.base64()},
+                    }
+                    for image in images
+                ]
+                content.append({"type": "text", "text": message})
+
             data = {
                 "model": self.model_id,
                 "max_tokens": MAX_TOKENS,
-                "messages": [{"role": "user", "content": message}],
+                "messages": [{"role": "user", "content": content}],
             }
-
-            response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data)
+            if SYSTEM_PROMPT:
+                # Cache breakpoint after the system prompt (ignored by the API below its minimum cacheable length)
+                data["system"] = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+            response = await asyncio.to_thread(
+                requests.post,
+                "https://api.anthropic.com/v1/messages",
+                headers=headers,
+                json=data,
+                timeout=self.request_timeout,
+            )
 
             response_json = response.json()
-            return response_json["content"][0]["text"]
+            return ModelResponse(response_json["content"][0]["text"], self._usage(response_json))
         except Exception as e:
             logger.error(f"Error querying Claude API: {e}")
+            ERRORS.inc(source="provider", name=self.model_id)
             return f"Error communicating with Claude: {str(e)}"
 
+    @staticmethod
+    def _usage(response_json: dict) -> Usage | None:
+        usage = response_json.get("usage")
+        if not usage:
+            return None
+
+        # input_tokens only counts what came after the last cache breakpoint
+        cached_tokens = usage.get("cache_read_input_tokens") or 0
+        cache_write_tokens = usage.get("cache_creation_input_tokens") or 0
+        input_tokens = usage.get("input_tokens", 0) + cached_tokens + cache_write_tokens
+        return Usage(input_tokens, usage.get("output_tokens", 0), cached_tokens, cache_write_tokens)
+
+    def image_tokens(self, width: int, height: int) -> int:
+        return math.ceil(width * height / 750)
+
 
 class DeepseekModel(BaseModelLLM):
-    def __init__(self, api_key: str, model_id: str, model_name: str) -> None:
-        super().__init__(api_key, model_id, model_name)
+    def __init__(
+        self, api_key: str, model_id: str, model_name: str, request_timeout: float = PROVIDER_REQUEST_TIMEOUT
+    ) -> None:
+        super().__init__(api_key, model_id, model_name, request_timeout)
 
     async def query(self, message: str) -> str | None:
         try:
@@ -54,45 +174,85 @@ class DeepseekModel(BaseModelLLM):
 
             data = {
                 "model": self.model_id,
-                "messages": [{"role": "user", "content": message}],
+                "messages": _openai_messages(message),
                 "max_tokens": MAX_TOKENS,
             }
 
-            response = requests.post("https://api.deepseek.com/v1/chat/completions", headers=headers, json=data)
+            response = await asyncio.to_thread(
+                requests.post,
+                "https://api.deepseek.com/v1/chat/completions",
+                headers=headers,
+                json=data,
+                timeout=self.request_timeout,
+            )
 
             response_json = response.json()
-            return response_json["choices"][0]["message"]["content"]
+            return ModelResponse(response_json["choices"][0]["message"]["content"], _openai_usage(response_json))
         except Exception as e:
             logging.error(f"Error querying DeepSeek API: {e}")
+            ERRORS.inc(source="provider", name=self.model_id)
             return f"Error communicating with DeepSeek: {str(e)}"
 
 
 class ChatGPTModel(BaseModelLLM):
-    def __init__(self, api_key: str, model_id: str, model_name: str) -> None:
-        super().__init__(api_key, model_id, model_name)
+    image_max_edge = 2048
+    image_max_bytes = 20 * 1024 * 1024
 
-    async def query(self, message: str) -> str | None:
+    def __init__(
+        self, api_key: str, model_id: str, model_name: str, request_timeout: float = PROVIDER_REQUEST_TIMEOUT
+    ) -> None:
+        super().__init__(api_key, model_id, model_name, request_timeout)
+
+    async def query(self, message: str, images: list[ImageInput] | None = None) -> str | None:
         try:
             headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
 
+            content = message
+            if images:
+                content = [{"type": "text", "text": message}]
+                content.extend(
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{image.media_type};base64,{image.base64()}", "detail": "high"},
+                    }
+                    for image in images
+                )
+
             data = {
                 "model": self.model_id,
                 "max_tokens": MAX_TOKENS,
-                "messages": [{"role": "user", "content": message}],
+                "messages": _openai_messages(content),
             }
 
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data)
+            response = await asyncio.to_thread(
+                requests.post,
+                "https://api.openai.com/v1/chat/completions",
+                headers=headers,
+                json=data,
+                timeout=self.request_timeout,
+            )
 
             response_json = response.json()
-            return response_json["choices"][0]["message"]["content"]
+            return ModelResponse(response_json["choices"][0]["message"]["content"], _openai_usage(response_json))
         except Exception as e:
             logging.error(f"Error querying OpenAI API: {e}")
+            ERRORS.inc(source="provider", name=self.model_id)
             return f"Error communicating with ChatGPT: {str(e)}"
 
+    def image_tokens(self, width: int, height: int) -> int:
+        # High detail: fit in 2048x2048, shortest side down to 768, then 170 tokens per 512px tile plus 85
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+        return 85 + 170 * tiles
+
 
 class PerplexityModel(BaseModelLLM):
-    def __init__(self, api_key: str, model_id: str, model_name: str) -> None:
-        super().__init__(api_key, model_id, model_name)
+    def __init__(
+        self, api_key: str, model_id: str, model_name: str, request_timeout: float = PROVIDER_REQUEST_TIMEOUT
+    ) -> None:
+        super().__init__(api_key, model_id, model_name, request_timeout)
 
     async def query(self, message: str) -> str | None:
         try:
@@ -101,59 +261,111 @@ class PerplexityModel(BaseModelLLM):
             data = {
                 "model": self.model_id,
                 "max_tokens": MAX_TOKENS,
-                "messages": [{"role": "user", "content": message}],
+                "messages": _openai_messages(message),
             }
 
-            response = requests.post("https://api.perplexity.ai/chat/completions", headers=headers, json=data)
+            response = await asyncio.to_thread(
+                requests.post,
+                "https://api.perplexity.ai/chat/completions",
+                headers=headers,
+                json=data,
+                timeout=self.request_timeout,
+            )
 
             response_json = response.json()
-            return response_json["choices"][0]["message"]["content"]
+            return ModelResponse(response_json["choices"][0]["message"]["content"], _openai_usage(response_json))
         except Exception as e:
             logging.error(f"Error querying Perplexity API: {e}")
+            ERRORS.inc(source="provider", name=self.model_id)
             return f"Error communicating with Perplexity: {str(e)}"
 
 
+PROVIDER_CLASSES: dict[str, type[BaseModelLLM]] = {
+    "ClaudeModel": ClaudeModel,
+    "DeepseekModel": DeepseekModel,
+    "ChatGPTModel": ChatGPTModel,
+    "PerplexityModel": PerplexityModel,
+}
+
+
 class AllModels:
-    def __init__(self, api_keys: dict[str, str], given_models: dict[str, list[dict[str, str]]]) -> None:
-        self.api_keys: dict[str, str] = api_keys
-        self.given_models: dict[str, list[dict[str, str]]] = given_models
+    """Registry of the providers declared in the model catalog, model clients are built on first use"""
+
+    def __init__(self, catalog_fpath: str) -> None:
+        self.catalog_fpath: str = catalog_fpath
+        self.catalog_mtime: float | None = None
+        self.providers: dict[str, dict] = {}
         self.reg_models: dict[str, BaseModelLLM] = {}
+        self.reload_hooks: list = []
+        # Caps concurrent calls per provider across all handlers (compare, documents, chat)
+        self.semaphores: dict[str, asyncio.Semaphore] = {}
 
-        self._init_models()
+        if not self.load_catalog():
+            raise RuntimeError(f"Unable to load model catalog {catalog_fpath}")
 
-    def _init_models(self):
-        claude_models = [
-            ClaudeModel(self.api_keys["Claude"], sub_model["id"], sub_model["name"])
-            for sub_model in self.given_models["Claude"]
-        ]
+    def load_catalog(self) -> bool:
+        """(Re)load the catalog, on any error the previous catalog stays active"""
+        try:
+            mtime = os.path.getmtime(self.catalog_fpath)
+            with open(self.catalog_fpath, "r") as file:
+                catalog = json.load(file)
+
+            providers: dict[str, dict] = {}
+            choices: dict[str, list[dict]] = {}
+            pricing: dict[str, dict[str, float]] = {}
+
+            for provider, spec in catalog["providers"].items():
+                model_cls = PROVIDER_CLASSES.get(spec["class"])
+                if model_cls is None:
+                    logger.error(f"Unknown provider class {spec['class']} for {provider}, skipping")
+                    continue
+
+                api_key = os.getenv(spec["api_key_env"])
+                if not api_key:
+                    logger.warning(f"No API key in {spec['api_key_env']}, skipping provider {provider}")
+                    continue
+
+                models = {model["id"]: model for model in spec["models"]}
+                providers[provider] = {"class": model_cls, "api_key": api_key, "models": models}
+                choices[provider] = [{k: v for k, v in model.items() if k != "pricing"} for model in spec["models"]]
+                pricing.update({model["id"]: model["pricing"] for model in spec["models"]})
+
+        except Exception as e:
+            logger.error(f"Error loading model catalog {self.catalog_fpath}: {e}")
+            return False
 
-        deepseek_models = [
-            DeepseekModel(self.api_keys["Deepseek"], sub_model["id"], sub_model["name"])
-            for sub_model in self.given_models["Deepseek"]
-        ]
+        # Swap in the new catalog, requests already holding a model client keep using it
+        self.providers = providers
+        self.reg_models = {}
+        self.catalog_mtime = mtime
 
-        chatGPT_models = [
-            ChatGPTModel(self.api_keys["ChatGPT"], sub_model["id"], sub_model["name"])
-            for sub_model in self.given_models["ChatGPT"]
-        ]
+        MODEL_CHOICES.clear()
+        MODEL_CHOICES.update(choices)
+        MODEL_PRICING.clear()
+        MODEL_PRICING.update(pricing)
 
-        perplexity_models: list[PerplexityModel] = [
-            PerplexityModel(self.api_keys["Perplexity"], sub_model["id"], sub_model["name"])
-            for sub_model in self.given_models["Perplexity"]
-        ]
+        for hook in self.reload_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Error running catalog reload hook {hook}: {e}")
 
-        # Register all models
-        for model in claude_models:
-            self.register_model("Claude", model)
+        logger.info(f"Loaded model catalog: {', '.join(f'{p} ({len(m)})' for p, m in choices.items())}")
+        return True
 
-        for model in deepseek_models:
-            self.register_model("Deepseek", model)
+    def reload_if_changed(self) -> bool:
+        try:
+            if os.path.getmtime(self.catalog_fpath) == self.catalog_mtime:
+                return False
+
+        except OSError as e:
+            logger.error(f"Unable to stat model catalog: {e}")
+            return False
 
-        for model in chatGPT_models:
-            self.register_model("ChatGPT", model)
+        return self.load_catalog()
 
-        for model in perplexity_models:
-            self.register_model("Perplexity", model)
+    def add_reload_hook(self, hook) -> None:
+        self.reload_hooks.append(hook)
 
     def register_model(self, provider: str, model: BaseModelLLM):
         model_key = f"{provider}_{model.model_id}"
@@ -161,11 +373,58 @@ class AllModels:
 
     def get_model(self, provider: str, model_id: str) -> BaseModelLLM | None:
         model_key = f"{provider}_{model_id}"
-        return self.reg_models.get(model_key)
-
-    async def query_model(self, provider: str, model_id: str, message: str) -> str | None:
+        model = self.reg_models.get(model_key)
+        if model is not None:
+            return model
+
+        spec = self.providers.get(provider)
+        if spec is None or model_id not in spec["models"]:
+            return None
+
+        model_spec = spec["models"][model_id]
+        request_timeout = LONG_RUNNING_REQUEST_TIMEOUT if model_spec.get("long_running") else PROVIDER_REQUEST_TIMEOUT
+        model = spec["class"](spec["api_key"], model_id, model_spec["name"], request_timeout)
+        self.register_model(provider, model)
+        return model
+
+    def get_semaphore(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self.semaphores.get(provider)
+        if semaphore is None:
+            limit = PROVIDER_CONCURRENCY.get(provider, PROVIDER_CONCURRENCY["default"])
+            semaphore = self.semaphores[provider] = asyncio.Semaphore(limit)
+        return semaphore
+
+    async def query_model(
+        self, provider: str, model_id: str, message: str, images: list[ImageInput] | None = None
+    ) -> str | None:
         model = self.get_model(provider, model_id)
         if model:
-            return await model.query(message)
+            async with self.get_semaphore(provider):
+                with IN_FLIGHT.track_inprogress(kind="llm"), LLM_LATENCY.time(provider=provider, model=model_id):
+                    start_time = time.perf_counter()
+                    # Only models with image_max_edge take images, the others keep their text-only signature
+                    response = await (model.query(message, images) if images else model.query(message))
+                    elapsed = time.perf_counter() - start_time
+
+            # Failures come back as error text, keep them out of the latency distribution
+            if not is_error_response(response):
+                sketches.observe(provider, model_id, "latency", elapsed)
+            return response
         else:
             return "Model not found. Please select a valid model."
+
+
+# Global Function to initalise AllModels
+def init_llm_models(catalog_fpath: str) -> AllModels:
+    global llm_models
+    if llm_models is None:
+        llm_models = AllModels(catalog_fpath)
+        logger.info("Initalised AllModels")
+
+    return llm_models
+
+
+def get_llm_models() -> AllModels:
+    if llm_models is None:
+        raise RuntimeError("AllModels is not initialised")
+    return llm_models
@@ -0,0 +1,207 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+
+from collections import OrderedDict
+
+from src.metrics import Counter
+
+logger = logging.getLogger(__name__)
+prompt_cache = None
+
+FINGERPRINT_BITS = 64
+
+CACHE_LOOKUPS = Counter("prompt_cache_lookups_total", "Near-duplicate prompt cache lookups", ("model", "result"))
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivial edits map to the same text"""
+    return " ".join(re.sub(r"[^\w\s]+", " ", text.lower()).split())
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(normalized: str) -> int:
+    """64-bit SimHash over word unigrams and bigrams"""
+    words = normalized.split()
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    weights = [0] * FINGERPRINT_BITS
+    for feature in features:
+        value = _feature_hash(feature)
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def to_signed(fingerprint: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+
+def to_unsigned(fingerprint: int) -> int:
+    return fingerprint + (1 << 64) if fingerprint < 0 else fingerprint
+
+
+class NearDupCache:
+    """Per-model SimHash index with LSH banding.
+
+    With max_hamming = k the fingerprint is split into k + 1 bands, so by pigeonhole any fingerprint
+    within distance k shares at least one band exactly and only those buckets need to be checked.
+    """
+
+    def __init__(
+        self,
+        models: list[str],
+        max_hamming: int = 3,
+        min_words: int = 4,
+        ttl_hours: float = 24,
+        max_entries_per_model: int = 5000,
+    ) -> None:
+        self.models: set[str] = set(models)
+        self.max_hamming = max_hamming
+        self.min_words = min_words
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries_per_model
+
+        self.num_bands = max_hamming + 1
+        self.band_bits = FINGERPRINT_BITS // self.num_bands
+        self.band_mask = (1 << self.band_bits) - 1
+
+        # model_id -> OrderedDict[fingerprint, (response, created_at)] in insertion order for FIFO eviction
+        self.entries: dict[str, OrderedDict] = {}
+        # model_id -> {(band index, band value): set of fingerprints}
+        self.buckets: dict[str, dict[tuple[int, int], set[int]]] = {}
+        self._lock = threading.Lock()
+
+    def enabled_for(self, model_id: str) -> bool:
+        return model_id in self.models
+
+    def _bands(self, fingerprint: int) -> list[tuple[int, int]]:
+        return [(i, fingerprint >> (i * self.band_bits) & self.band_mask) for i in range(self.num_bands)]
+
+    def _fingerprint(self, prompt: str) -> int | None:
+        normalized = normalize_prompt(prompt)
+        if len(normalized.split()) < self.min_words:
+            # Short prompts flip too many bits per word to compare safely
+            return None
+        return simhash(normalized)
+
+    def _remove(self, model_id: str, fingerprint: int) -> None:
+        self.entries[model_id].pop(fingerprint, None)
+        buckets = self.buckets[model_id]
+        for band in self._bands(fingerprint):
+            bucket = buckets.get(band)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del buckets[band]
+
+    def _insert(self, model_id: str, fingerprint: int, response: str, created_at: float) -> None:
+        entries = self.entries.setdefault(model_id, OrderedDict())
+        buckets = self.buckets.setdefault(model_id, {})
+
+        if fingerprint in entries:
+            self._remove(model_id, fingerprint)
+
+        entries[fingerprint] = (response, created_at)
+        for band in self._bands(fingerprint):
+            buckets.setdefault(band, set()).add(fingerprint)
+
+        while len(entries) > self.max_entries:
+            self._remove(model_id, next(iter(entries)))
+
+    def lookup(self, model_id: str, prompt: str) -> str | None:
+        if not self.enabled_for(model_id):
+            return None
+
+        fingerprint = self._fingerprint(prompt)
+        if fingerprint is None:
+            return None
+
+        now = time.time()
+        best, best_distance = None, self.max_hamming + 1
+
+        with self._lock:
+            entries = self.entries.get(model_id, {})
+            buckets = self.buckets.get(model_id, {})
+
+            candidates = set()
+            for band in self._bands(fingerprint):
+                candidates |= buckets.get(band, set())
+
+            for candidate in candidates:
+                response, created_at = entries[candidate]
+                if now - created_at > self.ttl_seconds:
+                    continue
+
+                distance = (candidate ^ fingerprint).bit_count()
+                if distance < best_distance:
+                    best, best_distance = response, distance
+
+        CACHE_LOOKUPS.inc(model=model_id, result="hit" if best is not None else "miss")
+        return best
+
+    def store(self, model_id: str, prompt: str, response: str) -> int | None:
+        """Index the answer, returns the fingerprint so the caller can persist it"""
+        if not self.enabled_for(model_id):
+            return None
+
+        fingerprint = self._fingerprint(prompt)
+        if fingerprint is None:
+            return None
+
+        with self._lock:
+            self._insert(model_id, fingerprint, response, time.time())
+        return fingerprint
+
+    def load(self, rows: list[dict]) -> None:
+        """Rows of (model_id, fingerprint, response, created_at epoch) from the persistent table, oldest first"""
+        with self._lock:
+            for row in rows:
+                if row["model_id"] in self.models:
+                    self._insert(row["model_id"], to_unsigned(row["fingerprint"]), row["response"], row["created_at"])
+
+        logger.info(f"Loaded {sum(len(e) for e in self.entries.values())} cached prompts")
+
+    def prune(self) -> int:
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        with self._lock:
+            for model_id, entries in self.entries.items():
+                expired = [fingerprint for fingerprint, (_, created_at) in entries.items() if created_at < cutoff]
+                for fingerprint in expired:
+                    self._remove(model_id, fingerprint)
+                removed += len(expired)
+        return removed
+
+
+# Global Function to initalise NearDupCache
+def init_prompt_cache(config: dict, rows: list[dict]) -> NearDupCache:
+    global prompt_cache
+    if prompt_cache is None:
+        prompt_cache = NearDupCache(
+            models=config["models"] if config["enabled"] else [],
+            max_hamming=config["max_hamming"],
+            min_words=config["min_words"],
+            ttl_hours=config["ttl_hours"],
+            max_entries_per_model=config["max_entries_per_model"],
+        )
+        prompt_cache.load(rows)
+
+    return prompt_cache
+
+
+def get_prompt_cache() -> NearDupCache:
+    if prompt_cache is None:
+        raise RuntimeError("NearDupCache is not initialised")
+    return prompt_cache
@@ -0,0 +1,190 @@
+import time
+import logging
+import threading
+
+from collections import deque
+
+from src.metrics import Counter, Histogram
+from config import DB_SLOW_QUERY_MS, DB_QUERY_SAMPLE_SIZE
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("slow_queries")
+
+QUERY_LATENCY = Histogram("db_query_seconds", "Duration of named SQL queries (execute and fetch)", ("query",))
+SLOW_QUERIES = Counter("db_slow_queries_total", "Named SQL queries above the slow query threshold", ("query",))
+
+# Statements EXPLAIN QUERY PLAN says something useful about
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+
+    rank = (len(sorted_values) - 1) * pct / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+def param_shape(params) -> str:
+    """Types (and lengths of strings) of the bound parameters, never their values"""
+    shapes = []
+    for param in params:
+        if isinstance(param, (str, bytes)):
+            shapes.append(f"{type(param).__name__}[{len(param)}]")
+        else:
+            shapes.append(type(param).__name__)
+    return f"({', '.join(shapes)})"
+
+
+class QueryStats:
+    def __init__(self, sample_size: int) -> None:
+        self.calls = 0
+        self.slow = 0
+        self.rows = 0
+        self.total = 0.0
+        self.max = 0.0
+        # Most recent durations, percentiles are computed over this window
+        self.samples: deque[float] = deque(maxlen=sample_size)
+
+
+class QueryProfiler:
+    """Call counts, latencies and row counts per named query, plus the slow query log.
+
+    Rows are the rows fetched for statements returning data and the affected rows otherwise.
+    """
+
+    def __init__(self, slow_query_ms: float, sample_size: int) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.sample_size = sample_size
+        self.stats: dict[str, QueryStats] = {}
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, elapsed: float, rows: int, conn, sql: str, params) -> None:
+        QUERY_LATENCY.observe(elapsed, query=name)
+        slow = self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms
+
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = QueryStats(self.sample_size)
+
+            stats.calls += 1
+            stats.rows += max(rows, 0)
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.samples.append(elapsed)
+            stats.slow += slow
+
+        if slow:
+            SLOW_QUERIES.inc(query=name)
+            slow_logger.warning(
+                f"Slow query {name}: {elapsed * 1000:.1f} ms, {rows} rows, params {param_shape(params)}"
+                f"\n{self._explain(conn, sql, params)}"
+            )
+
+    def _explain(self, conn, sql: str, params) -> str:
+        if not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return "  (no query plan)"
+
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except Exception as e:
+            return f"  (query plan unavailable: {e})"
+
+        # Rows are (id, parent, notused, detail), indent children under their parent
+        depth = {0: 0}
+        lines = []
+        for node_id, parent, _, detail in plan:
+            depth[node_id] = depth.get(parent, 0) + 1
+            lines.append(f"{'  ' * depth[node_id]}{detail}")
+        return "\n".join(lines)
+
+    def summary(self) -> list[dict]:
+        """Per query stats sorted by cumulative time, latencies in milliseconds"""
+        with self._lock:
+            snapshot = [(name, stats, sorted(stats.samples)) for name, stats in self.stats.items()]
+
+        result = [
+            {
+                "query": name,
+                "calls": stats.calls,
+                "slow": stats.slow,
+                "rows": stats.rows,
+                "total_ms": stats.total * 1000,
+                "avg_ms": stats.total * 1000 / stats.calls,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p90_ms": percentile(samples, 90) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "max_ms": stats.max * 1000,
+            }
+            for name, stats, samples in snapshot
+        ]
+        return sorted(result, key=lambda item: -item["total_ms"])
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats.clear()
+            self.started_at = time.time()
+
+
+class ProfiledCursor:
+    """sqlite3 cursor proxy timing the execute and every fetch of one named query.
+
+    The call is recorded once its result is consumed: right away for statements without a result set,
+    otherwise on fetchall, on fetchone (always single-row lookups here) or on the fetchmany that comes
+    back empty.
+    """
+
+    def __init__(self, profiler: QueryProfiler, name: str, cursor, sql: str, params, elapsed: float) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.cursor = cursor
+        self.sql = sql
+        self.params = params
+        self.elapsed = elapsed
+        self.rows = 0
+        self.recorded = False
+
+        if cursor.description is None:
+            self.rows = cursor.rowcount
+            self._record()
+
+    def _record(self) -> None:
+        if not self.recorded:
+            self.recorded = True
+            self.profiler.record(self.name, self.elapsed, self.rows, self.cursor.connection, self.sql, self.params)
+
+    def _timed(self, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.elapsed += time.perf_counter() - started
+
+    def fetchone(self):
+        row = self._timed(self.cursor.fetchone)
+        self.rows += row is not None
+        self._record()
+        return row
+
+    def fetchall(self) -> list:
+        rows = self._timed(self.cursor.fetchall)
+        self.rows += len(rows)
+        self._record()
+        return rows
+
+    def fetchmany(self, size: int) -> list:
+        rows = self._timed(self.cursor.fetchmany, size)
+        self.rows += len(rows)
+        if not rows:
+            self._record()
+        return rows
+
+    def __getattr__(self, attr: str):
+        return getattr(self.cursor, attr)
+
+
+profiler = QueryProfiler(DB_SLOW_QUERY_MS, DB_QUERY_SAMPLE_SIZE)
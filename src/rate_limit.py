@@ -0,0 +1,151 @@
+import math
+import time
+import logging
+
+from array import array
+
+from src.metrics import Counter
+
+logger = logging.getLogger(__name__)
+rate_limiter = None
+
+# Window name (the "per_<name>" key in config.RATE_LIMITS) -> length in seconds
+WINDOWS: dict[str, int] = {"minute": 60, "hour": 3600}
+
+# Counters per window, the window slides in steps of its length / BUCKETS
+BUCKETS = 12
+
+THROTTLED = Counter("rate_limited_total", "Messages refused by the per-user rate limit", ("tier", "window"))
+
+
+# Per user slot: for each window a ring of BUCKETS counters followed by the absolute number of its newest bucket,
+# then the time (whole seconds) until which the user was already told to wait
+WINDOW_STRIDE = BUCKETS + 1
+SLOT_STRIDE = len(WINDOWS) * WINDOW_STRIDE + 1
+EMPTY_SLOT = array("I", [0]) * SLOT_STRIDE
+EMPTY_WINDOW = array("I", [0]) * BUCKETS
+
+
+class RateLimiter:
+    """Per-user sliding-window message limits, checked in memory before any database or provider work.
+
+    Counters of all tracked users live in one flat array allocated up front (~110 bytes a user) with a dict from
+    user key to slot. Only max_users users are tracked, slots are reused with clock (second chance) eviction so
+    recently seen users stay, an evicted user starts with empty windows. A user's tier is the access level seen on
+    their previous message and is kept apart from the slots, users with no tier set count as free.
+    """
+
+    def __init__(self, limits: dict[str, dict], max_users: int) -> None:
+        self.limits = limits
+        self.max_users = max_users
+        self.counters = array("I", [0]) * (max_users * SLOT_STRIDE)
+        # user key -> slot and back
+        self.slots: dict = {}
+        self.keys: list = [None] * max_users
+        # Set when a slot's user is seen, the eviction hand clears set bits and takes the first clear one
+        self.referenced = bytearray(max_users)
+        self.hand = 0
+        # user key -> tier, only for users that aren't free
+        self.tiers: dict = {}
+
+    def _evict(self) -> int:
+        while self.referenced[self.hand]:
+            self.referenced[self.hand] = 0
+            self.hand = (self.hand + 1) % self.max_users
+
+        slot = self.hand
+        self.hand = (slot + 1) % self.max_users
+        del self.slots[self.keys[slot]]
+        return slot
+
+    def _slot(self, key) -> int:
+        """Offset of the user's counters"""
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._evict() if len(self.slots) >= self.max_users else len(self.slots)
+            self.slots[key] = slot
+            self.keys[slot] = key
+            self.counters[slot * SLOT_STRIDE : (slot + 1) * SLOT_STRIDE] = EMPTY_SLOT
+
+        self.referenced[slot] = 1
+        return slot * SLOT_STRIDE
+
+    def _advance(self, window: int, bucket: int) -> None:
+        head = self.counters[window + BUCKETS]
+        if bucket - head >= BUCKETS:
+            self.counters[window : window + BUCKETS] = EMPTY_WINDOW
+        else:
+            for i in range(head + 1, bucket + 1):
+                self.counters[window + i % BUCKETS] = 0
+        self.counters[window + BUCKETS] = max(head, bucket)
+
+    def _total(self, window: int, bucket: int) -> int:
+        self._advance(window, bucket)
+        return sum(self.counters[window : window + BUCKETS])
+
+    def _buckets_until_below(self, window: int, bucket: int, limit: int) -> int:
+        """How many buckets have to expire before the total drops under `limit`"""
+        running = self._total(window, bucket)
+        for age in range(BUCKETS):
+            running -= self.counters[window + (bucket + 1 + age) % BUCKETS]
+            if running < limit:
+                return age + 1
+        return BUCKETS
+
+    def check(self, key, now: float | None = None) -> float | None:
+        """Count a message, returns the seconds to wait instead if it is over a limit (it isn't counted then)"""
+        now = time.time() if now is None else now
+        offset = self._slot(key)
+        tier = self.tiers.get(key, "free")
+        limits = self.limits.get(tier, self.limits["free"])
+
+        buckets = {}
+        for i, (name, length) in enumerate(WINDOWS.items()):
+            limit = limits.get(f"per_{name}")
+            if limit is None:
+                continue
+
+            bucket_seconds = length / BUCKETS
+            bucket = int(now // bucket_seconds)
+            window = offset + i * WINDOW_STRIDE
+            if self._total(window, bucket) >= limit:
+                THROTTLED.inc(tier=tier, window=name)
+                waited = now % bucket_seconds
+                return self._buckets_until_below(window, bucket, limit) * bucket_seconds - waited
+            buckets[window] = bucket
+
+        for window, bucket in buckets.items():
+            self._advance(window, bucket)
+            self.counters[window + bucket % BUCKETS] += 1
+        return None
+
+    def should_notify(self, key, retry_after: float, now: float | None = None) -> bool:
+        """One cooldown reply per cooldown, messages sent meanwhile are dropped silently"""
+        now = time.time() if now is None else now
+        notified_until = self._slot(key) + SLOT_STRIDE - 1
+        if now < self.counters[notified_until]:
+            return False
+
+        self.counters[notified_until] = math.ceil(now + retry_after)
+        return True
+
+    def set_tier(self, key, access_level: str) -> None:
+        if access_level in self.limits and access_level != "free":
+            self.tiers[key] = access_level
+        else:
+            self.tiers.pop(key, None)
+
+
+# Global Function to initalise RateLimiter
+def init_rate_limiter(limits: dict[str, dict], max_users: int) -> RateLimiter:
+    global rate_limiter
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(limits, max_users)
+
+    return rate_limiter
+
+
+def get_rate_limiter() -> RateLimiter:
+    if rate_limiter is None:
+        raise RuntimeError("RateLimiter is not initialised")
+    return rate_limiter
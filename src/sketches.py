@@ -0,0 +1,180 @@
+import math
+import json
+import logging
+import threading
+
+from config import SKETCH_RELATIVE_ACCURACY, SKETCH_MAX_BINS
+
+logger = logging.getLogger(__name__)
+
+# Distributions kept per provider/model: seconds per provider call, output tokens and USD per answer
+SKETCH_METRICS: tuple[str, ...] = ("latency", "output_tokens", "cost")
+
+# Values below this are counted as zero instead of getting a bucket of their own
+MIN_INDEXABLE = 1e-9
+
+
+class DDSketch:
+    """Quantile sketch with relative error guarantees (DDSketch).
+
+    Values are counted in logarithmically sized buckets, so a quantile is within `relative_accuracy` of the
+    true value, the size doesn't grow with the number of values and two sketches merge by adding counts.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY, max_bins: int = SKETCH_MAX_BINS) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.bins: dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        if value < MIN_INDEXABLE:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("Can't merge sketches with different relative accuracy")
+
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _collapse(self) -> None:
+        """Fold the lowest buckets together, only the accuracy of the smallest values suffers"""
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_bins
+        folded = sum(self.bins.pop(key) for key in keys[:excess])
+        self.bins[keys[excess]] += folded
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+
+        running = self.zero_count
+        for key in sorted(self.bins):
+            running += self.bins[key]
+            if running > rank:
+                # Midpoint of the bucket (gamma^(key-1), gamma^key] in the relative sense
+                value = 2 * self.gamma**key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+
+        return self.max
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "relative_accuracy": self.relative_accuracy,
+                "bins": self.bins,
+                "zero_count": self.zero_count,
+                "count": self.count,
+                "sum": self.sum,
+                "min": self.min if self.count else None,
+                "max": self.max if self.count else None,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "DDSketch":
+        data = json.loads(text)
+        sketch = cls(data["relative_accuracy"])
+        sketch.bins = {int(key): count for key, count in data["bins"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        if data["count"]:
+            sketch.min, sketch.max = data["min"], data["max"]
+        return sketch
+
+
+class SketchStore:
+    """Sketches of the values observed by this process since its last flush.
+
+    Every process (bot and workers) flushes into the same metric_sketches rows, merging under a write lock,
+    so the persisted sketch covers all of them. Readers merge what is still pending on top.
+    """
+
+    def __init__(self) -> None:
+        # (provider, model_id, metric) -> sketch
+        self.pending: dict[tuple[str, str, str], DDSketch] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, provider: str, model_id: str, metric: str, value: float) -> None:
+        key = (provider.lower(), model_id.lower(), metric)
+        with self._lock:
+            sketch = self.pending.get(key)
+            if sketch is None:
+                sketch = self.pending[key] = DDSketch()
+            sketch.add(value)
+
+    def flush(self, user_mgr) -> int:
+        """Merge pending sketches into the database, returns how many were written"""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+
+        if not pending:
+            return 0
+
+        if not user_mgr.merge_sketches(pending):
+            # Keep them for the next flush, merged with whatever arrived meanwhile
+            with self._lock:
+                for key, sketch in pending.items():
+                    if key in self.pending:
+                        sketch.merge(self.pending[key])
+                    self.pending[key] = sketch
+            return 0
+
+        return len(pending)
+
+    def snapshot(self, user_mgr) -> dict[tuple[str, str], dict[str, DDSketch]]:
+        """(provider, model_id) -> metric -> sketch of everything recorded so far"""
+        result: dict[tuple[str, str], dict[str, DDSketch]] = {}
+        for row in user_mgr.load_sketches():
+            try:
+                sketch = DDSketch.from_json(row["sketch"])
+            except (ValueError, KeyError) as e:
+                logger.error(f"Skipping unreadable sketch {row['provider']}/{row['model_id']}/{row['metric']}: {e}")
+                continue
+            result.setdefault((row["provider"], row["model_id"]), {})[row["metric"]] = sketch
+
+        with self._lock:
+            pending = list(self.pending.items())
+
+        for (provider, model_id, metric), sketch in pending:
+            metrics = result.setdefault((provider, model_id), {})
+            # A stored sketch with another accuracy predates a config change and is replaced on the next flush
+            if metric not in metrics or metrics[metric].gamma != sketch.gamma:
+                metrics[metric] = DDSketch()
+            metrics[metric].merge(sketch)
+
+        return result
+
+
+sketches = SketchStore()
@@ -1,7 +1,13 @@
+import os
+import re
+import csv
+import asyncio
 import logging
+import tempfile
 
 from datetime import datetime
 from telegram import CallbackQuery, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     ContextTypes,
     ConversationHandler,
@@ -12,11 +18,22 @@ from telegram.ext import (
 )
 
 from src.database import get_user_mgr
+from src.query_profiler import profiler
+from src.sketches import sketches
+from src.metrics import timed_handler
+from src.callbacks import CallbackRouter, callback_pattern, pack
 
 logger = logging.getLogger(__name__)
 AWAITING_USER_ID = 1
 AWAITING_ACCESS_LEVEL = 2
 AWAITING_FREE_CREDITS = 3
+AWAITING_BULK_ACTION = 4
+AWAITING_BULK_CREDITS = 5
+AWAITING_BULK_TARGETS = 6
+
+BULK_INACTIVE_DAYS = 30
+BULK_MAX_FILE_SIZE = 1024 * 1024
+BULK_FILE_EXTENSIONS: tuple[str, ...] = (".txt", ".csv")
 
 
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -38,13 +55,6 @@ async def show_admin_dashboard(update: Update, context: ContextTypes.DEFAULT_TYP
     active_users = user_mgr.get_active_users(7)
     total_cost = user_mgr.get_total_cost()
 
-    keyboard = [
-        [InlineKeyboardButton("📊 Usage Statistics", callback_data="admin_stats")],
-        [InlineKeyboardButton("👥 User Management", callback_data="admin_users")],
-        [InlineKeyboardButton("🔎 Show Recent User", callback_data="admin_show_users")],
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
     dashboard_text = (
         "🔐 Admin Dashboard\n\n"
         f"Users: {user_counts['total']} total\n"
@@ -57,9 +67,9 @@ async def show_admin_dashboard(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
     if update.callback_query:
-        await update.callback_query.edit_message_text(dashboard_text, reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(dashboard_text, reply_markup=DASHBOARD_MARKUP)
     else:
-        await update.message.reply_text(dashboard_text, reply_markup=reply_markup)
+        await update.message.reply_text(dashboard_text, reply_markup=DASHBOARD_MARKUP)
 
 
 async def show_usage_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -86,6 +96,9 @@ async def show_usage_statistics(update: Update, context: ContextTypes.DEFAULT_TY
     # Format provider stats
     provider_text = "\n📱 Provider Usage:\n\n"
 
+    # Per model p50/p90/p99 from the persisted sketches, no scan of messages
+    model_sketches = sketches.snapshot(get_user_mgr(shared=True))
+
     for provider in provider_stats:
         avg_cost = provider["total_cost"] / provider["total_messages"] if provider["total_messages"] > 0 else 0
         provider_text += (
@@ -95,27 +108,147 @@ async def show_usage_statistics(update: Update, context: ContextTypes.DEFAULT_TY
             f"Avg: ${avg_cost:.4f}/msg\n"
         )
 
+        # Share of the prompt tokens the provider served from its prompt cache
+        if provider["reported_input_tokens"]:
+            hit_ratio = provider["cached_tokens"] / provider["reported_input_tokens"]
+            provider_text += (
+                f"  Prompt cache: {hit_ratio:.1%} of {provider['reported_input_tokens']:,} input tokens | "
+                f"{provider['cache_write_tokens']:,} written\n"
+            )
+
+        for (sketch_provider, model_id), metrics in sorted(model_sketches.items()):
+            if sketch_provider == provider["provider"]:
+                provider_text += _format_model_quantiles(model_id, metrics)
+
+    if model_sketches:
+        provider_text += "\n(per model: p50/p90/p99 latency | output tokens | cost per message)\n"
+
     # Create back button
-    keyboard = [[InlineKeyboardButton("◀️ Back to Dashboard", callback_data="admin_dashboard")]]
+    keyboard = [[BACK_TO_DASHBOARD]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await query.edit_message_text(f"{daily_text}\n{provider_text}", reply_markup=reply_markup)
 
 
-async def show_recent_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+def _format_model_quantiles(model_id: str, metrics: dict) -> str:
+    def quantiles(metric: str, fmt: str) -> str:
+        sketch = metrics.get(metric)
+        if sketch is None or sketch.count == 0:
+            return "-"
+        return "/".join(format(sketch.quantile(q), fmt) for q in (0.5, 0.9, 0.99))
+
+    return (
+        f"  ↳ {model_id}: {quantiles('latency', '.1f')}s | {quantiles('output_tokens', '.0f')} tok | "
+        f"${quantiles('cost', '.4f')}\n"
+    )
+
+
+async def show_query_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Named queries of this process ranked by cumulative time"""
+    summary = profiler.summary()
+    since = datetime.fromtimestamp(profiler.started_at).strftime("%Y-%m-%d %H:%M")
+    threshold = f"{profiler.slow_query_ms:g} ms" if profiler.slow_query_ms is not None else "off"
+
+    text = f"🐢 Query Profile (since {since}, slow threshold {threshold}):\n\n"
+    if not summary:
+        text += "No queries recorded yet\n"
+
+    for stats in summary[:PROFILE_TOP_QUERIES]:
+        slow_note = f", {stats['slow']} slow" if stats["slow"] else ""
+        text += (
+            f"• {stats['query']}: {stats['calls']} calls, {stats['total_ms'] / 1000:.2f}s total{slow_note}\n"
+            f"  p50 {stats['p50_ms']:.1f} | p90 {stats['p90_ms']:.1f} | p99 {stats['p99_ms']:.1f} | "
+            f"max {stats['max_ms']:.1f} ms | {stats['rows'] / stats['calls']:.1f} rows/call\n"
+        )
+
+    try:
+        await update.callback_query.edit_message_text(text, reply_markup=QUERY_PROFILE_MARKUP)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+
+USERS_PAGE_SIZE = 10
+PROFILE_TOP_QUERIES = 15
+USER_FILTERS: dict[str, str] = {"all": "All", "free": "Free", "premium": "Premium"}
+EXPORT_TABLES: tuple[str, ...] = ("users", "messages")
+
+# Static keyboards, built once at import
+BACK_TO_DASHBOARD = InlineKeyboardButton("◀️ Back to Dashboard", callback_data=pack("ad"))
+DASHBOARD_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("📊 Usage Statistics", callback_data=pack("as"))],
+        [InlineKeyboardButton("👥 User Management", callback_data=pack("au"))],
+        [InlineKeyboardButton("🔎 Show Recent User", callback_data=pack("ar"))],
+        [InlineKeyboardButton("🐢 Query Profile", callback_data=pack("aq"))],
+    ]
+)
+QUERY_PROFILE_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("🔄 Refresh", callback_data=pack("aq"))],
+        [InlineKeyboardButton("🧹 Reset", callback_data=pack("aqr"))],
+        [BACK_TO_DASHBOARD],
+    ]
+)
+USER_MANAGEMENT_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton("➕ Change User Role", callback_data=pack("acr"))],
+        [InlineKeyboardButton("⏱️ Add Free Credits", callback_data=pack("acc"))],
+        [InlineKeyboardButton("📦 Bulk Update", callback_data=pack("ab"))],
+        [BACK_TO_DASHBOARD],
+    ]
+)
+# Filter row of the user list for each selected filter, the selected one is marked
+FILTER_ROWS: dict[str, list[InlineKeyboardButton]] = {
+    selected: [
+        InlineKeyboardButton(f"• {label}" if key == selected else label, callback_data=pack("al", idx))
+        for idx, (key, label) in enumerate(USER_FILTERS.items())
+    ]
+    for selected in USER_FILTERS
+}
+EXPORT_ROW: list[InlineKeyboardButton] = [
+    InlineKeyboardButton("⬇️ Users CSV", callback_data=pack("ax", EXPORT_TABLES.index("users"))),
+    InlineKeyboardButton("⬇️ Messages CSV", callback_data=pack("ax", EXPORT_TABLES.index("messages"))),
+]
+
+
+async def show_recent_users(update: Update, context: ContextTypes.DEFAULT_TYPE, access_level: str = "all") -> None:
+    """Show the first page of users (most recently active first) for the given access filter"""
+    context.user_data["users_page"] = {"access_level": access_level, "first": None, "last": None}
+    await show_users_page(update, context, cursor=None, direction="next")
+
+
+async def show_users_page(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: tuple[str, int] | None, direction: str
+) -> None:
     query: CallbackQuery | None = update.callback_query
+    page_state = context.user_data.setdefault("users_page", {"access_level": "all", "first": None, "last": None})
+    access_level = page_state["access_level"]
 
     user_mgr = get_user_mgr()
-    users = user_mgr.list_users(limit=10)
 
-    if not users:
-        keyboard = [[InlineKeyboardButton("◀️ Back", callback_data="admin_dashboard")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    # Fetch one extra row to know whether there is another page in that direction
+    users = user_mgr.list_users_page(access_level, cursor, direction, limit=USERS_PAGE_SIZE + 1)
+    has_more = len(users) > USERS_PAGE_SIZE
+    if has_more:
+        users = users[1:] if direction == "prev" else users[:USERS_PAGE_SIZE]
+
+    filter_row = FILTER_ROWS[access_level]
+    export_row = EXPORT_ROW
+    back_row = [InlineKeyboardButton("◀️ Back", callback_data=pack("ad"))]
 
+    if not users:
+        reply_markup = InlineKeyboardMarkup([filter_row, export_row, back_row])
         await query.edit_message_text("No users found in the database.", reply_markup=reply_markup)
         return
 
-    user_text = "👥 Recent Users:\n\n"
+    page_state["first"] = (users[0]["last_active_at"], users[0]["user_id"])
+    page_state["last"] = (users[-1]["last_active_at"], users[-1]["user_id"])
+
+    has_prev = cursor is not None and (direction == "next" or has_more)
+    has_next = direction == "prev" or has_more
+
+    user_text = f"👥 Recent Users ({USER_FILTERS[access_level]}):\n\n"
 
     for user in users:
         last_active = datetime.fromisoformat(user["last_active_at"]).strftime("%Y-%m-%d")
@@ -129,12 +262,75 @@ async def show_recent_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
             f"Last active: {last_active}\n\n"
         )
 
-    keyboard = [[InlineKeyboardButton("◀️ Back", callback_data="admin_dashboard")]]
+    nav_row = []
+    if has_prev:
+        nav_row.append(InlineKeyboardButton("◀️ Prev", callback_data=pack("ap")))
+    if has_next:
+        nav_row.append(InlineKeyboardButton("Next ▶️", callback_data=pack("an")))
+
+    keyboard = [filter_row]
+    if nav_row:
+        keyboard.append(nav_row)
+    keyboard += [export_row, back_row]
+
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await query.edit_message_text(user_text, reply_markup=reply_markup)
 
 
+async def page_users(update: Update, context: ContextTypes.DEFAULT_TYPE, direction: str) -> None:
+    page_state = context.user_data.get("users_page")
+    if not page_state or page_state["first"] is None:
+        await show_recent_users(update, context)
+        return
+
+    cursor = page_state["last"] if direction == "next" else page_state["first"]
+    await show_users_page(update, context, cursor=tuple(cursor), direction=direction)
+
+
+def _write_csv_export(user_mgr, table: str, fpath: str) -> int:
+    """Stream a table into a CSV file, returns the number of data rows written"""
+    rows = user_mgr.iter_export_rows(table)
+    with open(fpath, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(next(rows))
+
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+
+    return count
+
+
+async def export_table(update: Update, context: ContextTypes.DEFAULT_TYPE, table: str) -> None:
+    query = update.callback_query
+    user_mgr = get_user_mgr()
+
+    fd, fpath = tempfile.mkstemp(prefix=f"export_{table}_", suffix=".csv")
+    os.close(fd)
+
+    try:
+        # Writing runs off the event loop, the file is uploaded from disk so memory stays bounded
+        row_count = await asyncio.to_thread(_write_csv_export, user_mgr, table, fpath)
+
+        filename = f"{table}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        with open(fpath, "rb") as file:
+            await context.bot.send_document(
+                chat_id=query.message.chat_id,
+                document=file,
+                filename=filename,
+                caption=f"📄 Export of {table}: {row_count} rows",
+            )
+
+    except Exception as e:
+        logger.error(f"Error exporting {table}: {e}")
+        await context.bot.send_message(chat_id=query.message.chat_id, text=f"❌ Failed to export {table}.")
+
+    finally:
+        os.remove(fpath)
+
+
 async def start_change_role(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Start the add premium user conversation"""
     query = update.callback_query
@@ -308,40 +504,295 @@ async def cancel_admin_conversation(update: Update, context: ContextTypes.DEFAUL
     return ConversationHandler.END
 
 
-# Conversation Handle
-add_premium_conv = ConversationHandler(
-    entry_points=[CallbackQueryHandler(start_change_role, pattern="^admin_change_role$")],
-    states={
-        AWAITING_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_user_id)],
-        AWAITING_ACCESS_LEVEL: [CallbackQueryHandler(process_access_level, pattern="^access_")],
-    },
-    fallbacks=[CommandHandler("cancel", cancel_admin_conversation)],
-)
+def _parse_user_ids(text: str) -> tuple[list[int], list[str]]:
+    """Split pasted or uploaded content on whitespace/commas/semicolons into valid IDs and rejected tokens"""
+    user_ids, invalid = [], []
+    for token in re.split(r"[\s,;]+", text.strip()):
+        if not token:
+            continue
 
-add_credits_conv = ConversationHandler(
-    entry_points=[CallbackQueryHandler(start_add_credits, pattern="^admin_add_credits$")],
-    states={
-        AWAITING_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_user_id_for_credits)],
-        AWAITING_FREE_CREDITS: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_free_credits)],
-    },
-    fallbacks=[CommandHandler("cancel", cancel_admin_conversation)],
-)
+        if token.isdigit():
+            user_ids.append(int(token))
+        else:
+            invalid.append(token)
 
+    return user_ids, invalid
 
-async def show_user_management(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+
+async def start_bulk_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Start the bulk role/credits conversation"""
     query = update.callback_query
+    await query.answer()
+
+    user = get_user_mgr().get_user(query.from_user.id)
+    if not user or user["access_level"] != "admin":
+        await query.edit_message_text("⛔ You don't have admin privileges to use this feature.")
+        return ConversationHandler.END
 
     keyboard = [
-        [InlineKeyboardButton("➕ Change User Role", callback_data="admin_change_role")],
-        [InlineKeyboardButton("⏱️ Add Free Credits", callback_data="admin_add_credits")],
-        [InlineKeyboardButton("◀️ Back to Dashboard", callback_data="admin_dashboard")],
+        [InlineKeyboardButton("Set Free", callback_data="bulk_role_free")],
+        [InlineKeyboardButton("Set Premium", callback_data="bulk_role_premium")],
+        [InlineKeyboardButton("Set Admin", callback_data="bulk_role_admin")],
+        [InlineKeyboardButton("Add Free Credits", callback_data="bulk_credits")],
+        [InlineKeyboardButton("Cancel", callback_data="bulk_cancel")],
     ]
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        "📦 Bulk Update\n\nSelect the change to apply to multiple users:",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
+
+    return AWAITING_BULK_ACTION
+
 
-    await query.edit_message_text("👥 User Management\n\nSelect an action to manage users:", reply_markup=reply_markup)
+async def _ask_bulk_targets(reply, context: ContextTypes.DEFAULT_TYPE) -> int:
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"Free users inactive {BULK_INACTIVE_DAYS}+ days", callback_data="bulk_target_inactive"
+            )
+        ],
+        [InlineKeyboardButton("Cancel", callback_data="bulk_cancel")],
+    ]
+
+    await reply(
+        "Send the target user IDs separated by spaces, commas or new lines, "
+        "upload a .txt/.csv file with the IDs, or pick a filter below.\n\n"
+        "You can use /cancel to cancel this operation.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+    )
 
+    return AWAITING_BULK_TARGETS
 
+
+async def process_bulk_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Process the selected bulk change"""
+    query = update.callback_query
+    await query.answer()
+
+    action = query.data.removeprefix("bulk_")
+
+    if action == "cancel":
+        await query.edit_message_text("Operation canceled.")
+        return ConversationHandler.END
+
+    if action == "credits":
+        context.user_data["bulk_change"] = ("credits", None)
+        await query.edit_message_text(
+            "How many free credits do you want to add to each user? (Enter a number)\n\n"
+            "You can use /cancel to cancel this operation."
+        )
+        return AWAITING_BULK_CREDITS
+
+    context.user_data["bulk_change"] = ("role", action.removeprefix("role_"))
+    return await _ask_bulk_targets(query.edit_message_text, context)
+
+
+async def process_bulk_credits(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Process the number of credits for the bulk change"""
+    try:
+        credits = int(update.message.text.strip())
+        if credits <= 0:
+            raise ValueError("Credits must be positive")
+
+    except ValueError:
+        await update.message.reply_text(
+            "⚠️ Please enter a positive number of credits.\nTry again or use /cancel to abort:"
+        )
+        return AWAITING_BULK_CREDITS
+
+    context.user_data["bulk_change"] = ("credits", credits)
+    return await _ask_bulk_targets(update.message.reply_text, context)
+
+
+async def _apply_bulk_change(reply, context: ContextTypes.DEFAULT_TYPE, user_ids: list[int], invalid: list[str]) -> int:
+    if not user_ids:
+        await reply("⚠️ No valid user IDs found.\nTry again or use /cancel to abort:")
+        return AWAITING_BULK_TARGETS
+
+    change, value = context.user_data.get("bulk_change", (None, None))
+    user_mgr = get_user_mgr()
+
+    if change == "role":
+        result = await asyncio.to_thread(user_mgr.bulk_update_access, user_ids, value)
+        summary = f"access level set to {value.upper()}"
+    else:
+        result = await asyncio.to_thread(user_mgr.bulk_add_credits, user_ids, value)
+        summary = f"{value} free credits added"
+
+    report = f"{'✅' if not result['failed'] else '❌'} Bulk update: {summary}\n\n"
+    report += f"Updated: {result['updated']}\n"
+    report += f"Missing: {len(result['missing'])}\n"
+
+    if result["failed"]:
+        report += f"Failed: {result['failed']} (transaction rolled back)\n"
+
+    if invalid:
+        report += f"Invalid entries: {len(invalid)}\n"
+
+    if result["missing"]:
+        preview = ", ".join(str(user_id) for user_id in result["missing"][:20])
+        more = "…" if len(result["missing"]) > 20 else ""
+        report += f"\nMissing IDs: {preview}{more}"
+
+    await reply(report)
+    context.user_data.pop("bulk_change", None)
+    return ConversationHandler.END
+
+
+async def process_bulk_targets_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_ids, invalid = _parse_user_ids(update.message.text)
+    return await _apply_bulk_change(update.message.reply_text, context, user_ids, invalid)
+
+
+def _is_id_list_file(file_name: str | None, mime_type: str | None) -> bool:
+    """Plain text ID lists only, like tele_document._document_kind judged by extension or MIME type"""
+    return (file_name or "").lower().endswith(BULK_FILE_EXTENSIONS) or (mime_type or "").startswith("text/")
+
+
+async def process_bulk_targets_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    document = update.message.document
+    if not _is_id_list_file(document.file_name, document.mime_type):
+        await update.message.reply_text(
+            "⚠️ Please upload the IDs as a .txt or .csv file.\nTry again or use /cancel to abort:"
+        )
+        return AWAITING_BULK_TARGETS
+
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        await update.message.reply_text("⚠️ File is too large (max 1 MB).\nTry again or use /cancel to abort:")
+        return AWAITING_BULK_TARGETS
+
+    tg_file = await document.get_file()
+    content = await tg_file.download_as_bytearray()
+
+    user_ids, invalid = _parse_user_ids(content.decode("utf-8", errors="ignore"))
+    return await _apply_bulk_change(update.message.reply_text, context, user_ids, invalid)
+
+
+async def process_bulk_targets_filter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+
+    user_ids = await asyncio.to_thread(get_user_mgr().find_inactive_free_users, BULK_INACTIVE_DAYS)
+    return await _apply_bulk_change(query.edit_message_text, context, user_ids, [])
+
+
+async def cancel_bulk_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text("Operation canceled.")
+    context.user_data.pop("bulk_change", None)
+    return ConversationHandler.END
+
+
+def admin_conversations() -> list[ConversationHandler]:
+    """Fresh conversation handlers for one Application, their state is per handler instance"""
+    add_premium_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_change_role, pattern=callback_pattern("acr"))],
+        states={
+            AWAITING_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_user_id)],
+            AWAITING_ACCESS_LEVEL: [CallbackQueryHandler(process_access_level, pattern="^access_")],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_admin_conversation)],
+    )
+
+    add_credits_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_add_credits, pattern=callback_pattern("acc"))],
+        states={
+            AWAITING_USER_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_user_id_for_credits)],
+            AWAITING_FREE_CREDITS: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_free_credits)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_admin_conversation)],
+    )
+
+    bulk_update_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(start_bulk_update, pattern=callback_pattern("ab"))],
+        states={
+            AWAITING_BULK_ACTION: [CallbackQueryHandler(process_bulk_action, pattern="^bulk_")],
+            AWAITING_BULK_CREDITS: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_bulk_credits)],
+            AWAITING_BULK_TARGETS: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, process_bulk_targets_text),
+                MessageHandler(filters.Document.ALL, process_bulk_targets_file),
+                CallbackQueryHandler(process_bulk_targets_filter, pattern="^bulk_target_inactive$"),
+                CallbackQueryHandler(cancel_bulk_conversation, pattern="^bulk_cancel$"),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel_admin_conversation)],
+    )
+
+    return [add_premium_conv, add_credits_conv, bulk_update_conv]
+
+
+async def show_user_management(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.callback_query.edit_message_text(
+        "👥 User Management\n\nSelect an action to manage users:", reply_markup=USER_MANAGEMENT_MARKUP
+    )
+
+
+# Admin menu payloads, see src/callbacks.py. The conversation entry points (acr, acc, ab) are matched by
+# their ConversationHandlers before admin_callback sees them
+admin_router = CallbackRouter("admin", legacy_prefixes=("admin_",))
+
+
+@admin_router.stale
+async def _on_stale(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_admin_dashboard(update, context)
+
+
+@admin_router.route("ad")
+async def _on_dashboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_admin_dashboard(update, context)
+
+
+@admin_router.route("as")
+async def _on_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_usage_statistics(update, context)
+
+
+@admin_router.route("au")
+async def _on_user_management(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_user_management(update, context)
+
+
+@admin_router.route("ar")
+async def _on_recent_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_recent_users(update, context)
+
+
+@admin_router.route("aq")
+async def _on_query_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_query_profile(update, context)
+
+
+@admin_router.route("aqr")
+async def _on_query_profile_reset(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    profiler.reset()
+    await show_query_profile(update, context)
+
+
+@admin_router.route("al")
+async def _on_user_filter(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: int) -> None:
+    keys = list(USER_FILTERS)
+    await show_recent_users(update, context, keys[idx] if idx < len(keys) else "all")
+
+
+@admin_router.route("an")
+async def _on_page_next(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await page_users(update, context, "next")
+
+
+@admin_router.route("ap")
+async def _on_page_prev(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await page_users(update, context, "prev")
+
+
+@admin_router.route("ax")
+async def _on_export(update: Update, context: ContextTypes.DEFAULT_TYPE, idx: int) -> None:
+    if idx < len(EXPORT_TABLES):
+        await export_table(update, context, EXPORT_TABLES[idx])
+
+
+@timed_handler("admin_callback")
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -354,13 +805,4 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text("⛔ You don't have admin privileges to use this feature.")
         return
 
-    action = query.data
-
-    if action == "admin_dashboard":
-        await show_admin_dashboard(update, context)
-    elif action == "admin_stats":
-        await show_usage_statistics(update, context)
-    elif action == "admin_users":
-        await show_user_management(update, context)
-    elif action == "admin_show_users":
-        await show_recent_users(update, context)
+    await admin_router.dispatch(update, context)
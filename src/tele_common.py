@@ -1,33 +1,47 @@
-import os
+import math
+import time
+import asyncio
 import logging
-from dotenv import load_dotenv
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from telegram.error import BadRequest
 
 from src.utils import count_token, count_pricing
-from src.models import AllModels
+from src.models import get_llm_models, is_error_response, response_usage, Usage
 from src.database import get_user_mgr
+from src.metrics import timed_handler, TOKENS, COST
+from src.sketches import sketches
+from src.tracing import RequestTrace
+from src.budget import get_budget, BudgetDecision
+from src.prompt_cache import get_prompt_cache, to_signed
+from src.admission import get_admission, AdmissionRejected, PRIORITIES
+from src.rate_limit import get_rate_limiter
+from src.callbacks import CallbackRouter, pack
+from src.menus import get_menus, BACK_TO_MAIN, SELECT_MODEL_MARKUP
+from src.tenants import current_tenant
+from src.dedup import ledger
 from config import (
     MODEL_CHOICES,
-    MODEL_PRICING,
+    COMPARE_MAX_MODELS,
+    COMPARE_TIMEOUT,
+    BACKGROUND_MAX_PENDING,
 )
 
 logger = logging.getLogger(__name__)
 
-# Load Variable
-load_dotenv()
+# (tenant, user_id) -> selected model, or the models of compare mode
+db_users: dict[tuple[str, int], dict] = {}
 
-TELE_API_KEY: str | None = os.getenv("TELE_API_KEY")
-api_keys: dict[str, str | None] = {
-    "Claude": os.getenv("CLA_API_KEY"),
-    "Deepseek": os.getenv("DS_API_KEY"),
-    "ChatGPT": os.getenv("GPT_API_KEY"),
-    "Perplexity": os.getenv("PEX_API_KEY"),
-}
+# job_id -> budget reservation of requests handed to worker processes
+queued_reservations: dict[int, BudgetDecision] = {}
 
-db_users = {}
-llm_models = AllModels(api_keys, MODEL_CHOICES)
+# Deliveries of compare answers still running after COMPARE_TIMEOUT, referenced so the event loop keeps them
+compare_stragglers: set[asyncio.Task] = set()
+
+
+def user_key(user_id: int) -> tuple[str, int]:
+    return current_tenant.get(), user_id
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -44,19 +58,14 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     await update.message.reply_text("Just send me any message, and I'll respond with AI-generated content!")
 
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    keyboard = []
-    for key in MODEL_CHOICES.keys():
-        keyboard.append([InlineKeyboardButton(key, callback_data=f"provider_{key}")])
-
-    keyboard.append([InlineKeyboardButton("Surprise Me!", callback_data="random")])
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, notice: str = "") -> None:
+    text = "Main Menu\n\nPlease select AI Model:" + (f"\n\n⚠️ {notice}" if notice else "")
+    menus = get_menus()
 
     if update.callback_query:
-        await update.callback_query.edit_message_text("Main Menu\n\nPlease select AI Model:", reply_markup=reply_markup)
+        await update.callback_query.edit_message_text(text, reply_markup=menus.main_markup)
     else:
-        await update.message.reply_text("Main Menu\n\nPlease select AI Model:", reply_markup=reply_markup)
+        await update.message.reply_text(text, reply_markup=menus.main_markup)
 
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -64,115 +73,672 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
 # Function to display the products submenu
-async def show_model_selection_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, provider: str) -> None:
+async def show_model_selection_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, p_idx: int) -> None:
+    await update.callback_query.edit_message_text(
+        "Models - Select your model:", reply_markup=get_menus().provider_markups[p_idx]
+    )
+
+
+async def show_compare_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, notice: str = "") -> None:
     query = update.callback_query
-    if query is not None:
-        models = MODEL_CHOICES[provider]
+    selected = context.user_data.setdefault("compare_selection", [])
+    menus = get_menus()
 
-        keyboard = []
-        for model in models:
-            keyboard.append([InlineKeyboardButton(model["name"], callback_data=f"model_{provider}_{model['id']}")])
+    keyboard = [
+        [ticked if [provider, model["id"]] in selected else unticked]
+        for (provider, model), (unticked, ticked) in zip(menus.flat, menus.compare_buttons)
+    ]
+    keyboard.append([InlineKeyboardButton(f"▶️ Start Compare ({len(selected)})", callback_data=pack("cs"))])
+    keyboard.append([BACK_TO_MAIN])
 
-        keyboard.append([InlineKeyboardButton("◀️ Back to Main Menu", callback_data="back_to_main")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    try:
+        await query.edit_message_text(
+            f"⚖️ Compare Models\n\nPick 2 to {COMPARE_MAX_MODELS} models. "
+            "Each message will be sent to all of them at once and every answer is billed separately."
+            + (f"\n\n⚠️ {notice}" if notice else ""),
+            reply_markup=reply_markup,
+        )
+    except BadRequest as e:
+        # Tapping a button that doesn't change the selection leaves the message as is
+        if "not modified" not in str(e):
+            raise
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text("Models - Select your model:", reply_markup=reply_markup)
 
+async def toggle_compare_model(update: Update, context: ContextTypes.DEFAULT_TYPE, provider: str, model: dict) -> None:
+    selected = context.user_data.setdefault("compare_selection", [])
+    entry = [provider, model["id"]]
 
-async def common_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    notice = ""
+    if entry in selected:
+        selected.remove(entry)
+    elif len(selected) < COMPARE_MAX_MODELS:
+        selected.append(entry)
+    else:
+        notice = f"You can compare at most {COMPARE_MAX_MODELS} models."
+
+    await show_compare_menu(update, context, notice)
+
+
+async def start_compare(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    await query.answer()  # Answer the callback query
+    selected = context.user_data.get("compare_selection", [])
 
-    # Get the callback data
-    data = query.data
-    user_id = query.from_user.id
+    if len(selected) < 2:
+        await show_compare_menu(update, context, "Select at least 2 models to compare.")
+        return
 
-    if data.startswith("provider_"):
-        provider = data.split("_")[1]
-        await show_model_selection_menu(update, context, provider)
+    db_users[user_key(query.from_user.id)] = {"compare": [list(entry) for entry in selected]}
 
-    elif data == "random":
-        await query.edit_message_text("Sorry currently not available. WIP")
+    names = "\n".join(f"• {provider} - {_model_name(provider, model_id)}" for provider, model_id in selected)
+    await query.edit_message_text(
+        f"⚖️ Compare mode with:\n{names}\n\n"
+        "Send a message and every model will answer it.\n\n"
+        "Type /change_model to go back to a single model at any time."
+    )
 
-    elif data == "back_to_main":
-        await show_main_menu(update, context)
 
-    # model_provider_model_id
-    elif data.startswith("model_"):
-        data_split = data.split("_")
-        provider = data_split[1]
-        model_id = data_split[-1]
+async def select_model(update: Update, context: ContextTypes.DEFAULT_TYPE, provider: str, model: dict) -> None:
+    db_users[user_key(update.callback_query.from_user.id)] = {
+        "provider": provider,
+        "model_id": model["id"],
+    }
 
-        db_users[user_id] = {
-            "provider": provider,
-            "model_id": model_id,
-        }
+    await update.callback_query.edit_message_text(
+        f"You have selected: {provider}\n\n"
+        f"Using model: {model['id']}\n\n"
+        "You can now start chatting with this model. Simply send a message!\n\n"
+        "Type /change_model to select a different AI model at any time."
+    )
 
-        await query.edit_message_text(
-            f"You have selected: {provider}\n\n"
-            f"Using model: {model_id}\n\n"
-            "You can now start chatting with this model. Simply send a message!\n\n"
-            "Type /change_model to select a different AI model at any time."
-        )
+
+# Callback payloads of the model menus, see src/callbacks.py. Old "provider_..." buttons just redraw the menu
+common_router = CallbackRouter("common", legacy_prefixes=("provider_", "model_", "back_", "compare_"))
+MENU_OUTDATED = "The model list has changed, please choose again."
+
+
+@common_router.stale
+async def _on_stale(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_main_menu(update, context, MENU_OUTDATED)
+
+
+@common_router.route("mm")
+async def _on_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_main_menu(update, context)
+
+
+@common_router.route("r")
+async def _on_random(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.callback_query.edit_message_text("Sorry currently not available. WIP")
+
+
+@common_router.route("p")
+async def _on_provider(update: Update, context: ContextTypes.DEFAULT_TYPE, generation: int, p_idx: int) -> None:
+    if get_menus().provider(generation, p_idx) is None:
+        await _on_stale(update, context)
+        return
+    await show_model_selection_menu(update, context, p_idx)
+
+
+@common_router.route("m")
+async def _on_model(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, generation: int, p_idx: int, m_idx: int
+) -> None:
+    entry = get_menus().model(generation, p_idx, m_idx)
+    if entry is None:
+        await _on_stale(update, context)
+        return
+    await select_model(update, context, *entry)
+
+
+@common_router.route("c")
+async def _on_compare_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await show_compare_menu(update, context)
+
+
+@common_router.route("ct")
+async def _on_compare_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, generation: int, idx: int) -> None:
+    entry = get_menus().flat_model(generation, idx)
+    if entry is None:
+        await show_compare_menu(update, context, MENU_OUTDATED)
+        return
+    await toggle_compare_model(update, context, *entry)
+
+
+@common_router.route("cs")
+async def _on_compare_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await start_compare(update, context)
 
 
+@timed_handler("common_callback")
+async def common_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.callback_query.answer()  # Answer the callback query
+    await common_router.dispatch(update, context)
+
+
+@timed_handler("handle_message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    trace = RequestTrace("handle_message", user_id=update.effective_user.id, update_id=update.update_id)
+    outcome = "error"
+    try:
+        if await throttle(update, trace):
+            outcome = "throttled"
+        elif await replay_update(update, trace):
+            outcome = "replayed"
+        else:
+            outcome = await _handle_message(update, context, trace)
+    finally:
+        trace.finish(outcome)
+
+
+async def throttle(update: Update, trace: RequestTrace) -> bool:
+    """Per-user rate limit, True if the message is dropped. Only the first one of a cooldown gets a reply"""
+    key = user_key(update.effective_user.id)
+    rate_limiter = get_rate_limiter()
+    retry_after = rate_limiter.check(key)
+    if retry_after is None:
+        return False
+
+    trace.set(retry_after=round(retry_after, 1))
+    if rate_limiter.should_notify(key, retry_after):
+        with trace.stage("send_cooldown"):
+            await update.message.reply_text(
+                f"⏳ You're sending messages too fast, please wait {math.ceil(retry_after)}s and try again."
+            )
+    return True
+
+
+async def replay_update(update: Update, trace: RequestTrace) -> bool:
+    """Claim the message, a redelivered one gets its stored reply (if any) instead of being handled again"""
+    user_mgr = get_user_mgr()
+    with trace.stage("dedup"):
+        claimed, reply = ledger.claim(user_mgr, update)
+    if claimed:
+        return False
+
+    trace.set(replayed=True, stored_reply=reply is not None)
+    if reply:
+        for i in range(0, len(reply), 4096):
+            with trace.stage("send_reply", part=i // 4096):
+                await update.message.reply_text(text=reply[i : i + 4096])
+    return True
+
+
+async def reply_final(update: Update, text: str, **kwargs) -> None:
+    """A reply that ends the handling of the message, a redelivery of the message is answered with it again"""
+    await update.message.reply_text(text, **kwargs)
+    ledger.complete(get_user_mgr(), update.effective_chat.id, update.message.message_id, text)
+
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE, trace: RequestTrace) -> str:
     user = update.effective_user
     user_id = update.effective_user.id
     message_text = update.message.text
 
     user_mgr = get_user_mgr()
 
-    user_info = user_mgr.register_user(
-        user_id=user_id,
-        username=user.username,
-        first_name=user.first_name,
-        last_name=user.last_name,
-    )
+    with trace.stage("register"):
+        user_info = user_mgr.register_user(
+            user_id=user_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+        )
 
-    bool_valid, status = user_mgr.validate_user(user_id)
+    with trace.stage("validate"):
+        bool_valid, status = user_mgr.validate_user(user_id)
 
     if not bool_valid:
-        await update.message.reply_text(
-            "⚠️ You've reached your free message limit.\n\nTo continue using the bot, please contact @Kennnnnnnn",
-        )
+        with trace.stage("send_limit_reached"):
+            await reply_final(
+                update,
+                "⚠️ You've reached your free message limit.\n\nTo continue using the bot, please contact @Kennnnnnnn",
+            )
+        return "rejected"
+
+    access_level = status.split(":")[0]
+    get_rate_limiter().set_tier(user_key(user_id), access_level)
+
+    if user_key(user_id) not in db_users:
+        with trace.stage("send_select_model"):
+            await reply_final(
+                update,
+                "Please select an AI model first before sending messages.",
+                reply_markup=SELECT_MODEL_MARKUP,
+            )
+        return "no_model"
+
+    model_info = db_users[user_key(user_id)]
+
+    if "compare" in model_info:
+        compare_models = model_info["compare"]
+        if not await admit(update, trace, access_level):
+            return "shed"
+        try:
+            outcome = await _handle_compare(
+                update, trace, user_mgr, user_id, access_level, compare_models, message_text
+            )
+        finally:
+            get_admission().release()
+
+        # Several answers, a replay is skipped rather than repeating all of them
+        ledger.complete(user_mgr, update.effective_chat.id, update.message.message_id)
+        return outcome
+
+    provider = model_info["provider"]
+    model_id = model_info["model_id"]
+    trace.set(provider=provider, model_id=model_id)
+
+    with trace.stage("cache_lookup"):
+        response_text = get_prompt_cache().lookup(model_id, message_text)
+
+    if response_text is not None:
+        trace.set(cache_hit=True)
+        input_tokens, output_tokens = count_token(message_text), count_token(response_text)
+        record_response(trace, user_mgr, user_id, provider, model_id, input_tokens, output_tokens, 0.0)
+    else:
+        # Split mode and long-running models: a worker makes the call and deliver_queued_reply answers later
+        work_queue = context.bot_data.get("work_queue")
+        background = _is_long_running(provider, model_id)
+        if work_queue is not None and (background or "worker_pool" in context.bot_data):
+            return await _enqueue_single(
+                update, trace, work_queue, user_id, access_level, status, provider, model_id, message_text, background
+            )
+
+        if not await admit(update, trace, access_level):
+            return "shed"
+        try:
+            response_text = await _query_single(
+                update, context, trace, user_mgr, user_id, access_level, provider, model_id, message_text
+            )
+        finally:
+            get_admission().release()
+
+        if response_text is None:
+            return "over_budget"
+
+    response_text += free_footnote(status)
+
+    response_batch = [response_text[i : i + 4096] for i in range(0, len(response_text), 4096)]
+    for i, msg in enumerate(response_batch):
+        with trace.stage("send_reply", part=i):
+            await update.message.reply_text(text=msg)
+
+    ledger.complete(user_mgr, update.effective_chat.id, update.message.message_id, response_text)
+    return "ok"
+
+
+async def admit(update: Update, trace: RequestTrace, access_level: str) -> bool:
+    """Wait for an LLM slot, answers with a busy message and returns False if the request was shed"""
+    try:
+        with trace.stage("admission", tier=access_level):
+            await get_admission().acquire(access_level)
+        return True
+
+    except AdmissionRejected as e:
+        trace.set(shed_reason=e.reason)
+        with trace.stage("send_busy"):
+            await reply_final(update, "⏳ The bot is busy right now, please try again in a minute.")
+        return False
+
+
+async def _query_single(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    trace: RequestTrace,
+    user_mgr,
+    user_id: int,
+    access_level: str,
+    provider: str,
+    model_id: str,
+    message_text: str,
+) -> str | None:
+    """Budget check, provider call and accounting for one model, returns None if the budget rejected it"""
+    decision = await reserve_budget(update, trace, user_id, access_level, provider, model_id, message_text)
+    if decision is None:
         return None
 
-    if user_id not in db_users:
-        await update.message.reply_text(
-            "Please select an AI model first before sending messages.",
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Select Model", callback_data="back_to_main")]]),
-        )
+    model_id = decision.model_id
+    msg_cost = 0.0
+    try:
+        with trace.stage("send_typing"):
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        with trace.stage("send_thinking"):
+            await update.message.reply_text("Thinking...")
+        with trace.stage("send_typing"):
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+
+        with trace.stage("provider_call"):
+            response_text = await get_llm_models().query_model(provider, model_id, message_text)
+
+        input_tokens, output_tokens, msg_cost = price_response(trace, provider, model_id, message_text, response_text)
+
+    finally:
+        get_budget().settle(decision, msg_cost)
+
+    usage = response_usage(response_text)
+    record_response(trace, user_mgr, user_id, provider, model_id, input_tokens, output_tokens, msg_cost, usage)
+
+    if not is_error_response(response_text):
+        fingerprint = get_prompt_cache().store(model_id, message_text, response_text)
+        if fingerprint is not None:
+            user_mgr.store_cached_prompt(model_id, to_signed(fingerprint), response_text, time.time())
+
+    return response_text
+
+
+def free_footnote(status: str) -> str:
+    if not status.startswith("free:"):
+        return ""
+
+    remaining: str = status.split(":")[-1]
+    return f"\n\n\n[📊 **{remaining}** free queries remaining]"
+
+
+async def reserve_budget(
+    update: Update,
+    trace: RequestTrace,
+    user_id: int,
+    access_level: str,
+    provider: str,
+    model_id: str,
+    message_text: str,
+    image_tokens: int = 0,
+) -> BudgetDecision | None:
+    """Reserve the worst-case cost, tells the user about a rejection or downgrade"""
+    with trace.stage("budget"):
+        decision = get_budget().reserve(user_id, access_level, provider, model_id, message_text, image_tokens)
+
+    if not decision.allowed:
+        with trace.stage("send_over_budget"):
+            await reply_final(
+                update,
+                f"⚠️ This request would exceed the {decision.reason}.\n\n"
+                "Please try again later or switch to a cheaper model with /change_model.",
+            )
         return None
 
-    model_info = db_users[user_id]
-    provider = model_info["provider"]
-    model_id = model_info["model_id"]
+    if decision.model_id != model_id:
+        trace.set(downgraded_to=decision.model_id)
+        with trace.stage("send_downgrade"):
+            await update.message.reply_text(
+                f"ℹ️ Budget limit reached for your model, answering with {decision.model_id} instead."
+            )
+
+    return decision
+
+
+async def _enqueue_single(
+    update: Update,
+    trace: RequestTrace,
+    work_queue,
+    user_id: int,
+    access_level: str,
+    status: str,
+    provider: str,
+    model_id: str,
+    message_text: str,
+    background: bool = False,
+) -> str:
+    if background:
+        with trace.stage("count_pending_jobs"):
+            pending = await asyncio.to_thread(work_queue.list_user_jobs, user_id, current_tenant.get())
+
+        if len(pending) >= BACKGROUND_MAX_PENDING:
+            await reply_final(
+                update,
+                f"⚠️ You already have {len(pending)} background jobs running. "
+                "Please wait for them to finish or cancel one with /jobs.",
+            )
+            return "rejected"
+
+    decision = await reserve_budget(update, trace, user_id, access_level, provider, model_id, message_text)
+    if decision is None:
+        return "over_budget"
+
+    payload = {
+        "user_id": user_id,
+        "chat_id": update.effective_chat.id,
+        "message_id": update.message.message_id,
+        "provider": provider,
+        "model_id": decision.model_id,
+        "text": message_text,
+        "status": status,
+        "request_id": trace.request_id,
+        "background": background,
+        "tenant": current_tenant.get(),
+    }
+    with trace.stage("enqueue"):
+        job_id = await asyncio.to_thread(
+            work_queue.enqueue, "llm_query", payload, PRIORITIES.get(access_level, PRIORITIES["free"])
+        )
 
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-    await update.message.reply_text("Thinking...")
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    if job_id is None:
+        get_budget().settle(decision, 0.0)
+        await reply_final(update, "❌ Unable to process your request right now, please try again.")
+        return "error"
+
+    # Settled when the result is delivered, lost on restart (the budget is re-seeded from the messages table)
+    queued_reservations[job_id] = decision
+    trace.set(job_id=job_id, background=background)
+
+    if background:
+        with trace.stage("send_job_ack"):
+            await update.message.reply_text(
+                f"⏳ {_model_name(provider, decision.model_id)} can take several minutes, so this runs in the "
+                f"background as job #{job_id}.\n\nI'll send the answer here when it's ready. Use /jobs to see or "
+                "cancel your pending jobs."
+            )
+        return "queued"
+
+    with trace.stage("send_thinking"):
+        await update.message.reply_text("Thinking...")
+    return "queued"
+
+
+async def deliver_queued_reply(bot, job: dict) -> None:
+    """Send a finished llm_query job back to the chat it came from"""
+    payload, result = job["payload"], job["result"]
+    provider, model_id = payload["provider"], payload["model_id"]
+
+    decision = queued_reservations.pop(job["job_id"], None)
+    if decision is not None:
+        get_budget().settle(decision, result.get("cost", 0.0))
+
+    if job.get("cancel_requested"):
+        # Cancelled while it ran: the call is billed and settled above, its answer isn't wanted
+        if "message_id" in payload:
+            ledger.complete(get_user_mgr(), payload["chat_id"], payload["message_id"])
+        logger.debug(f"Dropped the answer of cancelled job {job['job_id']} ({provider}/{model_id})")
+        return
+
+    if job["status"] == "failed":
+        response_text = "❌ Sorry, something went wrong while answering your message. Please try again."
+    else:
+        response_text = result["text"]
+        if not is_error_response(response_text):
+            fingerprint = get_prompt_cache().store(model_id, payload["text"], response_text)
+            if fingerprint is not None:
+                get_user_mgr().store_cached_prompt(model_id, to_signed(fingerprint), response_text, time.time())
+
+        response_text += free_footnote(payload["status"])
+
+    if payload.get("background"):
+        response_text = f"📬 Job #{job['job_id']} ({_model_name(provider, model_id)}):\n\n{response_text}"
+
+    for i in range(0, len(response_text), 4096):
+        await bot.send_message(chat_id=payload["chat_id"], text=response_text[i : i + 4096])
+
+    # Jobs queued before message_id was part of the payload have no processed_updates row to complete
+    if "message_id" in payload:
+        ledger.complete(get_user_mgr(), payload["chat_id"], payload["message_id"], response_text)
+
+    logger.debug(f"Delivered job {job['job_id']} ({provider}/{model_id}) to chat {payload['chat_id']}")
+
+
+def price_response(
+    trace: RequestTrace, provider: str, model_id: str, message_text: str, response_text: str, image_tokens: int = 0
+) -> tuple[int, int, float]:
+    usage = response_usage(response_text)
+    with trace.stage("token_count", model=model_id):
+        if usage is not None:
+            # Provider counts, images and the cached prefix included
+            input_tokens, output_tokens = usage.input_tokens, usage.output_tokens
+            msg_cost = count_pricing(
+                model_id,
+                input_tokens,
+                output_tokens,
+                cached_tokens=usage.cached_tokens,
+                cache_write_tokens=usage.cache_write_tokens,
+            )
+            trace.set(cached_tokens=usage.cached_tokens, cache_write_tokens=usage.cache_write_tokens)
+        else:
+            input_tokens = count_token(message_text)
+            output_tokens = count_token(response_text)
+            msg_cost = count_pricing(model_id, input_tokens, output_tokens, image_tokens)
+            if image_tokens:
+                input_tokens = (input_tokens or 0) + image_tokens
+
+    TOKENS.inc(input_tokens, provider=provider, model=model_id, direction="input")
+    TOKENS.inc(output_tokens, provider=provider, model=model_id, direction="output")
+    if usage is not None and usage.cached_tokens:
+        TOKENS.inc(usage.cached_tokens, provider=provider, model=model_id, direction="cached_input")
+    COST.inc(msg_cost, provider=provider, model=model_id)
+
+    if not is_error_response(response_text):
+        sketches.observe(provider, model_id, "output_tokens", output_tokens)
+        sketches.observe(provider, model_id, "cost", msg_cost)
+
+    return input_tokens, output_tokens, msg_cost
+
+
+def record_response(
+    trace: RequestTrace,
+    user_mgr,
+    user_id: int,
+    provider: str,
+    model_id: str,
+    input_tokens: int,
+    output_tokens: int,
+    msg_cost: float,
+    usage: Usage | None = None,
+) -> None:
+    """`usage` (provider reported counts) feeds the prompt cache hit ratio of the provider"""
+    with trace.stage("record_msg", model=model_id):
+        user_mgr.record_msg(
+            user_id=user_id,
+            provider=provider.lower(),
+            model_id=model_id.lower(),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            query_cost=msg_cost,
+            cached_tokens=usage.cached_tokens if usage else None,
+            cache_write_tokens=usage.cache_write_tokens if usage else 0,
+        )
 
-    response_text = await llm_models.query_model(provider, model_id, message_text)
 
-    input_tokens = count_token(message_text)
-    output_tokens = count_token(response_text)
-    msg_cost = count_pricing(MODEL_PRICING, model_id, input_tokens, output_tokens)
+def _is_long_running(provider: str, model_id: str) -> bool:
+    for model in MODEL_CHOICES.get(provider, []):
+        if model["id"] == model_id:
+            return model.get("long_running", False)
+    return False
 
-    user_mgr.record_msg(
-        user_id=user_id,
-        provider=provider.lower(),
-        model_id=model_id.lower(),
-        input_tokens=input_tokens,
-        output_tokens=output_tokens,
-        query_cost=msg_cost,
-    )
 
-    if status.startswith("free:"):
-        remaining: str = status.split(":")[-1]
-        msg_footnote = f"\n\n\n[📊 **{remaining}** free queries remaining]"
-        response_text += msg_footnote
+def _model_name(provider: str, model_id: str) -> str:
+    for model in MODEL_CHOICES.get(provider, []):
+        if model["id"] == model_id:
+            return model["name"]
+    return model_id
 
+
+async def _compare_one(trace: RequestTrace, user_mgr, user_id: int, decision, message_text: str) -> tuple:
+    """Bills the answer itself, so one that arrives after COMPARE_TIMEOUT is still recorded (the provider charges
+    for it) and its reservation is held until the call really ends"""
+    provider, model_id = decision.provider, decision.model_id
+    msg_cost = 0.0
+    try:
+        with trace.stage("provider_call", model=model_id):
+            response_text = await get_llm_models().query_model(provider, model_id, message_text)
+
+        input_tokens, output_tokens, msg_cost = price_response(trace, provider, model_id, message_text, response_text)
+        usage = response_usage(response_text)
+        record_response(trace, user_mgr, user_id, provider, model_id, input_tokens, output_tokens, msg_cost, usage)
+        return decision, response_text
+
+    finally:
+        get_budget().settle(decision, msg_cost)
+
+
+async def _send_compare_answer(update: Update, trace: RequestTrace, decision, response_text: str, label: str) -> None:
+    provider, model_id = decision.provider, decision.model_id
+    response_text = f"🤖 {provider} - {_model_name(provider, model_id)} ({label})\n\n" + response_text
     response_batch = [response_text[i : i + 4096] for i in range(0, len(response_text), 4096)]
-    for msg in response_batch:
-        await update.message.reply_text(text=msg)
+    for i, msg in enumerate(response_batch):
+        with trace.stage("send_reply", model=model_id, part=i):
+            await update.message.reply_text(text=msg)
+
+
+async def _send_late_compare_answer(update: Update, trace: RequestTrace, task: asyncio.Task) -> None:
+    """Answers past COMPARE_TIMEOUT are billed like the others, so the user still gets them"""
+    try:
+        decision, response_text = await task
+        await _send_compare_answer(update, trace, decision, response_text, "late")
+    except Exception as e:
+        logger.error(f"Error delivering late compare answer to user {update.effective_user.id}: {e}")
+
+
+async def _handle_compare(
+    update: Update,
+    trace: RequestTrace,
+    user_mgr,
+    user_id: int,
+    access_level: str,
+    models: list[list[str]],
+    message_text: str,
+) -> str:
+    trace.set(compare=[model_id for _, model_id in models])
+
+    decisions, skipped = [], []
+    with trace.stage("budget"):
+        for provider, model_id in models:
+            decision = get_budget().reserve(user_id, access_level, provider, model_id, message_text)
+            if decision.allowed:
+                decisions.append(decision)
+            else:
+                skipped.append(f"{_model_name(provider, model_id)} ({decision.reason})")
+
+    if skipped:
+        await update.message.reply_text("⚠️ Skipped, would exceed budget:\n" + "\n".join(skipped))
+
+    if not decisions:
+        return "over_budget"
+
+    with trace.stage("send_thinking"):
+        await update.message.reply_text(f"⚖️ Asking {len(decisions)} models, answers arrive as they finish...")
+
+    tasks = [
+        asyncio.create_task(_compare_one(trace, user_mgr, user_id, decision, message_text)) for decision in decisions
+    ]
+    answered = 0
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=COMPARE_TIMEOUT):
+            decision, response_text = await next_done
+            answered += 1
+            await _send_compare_answer(update, trace, decision, response_text, f"#{answered}")
+
+    except TimeoutError:
+        await update.message.reply_text(
+            f"⏱️ {len(tasks) - answered} model(s) still running after {COMPARE_TIMEOUT}s, "
+            "their answers will follow as they arrive."
+        )
+
+    finally:
+        # Not cancelled: the HTTP call would keep running in its thread anyway (bounded by PROVIDER_REQUEST_TIMEOUT)
+        # and the provider bills it, so stragglers finish in the background, are recorded and sent late
+        for task in tasks:
+            if not task.done():
+                straggler = asyncio.create_task(_send_late_compare_answer(update, trace, task))
+                compare_stragglers.add(straggler)
+                straggler.add_done_callback(compare_stragglers.discard)
+
+    return "ok" if answered == len(tasks) else "partial"
@@ -0,0 +1,341 @@
+import os
+import time
+import asyncio
+import logging
+import tempfile
+
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.error import BadRequest
+
+from src.models import get_llm_models, is_error_response, response_usage
+from src.database import get_user_mgr
+from src.budget import get_budget
+from src.metrics import timed_handler
+from src.tracing import RequestTrace
+from src.admission import get_admission
+from src.rate_limit import get_rate_limiter
+from src.tele_common import (
+    db_users,
+    user_key,
+    price_response,
+    record_response,
+    reply_final,
+    admit,
+    replay_update,
+    throttle,
+)
+from src.dedup import ledger
+from config import (
+    DOCUMENT_MAX_BYTES,
+    DOCUMENT_CHUNK_TOKENS,
+    DOCUMENT_MAX_CHUNKS,
+    DOCUMENT_PARALLELISM,
+)
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS: tuple[str, ...] = (".txt", ".md", ".csv", ".json", ".log", ".py", ".html", ".xml")
+PROGRESS_EDIT_INTERVAL = 2.0
+MAX_REDUCE_ROUNDS = 3
+
+MAP_PROMPT = (
+    "You are summarising part {index} of {total} of a longer document. "
+    "Write a concise summary of this part, keeping key facts, names and numbers.\n\n---\n{chunk}"
+)
+REDUCE_PROMPT = (
+    "Below are summaries of consecutive parts of one document. "
+    "Combine them into a single coherent summary.{instruction}\n\n---\n{summaries}"
+)
+
+
+def _document_kind(file_name: str, mime_type: str | None) -> str | None:
+    name = (file_name or "").lower()
+    if name.endswith(".pdf") or mime_type == "application/pdf":
+        return "pdf"
+    if name.endswith(TEXT_EXTENSIONS) or (mime_type or "").startswith("text/"):
+        return "text"
+    return None
+
+
+def _iter_words(fpath: str, kind: str):
+    """Yield words page by page / line by line so the whole text is never loaded at once"""
+    if kind == "pdf":
+        from pypdf import PdfReader
+
+        for page in PdfReader(fpath).pages:
+            yield from (page.extract_text() or "").split()
+    else:
+        with open(fpath, "r", encoding="utf-8", errors="ignore") as file:
+            for line in file:
+                yield from line.split()
+
+
+def split_chunks(fpath: str, kind: str, chunk_tokens: int, max_chunks: int) -> list[str]:
+    """Split into chunks of ~chunk_tokens (same word based estimate as count_token), at most max_chunks + 1"""
+    words_per_chunk = max(1, int(chunk_tokens / 1.3))
+    chunks, current = [], []
+
+    for word in _iter_words(fpath, kind):
+        current.append(word)
+        if len(current) >= words_per_chunk:
+            chunks.append(" ".join(current))
+            current = []
+            # One extra chunk tells the caller the document is over the limit
+            if len(chunks) > max_chunks:
+                return chunks
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class ProgressMessage:
+    """Edits one status message, throttled so Telegram's edit rate limit isn't hit"""
+
+    def __init__(self, message) -> None:
+        self.message = message
+        self.last_edit = 0.0
+
+    async def update(self, text: str, force: bool = False) -> None:
+        if not force and time.monotonic() - self.last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+
+        self.last_edit = time.monotonic()
+        try:
+            await self.message.edit_text(text)
+        except BadRequest as e:
+            logger.debug(f"Progress edit skipped: {e}")
+
+
+async def _finish(update: Update, progress: ProgressMessage, text: str) -> None:
+    """Final status of a document that won't be summarised, a redelivery of it is answered with the same text"""
+    await progress.update(text, force=True)
+    ledger.complete(get_user_mgr(), update.effective_chat.id, update.message.message_id, text)
+
+
+async def _summarise_part(
+    trace: RequestTrace,
+    user_mgr,
+    user_id: int,
+    access_level: str,
+    provider: str,
+    model_id: str,
+    prompt: str,
+    semaphore: asyncio.Semaphore,
+) -> str | None:
+    """One billed provider call, returns None if the budget rejected it or the provider failed"""
+    decision = get_budget().reserve(user_id, access_level, provider, model_id, prompt)
+    if not decision.allowed:
+        return None
+
+    msg_cost = 0.0
+    try:
+        async with semaphore:
+            with trace.stage("provider_call", model=decision.model_id):
+                response_text = await get_llm_models().query_model(provider, decision.model_id, prompt)
+
+        if is_error_response(response_text):
+            return None
+
+        input_tokens, output_tokens, msg_cost = price_response(trace, provider, decision.model_id, prompt, response_text)
+
+    finally:
+        get_budget().settle(decision, msg_cost)
+
+    usage = response_usage(response_text)
+    record_response(
+        trace, user_mgr, user_id, provider, decision.model_id, input_tokens, output_tokens, msg_cost, usage
+    )
+    return response_text
+
+
+async def _map_reduce(
+    trace: RequestTrace,
+    progress: ProgressMessage,
+    user_mgr,
+    user_id: int,
+    access_level: str,
+    provider: str,
+    model_id: str,
+    chunks: list[str],
+    instruction: str,
+) -> str | None:
+    semaphore = asyncio.Semaphore(DOCUMENT_PARALLELISM)
+    total = len(chunks)
+    done = 0
+
+    async def map_one(index: int, chunk: str) -> str | None:
+        nonlocal done
+        prompt = MAP_PROMPT.format(index=index + 1, total=total, chunk=chunk)
+        summary = await _summarise_part(trace, user_mgr, user_id, access_level, provider, model_id, prompt, semaphore)
+
+        done += 1
+        await progress.update(f"📄 Summarising… {done}/{total} parts done")
+        return summary
+
+    with trace.stage("map", chunks=total):
+        summaries = await asyncio.gather(*(map_one(i, chunk) for i, chunk in enumerate(chunks)))
+
+    summaries = [summary for summary in summaries if summary]
+    if not summaries:
+        return None
+
+    # Reduce in rounds until the combined summaries fit in one request
+    level = 0
+    words_per_chunk = int(DOCUMENT_CHUNK_TOKENS / 1.3)
+    instruction_text = f"\nThen answer this request about the document: {instruction}" if instruction else ""
+    while True:
+        level += 1
+        batches, batch, batch_words = [], [], 0
+        for summary in summaries:
+            summary_words = len(summary.split())
+            if batch and batch_words + summary_words > words_per_chunk:
+                batches.append(batch)
+                batch, batch_words = [], 0
+            batch.append(summary)
+            batch_words += summary_words
+        batches.append(batch)
+
+        # Stop recursing if summaries don't shrink enough, the last round combines everything left
+        if level >= MAX_REDUCE_ROUNDS:
+            batches = [summaries]
+
+        final_round = len(batches) == 1
+        await progress.update(f"📄 Combining {len(summaries)} partial summaries (round {level})…", force=True)
+
+        with trace.stage("reduce", round=level, batches=len(batches)):
+            reduced = await asyncio.gather(
+                *(
+                    _summarise_part(
+                        trace,
+                        user_mgr,
+                        user_id,
+                        access_level,
+                        provider,
+                        model_id,
+                        REDUCE_PROMPT.format(
+                            instruction=instruction_text if final_round else "",
+                            summaries="\n\n".join(batch),
+                        ),
+                        semaphore,
+                    )
+                    for batch in batches
+                )
+            )
+
+        reduced = [summary for summary in reduced if summary]
+        if final_round or not reduced:
+            return reduced[0] if reduced else None
+
+        summaries = reduced
+
+
+@timed_handler("handle_document")
+async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    trace = RequestTrace("handle_document", user_id=update.effective_user.id, update_id=update.update_id)
+    outcome = "error"
+    try:
+        if await throttle(update, trace):
+            outcome = "throttled"
+        elif await replay_update(update, trace):
+            outcome = "replayed"
+        else:
+            outcome = await _handle_document(update, context, trace)
+    finally:
+        trace.finish(outcome)
+
+
+async def _handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE, trace: RequestTrace) -> str:
+    user = update.effective_user
+    user_id = user.id
+    document = update.message.document
+
+    user_mgr = get_user_mgr()
+    user_mgr.register_user(user_id=user_id, username=user.username, first_name=user.first_name, last_name=user.last_name)
+    bool_valid, status = user_mgr.validate_user(user_id)
+
+    if not bool_valid:
+        await reply_final(update, "⚠️ You've reached your free message limit.")
+        return "rejected"
+
+    access_level = status.split(":")[0]
+    get_rate_limiter().set_tier(user_key(user_id), access_level)
+
+    model_info = db_users.get(user_key(user_id))
+    if not model_info or "compare" in model_info:
+        await reply_final(update, "Please select a single AI model with /change_model before sending documents.")
+        return "no_model"
+
+    kind = _document_kind(document.file_name, document.mime_type)
+    if kind is None:
+        await reply_final(update, "⚠️ Only text and PDF documents are supported.")
+        return "unsupported"
+
+    if document.file_size and document.file_size > DOCUMENT_MAX_BYTES:
+        await reply_final(update, f"⚠️ Document is too large (max {DOCUMENT_MAX_BYTES // (1024 * 1024)} MB).")
+        return "too_large"
+
+    provider, model_id = model_info["provider"], model_info["model_id"]
+    trace.set(provider=provider, model_id=model_id, kind=kind, file_size=document.file_size)
+    progress = ProgressMessage(await update.message.reply_text("📄 Downloading document…"))
+
+    fd, fpath = tempfile.mkstemp(suffix=os.path.splitext(document.file_name or "")[1])
+    os.close(fd)
+    try:
+        # Streamed straight to disk by the Telegram client
+        with trace.stage("download"):
+            tg_file = await document.get_file()
+            await tg_file.download_to_drive(custom_path=fpath)
+
+        with trace.stage("split"):
+            try:
+                chunks = await asyncio.to_thread(split_chunks, fpath, kind, DOCUMENT_CHUNK_TOKENS, DOCUMENT_MAX_CHUNKS)
+            except ImportError:
+                await _finish(update, progress, "⚠️ PDF support is not installed (pip install pypdf).")
+                return "unsupported"
+
+    finally:
+        os.remove(fpath)
+
+    if not chunks:
+        await _finish(update, progress, "⚠️ No text found in this document.")
+        return "empty"
+
+    if len(chunks) > DOCUMENT_MAX_CHUNKS:
+        await _finish(update, progress, f"⚠️ Document is too long (max {DOCUMENT_MAX_CHUNKS} parts).")
+        return "too_large"
+
+    # Every part is a billed query, free users need enough queries left for the map step and the final answer
+    if status.startswith("free:") and int(status.split(":")[-1]) < len(chunks) + 1:
+        await _finish(
+            update,
+            progress,
+            f"⚠️ This document needs {len(chunks) + 1} queries, you have {status.split(':')[-1]} left.",
+        )
+        return "rejected"
+
+    await progress.update(f"📄 Summarising {len(chunks)} parts with {model_id}…", force=True)
+
+    if not await admit(update, trace, access_level):
+        return "shed"
+    try:
+        summary = await _map_reduce(
+            trace, progress, user_mgr, user_id, access_level, provider, model_id, chunks, update.message.caption or ""
+        )
+    finally:
+        get_admission().release()
+
+    if summary is None:
+        await _finish(update, progress, "❌ Unable to summarise this document (provider error or budget limit).")
+        return "failed"
+
+    await progress.update(f"✅ Summarised {len(chunks)} parts.", force=True)
+
+    response_batch = [summary[i : i + 4096] for i in range(0, len(summary), 4096)]
+    for i, msg in enumerate(response_batch):
+        with trace.stage("send_reply", part=i):
+            await update.message.reply_text(text=msg)
+
+    ledger.complete(user_mgr, update.effective_chat.id, update.message.message_id, summary)
+    return "ok"
@@ -0,0 +1,174 @@
+import os
+import logging
+import tempfile
+
+from telegram import Update, PhotoSize
+from telegram.ext import ContextTypes
+
+from src.models import get_llm_models, response_usage
+from src.database import get_user_mgr
+from src.budget import get_budget
+from src.metrics import timed_handler
+from src.tracing import RequestTrace
+from src.admission import get_admission
+from src.images import prepare_image
+from src.rate_limit import get_rate_limiter
+from src.dedup import ledger
+from src.tele_common import (
+    db_users,
+    user_key,
+    price_response,
+    record_response,
+    reserve_budget,
+    reply_final,
+    admit,
+    replay_update,
+    throttle,
+    free_footnote,
+)
+from config import MODEL_CHOICES, VISION_MAX_DOWNLOAD_BYTES, VISION_DEFAULT_PROMPT
+
+logger = logging.getLogger(__name__)
+
+
+def _supports_vision(provider: str, model_id: str) -> bool:
+    for model in MODEL_CHOICES.get(provider, []):
+        if model["id"] == model_id:
+            return model.get("vision", False)
+    return False
+
+
+def _pick_photo_size(sizes: tuple[PhotoSize, ...], max_edge: int) -> PhotoSize:
+    """Largest size Telegram already scaled to fit max_edge, the largest one if none does (resized later)"""
+    fitting = [size for size in sizes if max(size.width, size.height) <= max_edge]
+    return max(fitting or sizes, key=lambda size: size.width * size.height)
+
+
+@timed_handler("handle_image")
+async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    trace = RequestTrace("handle_image", user_id=update.effective_user.id, update_id=update.update_id)
+    outcome = "error"
+    try:
+        if await throttle(update, trace):
+            outcome = "throttled"
+        elif await replay_update(update, trace):
+            outcome = "replayed"
+        else:
+            outcome = await _handle_image(update, context, trace)
+    finally:
+        trace.finish(outcome)
+
+
+async def _handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE, trace: RequestTrace) -> str:
+    user = update.effective_user
+    user_id = user.id
+
+    user_mgr = get_user_mgr()
+    user_mgr.register_user(
+        user_id=user_id, username=user.username, first_name=user.first_name, last_name=user.last_name
+    )
+    bool_valid, status = user_mgr.validate_user(user_id)
+
+    if not bool_valid:
+        await reply_final(update, "⚠️ You've reached your free message limit.")
+        return "rejected"
+
+    access_level = status.split(":")[0]
+    get_rate_limiter().set_tier(user_key(user_id), access_level)
+
+    model_info = db_users.get(user_key(user_id))
+    if not model_info or "compare" in model_info:
+        await reply_final(update, "Please select a single AI model with /change_model before sending images.")
+        return "no_model"
+
+    provider, model_id = model_info["provider"], model_info["model_id"]
+    model = get_llm_models().get_model(provider, model_id)
+    if model is None or model.image_max_edge is None or not _supports_vision(provider, model_id):
+        await reply_final(
+            update, f"⚠️ {model_id} can't read images, please pick a model that can (e.g. GPT-4o) with /change_model."
+        )
+        return "unsupported"
+
+    # Photos come in several sizes already encoded by Telegram, documents as the original file
+    if update.message.photo:
+        source = _pick_photo_size(update.message.photo, model.image_max_edge)
+        media_type, width, height = "image/jpeg", source.width, source.height
+    else:
+        source = update.message.document
+        media_type, width, height = source.mime_type, None, None
+
+    if source.file_size and source.file_size > VISION_MAX_DOWNLOAD_BYTES:
+        await reply_final(update, f"⚠️ Image is too large (max {VISION_MAX_DOWNLOAD_BYTES // (1024 * 1024)} MB).")
+        return "too_large"
+
+    trace.set(provider=provider, model_id=model_id, media_type=media_type, file_size=source.file_size)
+
+    fd, fpath = tempfile.mkstemp(suffix=".img")
+    os.close(fd)
+    try:
+        # Streamed straight to disk by the Telegram client
+        with trace.stage("download"):
+            tg_file = await source.get_file()
+            await tg_file.download_to_drive(custom_path=fpath)
+
+        with trace.stage("preprocess"):
+            try:
+                image = await prepare_image(
+                    fpath, media_type, model.image_max_edge, model.image_max_bytes, width, height
+                )
+            except ImportError:
+                await reply_final(
+                    update,
+                    "⚠️ Resizing images is not installed (pip install Pillow), please send it as a photo instead.",
+                )
+                return "unsupported"
+            except Exception as e:
+                logger.error(f"Unable to process image from {user_id}: {e}")
+                await reply_final(update, "⚠️ Unable to read this image.")
+                return "unsupported"
+
+    finally:
+        os.remove(fpath)
+
+    prompt = update.message.caption or VISION_DEFAULT_PROMPT
+    image_tokens = model.image_tokens(image.width, image.height)
+    trace.set(width=image.width, height=image.height, image_tokens=image_tokens)
+
+    decision = await reserve_budget(update, trace, user_id, access_level, provider, model_id, prompt, image_tokens)
+    if decision is None:
+        return "over_budget"
+
+    if not await admit(update, trace, access_level):
+        get_budget().settle(decision, 0.0)
+        return "shed"
+
+    msg_cost = 0.0
+    try:
+        with trace.stage("send_typing"):
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+
+        with trace.stage("provider_call"):
+            response_text = await get_llm_models().query_model(provider, decision.model_id, prompt, [image])
+
+        input_tokens, output_tokens, msg_cost = price_response(
+            trace, provider, decision.model_id, prompt, response_text, image_tokens
+        )
+
+    finally:
+        get_admission().release()
+        get_budget().settle(decision, msg_cost)
+
+    usage = response_usage(response_text)
+    record_response(
+        trace, user_mgr, user_id, provider, decision.model_id, input_tokens, output_tokens, msg_cost, usage
+    )
+
+    response_text += free_footnote(status)
+
+    response_batch = [response_text[i : i + 4096] for i in range(0, len(response_text), 4096)]
+    for i, msg in enumerate(response_batch):
+        with trace.stage("send_reply", part=i):
+            await update.message.reply_text(text=msg)
+
+    ledger.complete(user_mgr, update.effective_chat.id, update.message.message_id, response_text)
+    return "ok"
@@ -0,0 +1,97 @@
+import time
+import asyncio
+import logging
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from telegram.error import BadRequest
+
+from src.metrics import timed_handler
+from src.callbacks import CallbackRouter, pack
+from src.budget import get_budget
+from src.tele_common import _model_name, queued_reservations
+from src.tenants import current_tenant
+
+logger = logging.getLogger(__name__)
+
+
+def _jobs_view(jobs: list[dict]) -> tuple[str, InlineKeyboardMarkup | None]:
+    if not jobs:
+        return "You have no pending background jobs.", None
+
+    now = time.time()
+    lines = ["⏳ Your pending background jobs:\n"]
+    keyboard = []
+    for job in jobs:
+        minutes = int((now - job["created_at"]) // 60)
+        if job["cancel_requested"]:
+            state = "cancelling, ends with the current call"
+        else:
+            state = "running" if job["status"] == "running" else "queued"
+            keyboard.append(
+                [InlineKeyboardButton(f"❌ Cancel #{job['job_id']}", callback_data=pack("jc", job["job_id"]))]
+            )
+        lines.append(f"#{job['job_id']} {_model_name(job['provider'], job['model_id'])} - {state}, {minutes} min ago")
+
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard) if keyboard else None
+
+
+@timed_handler("jobs_command")
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List the user's pending background jobs with a cancel button each"""
+    work_queue = context.bot_data.get("work_queue")
+    if work_queue is None:
+        await update.message.reply_text("Background jobs are not enabled.")
+        return
+
+    jobs = await asyncio.to_thread(work_queue.list_user_jobs, update.effective_user.id, current_tenant.get())
+    text, reply_markup = _jobs_view(jobs)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+
+jobs_router = CallbackRouter("jobs")
+
+
+@jobs_router.stale
+async def _on_stale(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.callback_query.answer()
+
+
+@jobs_router.route("jc")
+async def _on_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, job_id: int) -> None:
+    query = update.callback_query
+    outcome = await asyncio.to_thread(
+        context.bot_data["work_queue"].cancel, job_id, query.from_user.id, current_tenant.get()
+    )
+    if outcome == "cancelled":
+        # Queued jobs were never sent to a provider and are never delivered, release the reservation here
+        decision = queued_reservations.pop(job_id, None)
+        if decision is not None:
+            get_budget().settle(decision, 0.0)
+        await query.answer(f"Job #{job_id} cancelled")
+    elif outcome == "cancelling":
+        # A running call can't be taken back: its reservation and pending slot stay until it ends
+        # and is settled with its cost on delivery, then its answer is dropped
+        await query.answer(f"Job #{job_id} is already running, it will be cancelled when the current call ends")
+    else:
+        await query.answer(f"Job #{job_id} already finished")
+
+
+@timed_handler("jobs_callback")
+async def jobs_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    work_queue = context.bot_data.get("work_queue")
+
+    if work_queue is None:
+        await query.answer()
+        return
+
+    await jobs_router.dispatch(update, context)
+
+    jobs = await asyncio.to_thread(work_queue.list_user_jobs, query.from_user.id, current_tenant.get())
+    text, reply_markup = _jobs_view(jobs)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
@@ -0,0 +1,118 @@
+import os
+import logging
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from src.database import UserManager, current_user_mgr
+from src.menus import ModelMenus, current_menus, menus
+from config import MODEL_CHOICES, QUERY_PATH, TENANTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+
+# Name of the tenant the current update / job belongs to, stored in queued job payloads
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+
+
+class Tenant:
+    """One bot token with its own database, model subset and free quota.
+
+    Everything that talks to providers (clients, concurrency limits, admission, budgets, prompt cache) is shared
+    by all tenants of the process, only the per-bot state hangs off this object.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        token: str | None,
+        user_mgr: UserManager,
+        models: dict[str, list[str]] | None = None,
+        free_queries: int = 30,
+        model_menus: ModelMenus | None = None,
+    ) -> None:
+        self.name = name
+        self.token = token
+        self.user_mgr = user_mgr
+        self.models = models
+        self.free_queries = free_queries
+        self.menus = model_menus or ModelMenus()
+        # Set once the tenant's Application is built, used to deliver its queued replies
+        self.bot = None
+
+    def model_choices(self) -> dict[str, list[dict]]:
+        if self.models is None:
+            return MODEL_CHOICES
+
+        choices = {}
+        for provider, model_ids in self.models.items():
+            allowed = [model for model in MODEL_CHOICES.get(provider, []) if model["id"] in model_ids]
+            if allowed:
+                choices[provider] = allowed
+        return choices
+
+    def build_menus(self) -> None:
+        """Catalog reload hook"""
+        self.menus.build(self.model_choices())
+
+
+tenants: dict[str, Tenant] = {}
+
+
+def load_tenants(default_user_mgr: UserManager, default_token: str | None, require_tokens: bool = True) -> list[Tenant]:
+    """The default tenant (TELE_API_KEY, master.db, whole catalog) first, then config.TENANTS.
+
+    Worker processes only need the databases and pass require_tokens=False.
+    """
+    default = Tenant(DEFAULT_TENANT, default_token, default_user_mgr, model_menus=menus)
+    tenants[DEFAULT_TENANT] = default
+
+    for spec in TENANTS:
+        name = spec["name"]
+        token = os.getenv(spec["token_env"])
+        if name in tenants:
+            logger.error(f"Duplicate tenant {name}, skipping it")
+            continue
+        if require_tokens and not token:
+            logger.error(f"No Telegram token in {spec['token_env']}, tenant {name} is not started")
+            continue
+
+        free_queries = spec.get("free_queries", 30)
+        user_mgr = UserManager(spec["db_fpath"], QUERY_PATH, free_queries, spec.get("shards", 0))
+        tenants[name] = Tenant(name, token, user_mgr, spec.get("models"), free_queries)
+        logger.info(f"Loaded tenant {name} ({spec['db_fpath']})")
+
+    return list(tenants.values())
+
+
+@contextmanager
+def use_tenant(tenant: Tenant | None):
+    """Route get_user_mgr() / get_menus() to the tenant for the duration of the block"""
+    if tenant is None:
+        yield
+        return
+
+    tokens = (
+        current_tenant.set(tenant.name),
+        current_user_mgr.set(tenant.user_mgr),
+        current_menus.set(tenant.menus),
+    )
+    try:
+        yield
+    finally:
+        current_menus.reset(tokens[2])
+        current_user_mgr.reset(tokens[1])
+        current_tenant.reset(tokens[0])
+
+
+async def enter_tenant(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Group -1 handler: the rest of this update's handlers run with the Application's tenant"""
+    tenant = context.bot_data.get("tenant")
+    if tenant is not None:
+        current_tenant.set(tenant.name)
+        current_user_mgr.set(tenant.user_mgr)
+        current_menus.set(tenant.menus)
@@ -0,0 +1,79 @@
+import json
+import time
+import uuid
+import queue
+import logging
+
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+# Dedicated logger for trace records, kept out of the root handlers so traces never hit stdout
+trace_logger = logging.getLogger("trace")
+trace_logger.propagate = False
+
+
+class RequestTrace:
+    """Collects per-stage timings of one request and emits them as a single JSON line on finish"""
+
+    def __init__(self, name: str, **fields) -> None:
+        self.request_id: str = uuid.uuid4().hex[:16]
+        self.name: str = name
+        self.fields: dict = fields
+        self.stages: list[dict] = []
+        self.started_at: float = time.time()
+        self._t0: float = time.perf_counter()
+
+    def _elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 3)
+
+    @contextmanager
+    def stage(self, stage_name: str, **fields):
+        start_ms = self._elapsed_ms()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            end_ms = self._elapsed_ms()
+            self.stages.append(
+                {"stage": stage_name, "start_ms": start_ms, "duration_ms": round(end_ms - start_ms, 3), "status": status}
+                | fields
+            )
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def finish(self, status: str = "ok") -> None:
+        if not trace_logger.handlers:
+            return
+
+        record = {
+            "request_id": self.request_id,
+            "name": self.name,
+            "ts": self.started_at,
+            "status": status,
+            "total_ms": self._elapsed_ms(),
+            "stages": self.stages,
+        } | self.fields
+
+        trace_logger.info(json.dumps(record, default=str))
+
+
+def setup_trace_logging(fpath: str, max_bytes: int, backup_count: int) -> QueueListener:
+    """Route trace records through a non-blocking queue to a size-rotated JSONL file written by a listener thread"""
+    file_handler = RotatingFileHandler(fpath, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    trace_logger.addHandler(QueueHandler(log_queue))
+    trace_logger.setLevel(logging.INFO)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=False)
+    listener.start()
+
+    logger.info(f"Writing request traces to {fpath}")
+    return listener
@@ -2,14 +2,52 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# model_id -> (input_cost, output_cost, search_cost, cached_input_cost, cache_write_cost), rebuilt whenever
+# MODEL_PRICING is (re)loaded. Cached rates default to the input rate for models without them
+pricing_table: dict[str, tuple[float, float, float, float, float]] = {}
+
 
 def count_token(text: str) -> int | None:
     if text:
         return int(len(text.split()) * 1.3)
 
 
-def count_pricing(model_pricing: dict, model_id: str, input_tokens: int, output_tokens: int) -> float | None:
-    input_cost: float = model_pricing[model_id]["input_cost"] * input_tokens
-    output_cost: float = model_pricing[model_id]["output_cost"] * output_tokens
+def build_pricing_table(model_pricing: dict[str, dict[str, float]]) -> None:
+    table = {
+        model_id: (
+            price["input_cost"],
+            price["output_cost"],
+            price.get("search_cost", 0.0),
+            price.get("cached_input_cost", price["input_cost"]),
+            price.get("cache_write_cost", price["input_cost"]),
+        )
+        for model_id, price in model_pricing.items()
+    }
+
+    pricing_table.clear()
+    pricing_table.update(table)
+
+
+def count_pricing(
+    model_id: str,
+    input_tokens: int,
+    output_tokens: int,
+    image_tokens: int = 0,
+    cached_tokens: int = 0,
+    cache_write_tokens: int = 0,
+) -> float:
+    """Image tokens are billed at the input rate, the cached and cache-written part of input_tokens at cached rates"""
+    price = pricing_table.get(model_id)
+    if price is None:
+        logger.warning(f"No pricing for model {model_id}, recording cost as 0")
+        return 0.0
 
-    return input_cost + output_cost
+    input_cost, output_cost, search_cost, cached_input_cost, cache_write_cost = price
+    uncached_tokens = max(0, (input_tokens or 0) - cached_tokens - cache_write_tokens) + image_tokens
+    return (
+        input_cost * uncached_tokens
+        + cached_input_cost * cached_tokens
+        + cache_write_cost * cache_write_tokens
+        + output_cost * (output_tokens or 0)
+        + search_cost
+    )
@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+
+from src.metrics import instrument_methods
+
+logger = logging.getLogger(__name__)
+work_queue = None
+
+
+class WorkQueue:
+    """SQLite backed job queue shared between the Telegram process and worker processes.
+
+    Delivery is at-least-once: a claimed job stays invisible until its visibility deadline, which the
+    owning worker keeps pushing forward with heartbeats. If the worker dies the job becomes claimable again.
+    """
+
+    def __init__(self, db_path: str, query_path: str) -> None:
+        self.db_path: str = db_path
+        self.query_path: str = query_path
+        self.ini_sql_file: str = "init_jobs.sql"
+        self.common_sql_file: str = "jobs.sql"
+        self.queries: dict[str, str] = {}
+
+        self._check_db()
+        self._store_queries()
+
+    def _connect_db(self):
+        # Several processes write to this file, wait on the lock instead of failing straight away
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _check_db(self):
+        conn = self._connect_db()
+        init_query_path = os.path.join(self.query_path, self.ini_sql_file)
+
+        with open(init_query_path, "r") as file:
+            query = file.read()
+
+        try:
+            conn.executescript(query)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error initialising job database: {e}")
+        finally:
+            conn.close()
+
+    def _store_queries(self) -> None:
+        fpath = os.path.join(self.query_path, self.common_sql_file)
+        with open(fpath, "r") as file:
+            content = file.read()
+
+        query_blocks = content.split("-- name:")
+        for block in query_blocks[1:]:
+            lines = block.strip().split("\n")
+            current_name = lines[0].strip()
+            query = "\n".join(lines[1:])
+
+            self.queries[current_name] = query
+
+    def enqueue(self, kind: str, payload: dict, priority: int = 2, delay: float = 0) -> int | None:
+        conn = self._connect_db()
+        now = time.time()
+
+        try:
+            cursor = conn.execute(
+                self.queries["enqueue_job"], (kind, priority, json.dumps(payload), now + delay, now, now)
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+        except Exception as e:
+            logger.error(f"Error enqueuing {kind} job: {e}")
+            conn.rollback()
+            return None
+
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str, visibility_timeout: float, max_attempts: int) -> dict | None:
+        """Take the next visible job, or a running job whose worker stopped extending its deadline.
+
+        Abandoned jobs that already used max_attempts (e.g. they keep crashing their worker) are failed instead,
+        so the user gets the error reply rather than the job being rerun forever.
+        """
+        conn = self._connect_db()
+        now = time.time()
+
+        try:
+            conn.execute(
+                self.queries["fail_exhausted_jobs"],
+                (json.dumps({"error": "worker lost"}), now, now, max_attempts),
+            )
+            row = conn.execute(
+                self.queries["claim_job"], (worker_id, now + visibility_timeout, now, now, max_attempts)
+            ).fetchone()
+            conn.commit()
+            if row is None:
+                return None
+
+            job = dict(row)
+            job["payload"] = json.loads(job["payload"])
+            return job
+
+        except Exception as e:
+            logger.error(f"Error claiming job for worker {worker_id}: {e}")
+            conn.rollback()
+            return None
+
+        finally:
+            conn.close()
+
+    def complete(self, job_id: int, worker_id: str, result: dict) -> bool:
+        """Returns False if the job was reclaimed by another worker in the meantime"""
+        conn = self._connect_db()
+
+        try:
+            cursor = conn.execute(self.queries["complete_job"], (json.dumps(result), time.time(), job_id, worker_id))
+            conn.execute(self.queries["count_worker_job"], (1, 0, worker_id))
+            conn.commit()
+            return cursor.rowcount == 1
+
+        except Exception as e:
+            logger.error(f"Error completing job {job_id}: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def fail(self, job_id: int, worker_id: str, error: str, attempts: int, max_attempts: int, backoff: float) -> bool:
+        """Requeue with linear backoff until max_attempts, then mark failed so the user gets an error reply.
+        A job whose cancel was requested while it ran isn't retried"""
+        conn = self._connect_db()
+        now = time.time()
+        result = json.dumps({"error": error})
+
+        try:
+            retried = False
+            if attempts < max_attempts:
+                visible_at = now + backoff * attempts
+                cursor = conn.execute(self.queries["retry_job"], (result, visible_at, now, job_id, worker_id))
+                retried = cursor.rowcount == 1
+            if not retried:
+                conn.execute(self.queries["fail_job"], (result, now, job_id, worker_id))
+
+            conn.execute(self.queries["count_worker_job"], (0, 1, worker_id))
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error failing job {job_id}: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def claim_charge(self, job_id: int) -> bool:
+        """True the first time it is called for a job, its usage is recorded only then"""
+        conn = self._connect_db()
+
+        try:
+            cursor = conn.execute(self.queries["claim_job_charge"], (job_id, time.time()))
+            conn.commit()
+            return cursor.rowcount == 1
+
+        except Exception as e:
+            # Not billing beats billing twice, the answer itself is still delivered
+            logger.error(f"Error claiming charge of job {job_id}: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def heartbeat(
+        self, worker_id: str, pid: int, started_at: float, visibility_timeout: float, job_deadline: float
+    ) -> bool:
+        """Record liveness and push the visibility deadline of every job this worker is running.
+
+        A running job's updated_at is its claim time, jobs claimed more than job_deadline seconds ago are failed
+        instead so a hung call can't hold the job (and the user's pending slot and reservation) forever.
+        """
+        conn = self._connect_db()
+        now = time.time()
+        claimed_after = now - job_deadline
+
+        try:
+            conn.execute(self.queries["heartbeat_worker"], (worker_id, pid, started_at, now))
+            conn.execute(
+                self.queries["fail_overdue_jobs"],
+                (json.dumps({"error": "deadline exceeded"}), now, worker_id, claimed_after),
+            )
+            conn.execute(self.queries["extend_visibility"], (now + visibility_timeout, worker_id, claimed_after))
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error recording heartbeat for worker {worker_id}: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def register_worker(self, worker_id: str, pid: int) -> bool:
+        conn = self._connect_db()
+        now = time.time()
+
+        try:
+            conn.execute(self.queries["restart_worker"], (worker_id, pid, now, now))
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error registering worker {worker_id}: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def list_workers(self) -> list[dict]:
+        conn = self._connect_db()
+
+        try:
+            return [dict(row) for row in conn.execute(self.queries["list_workers"]).fetchall()]
+
+        except Exception as e:
+            logger.error(f"Error listing workers: {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def fetch_finished(self, limit: int = 50) -> list[dict]:
+        conn = self._connect_db()
+
+        try:
+            jobs = [dict(row) for row in conn.execute(self.queries["fetch_finished_jobs"], (limit,)).fetchall()]
+            for job in jobs:
+                job["payload"] = json.loads(job["payload"])
+                job["result"] = json.loads(job["result"]) if job["result"] else {}
+            return jobs
+
+        except Exception as e:
+            logger.error(f"Error fetching finished jobs: {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def mark_delivered(self, job_ids: list[int]) -> bool:
+        conn = self._connect_db()
+        now = time.time()
+
+        try:
+            conn.executemany(self.queries["mark_job_delivered"], [(now, job_id) for job_id in job_ids])
+            conn.commit()
+            return True
+
+        except Exception as e:
+            logger.error(f"Error marking jobs delivered: {e}")
+            conn.rollback()
+            return False
+
+        finally:
+            conn.close()
+
+    def purge_delivered(self, before: float) -> int:
+        conn = self._connect_db()
+
+        try:
+            cursor = conn.execute(self.queries["purge_delivered_jobs"], (before,))
+            conn.execute(self.queries["purge_job_charges"])
+            conn.execute(self.queries["purge_job_cancels"])
+            conn.commit()
+            return cursor.rowcount
+
+        except Exception as e:
+            logger.error(f"Error purging delivered jobs: {e}")
+            conn.rollback()
+            return 0
+
+        finally:
+            conn.close()
+
+    def list_user_jobs(self, user_id: int, tenant: str) -> list[dict]:
+        """Pending jobs of the user on one bot, payloads from before multi-tenancy count as the default tenant"""
+        conn = self._connect_db()
+
+        try:
+            return [dict(row) for row in conn.execute(self.queries["list_user_jobs"], (user_id, tenant)).fetchall()]
+
+        except Exception as e:
+            logger.error(f"Error listing jobs of user {user_id}: {e}")
+            return []
+
+        finally:
+            conn.close()
+
+    def cancel(self, job_id: int, user_id: int, tenant: str) -> str | None:
+        """'cancelled' for a queued job, closed as delivered. 'cancelling' for a running one: the call can't be
+        taken back, so the job stays pending until it ends and then is settled with its cost, answer dropped.
+        None when the job is no longer pending"""
+        conn = self._connect_db()
+        now = time.time()
+
+        try:
+            if conn.execute(self.queries["cancel_job"], (now, now, job_id, user_id, tenant)).rowcount == 1:
+                outcome = "cancelled"
+            elif conn.execute(self.queries["request_job_cancel"], (now, job_id, user_id, tenant)).rowcount == 1:
+                outcome = "cancelling"
+            else:
+                outcome = None
+
+            conn.commit()
+            return outcome
+
+        except Exception as e:
+            logger.error(f"Error cancelling job {job_id}: {e}")
+            conn.rollback()
+            return None
+
+        finally:
+            conn.close()
+
+    def running_job_ids(self, worker_id: str) -> set[int] | None:
+        conn = self._connect_db()
+
+        try:
+            return {row["job_id"] for row in conn.execute(self.queries["list_worker_running_jobs"], (worker_id,))}
+
+        except Exception as e:
+            logger.error(f"Error listing running jobs of worker {worker_id}: {e}")
+            return None
+
+        finally:
+            conn.close()
+
+    def count_by_status(self) -> dict[str, int]:
+        conn = self._connect_db()
+
+        try:
+            return {row["status"]: row["count"] for row in conn.execute(self.queries["count_jobs_by_status"])}
+
+        except Exception as e:
+            logger.error(f"Error counting jobs: {e}")
+            return {}
+
+        finally:
+            conn.close()
+
+
+instrument_methods(WorkQueue)
+
+
+# Global Function to initalise WorkQueue
+def init_work_queue(db_path: str, query_path: str) -> WorkQueue:
+    global work_queue
+    if work_queue is None:
+        work_queue = WorkQueue(db_path, query_path)
+        logger.info("Initalised WorkQueue")
+
+    return work_queue
+
+
+def get_work_queue() -> WorkQueue:
+    if work_queue is None:
+        raise RuntimeError("WorkQueue is not initialised")
+    return work_queue
@@ -0,0 +1,344 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from dotenv import load_dotenv
+from telegram.error import NetworkError
+from telegram.ext import ContextTypes, JobQueue
+
+from src.database import init_user_mgr, get_user_mgr
+from src.models import init_llm_models, get_llm_models, response_usage
+from src.utils import build_pricing_table
+from src.work_queue import WorkQueue, init_work_queue, get_work_queue
+from src.tracing import RequestTrace, setup_trace_logging
+from src.metrics import Counter, Gauge
+from src.maintenance import maintenance_job, JOB_KWARGS
+from src.sketches import sketches
+from src.tenants import tenants, load_tenants, use_tenant
+from src.tele_common import price_response, record_response, deliver_queued_reply
+from config import (
+    LOG_PATH,
+    QUERY_PATH,
+    DB_MASTER_FPATH,
+    JOBS_DB_FPATH,
+    MODEL_CATALOG_FPATH,
+    CATALOG_POLL_INTERVAL,
+    SKETCH_FLUSH_INTERVAL,
+    MODEL_PRICING,
+    TRACE_MAX_BYTES,
+    TRACE_BACKUP_COUNT,
+    WORKER_CONCURRENCY,
+    WORKER_POLL_INTERVAL,
+    WORKER_HEARTBEAT_INTERVAL,
+    WORKER_VISIBILITY_TIMEOUT,
+    WORKER_MAX_ATTEMPTS,
+    WORKER_JOB_DEADLINE,
+    WORKER_RETRY_BACKOFF,
+    WORKER_SHUTDOWN_TIMEOUT,
+    WORKER_DELIVERY_INTERVAL,
+    WORKER_SUPERVISE_INTERVAL,
+    JOBS_RETENTION_HOURS,
+)
+
+logger = logging.getLogger(__name__)
+
+WORKER_HEARTBEAT_AGE = Gauge("worker_heartbeat_age_seconds", "Seconds since each worker's last heartbeat", ("worker",))
+WORKER_RESTARTS = Counter("worker_restarts_total", "Worker processes restarted by the supervisor", ("worker",))
+QUEUED_JOBS = Gauge("work_queue_jobs", "Undelivered jobs in the work queue", ("status",))
+
+
+# ---- Worker process side ----
+
+
+async def run_llm_query(job_id: int, payload: dict, trace: RequestTrace) -> dict:
+    provider, model_id, message_text = payload["provider"], payload["model_id"], payload["text"]
+    trace.set(provider=provider, model_id=model_id)
+
+    with trace.stage("provider_call"):
+        response_text = await get_llm_models().query_model(provider, model_id, message_text)
+
+    input_tokens, output_tokens, msg_cost = price_response(trace, provider, model_id, message_text, response_text)
+    # A rerun of a job whose worker died after recording it isn't billed again
+    if not await asyncio.to_thread(get_work_queue().claim_charge, job_id):
+        trace.set(already_charged=True)
+        return {"text": response_text, "cost": msg_cost}
+
+    # Charged to the database of the bot the message came in on
+    with use_tenant(tenants.get(payload.get("tenant"))):
+        record_response(
+            trace,
+            get_user_mgr(),
+            payload["user_id"],
+            provider,
+            model_id,
+            input_tokens,
+            output_tokens,
+            msg_cost,
+            response_usage(response_text),
+        )
+    return {"text": response_text, "cost": msg_cost}
+
+
+# kind -> coroutine(job_id, payload, trace) returning the JSON result stored on the job
+JOB_HANDLERS: dict = {
+    "llm_query": run_llm_query,
+}
+
+
+class Worker:
+    def __init__(self, worker_id: str, work_queue: WorkQueue) -> None:
+        self.worker_id = worker_id
+        self.work_queue = work_queue
+        self.started_at = time.time()
+        self.stopping = False
+        # job_id -> task, removed once the handler returns
+        self.tasks: dict[int, asyncio.Task] = {}
+        # Jobs taken away from this worker while their call was running
+        self.dropped: set[int] = set()
+
+    def stop(self) -> None:
+        logger.info(f"Worker {self.worker_id} stopping after {len(self.tasks)} in-flight jobs")
+        self.stopping = True
+
+    def _note_dropped(self, running: set[int]) -> None:
+        """Jobs that are no longer ours (past WORKER_JOB_DEADLINE or reclaimed) aren't cancelled: the
+        HTTP call goes on in its thread until its request timeout and the provider bills it, so it is left to
+        finish and be recorded, only its result is dropped"""
+        for job_id in self.tasks.keys() - running - self.dropped:
+            logger.info(f"Job {job_id} is no longer assigned to {self.worker_id}, its result will be dropped")
+            self.dropped.add(job_id)
+
+    async def _heartbeat_loop(self) -> None:
+        last_catalog_check = last_sketch_flush = time.monotonic()
+        while True:
+            await asyncio.to_thread(
+                self.work_queue.heartbeat,
+                self.worker_id,
+                os.getpid(),
+                self.started_at,
+                WORKER_VISIBILITY_TIMEOUT,
+                WORKER_JOB_DEADLINE,
+            )
+            if self.tasks:
+                running = await asyncio.to_thread(self.work_queue.running_job_ids, self.worker_id)
+                if running is not None:
+                    self._note_dropped(running)
+
+            if time.monotonic() - last_catalog_check >= CATALOG_POLL_INTERVAL:
+                get_llm_models().reload_if_changed()
+                last_catalog_check = time.monotonic()
+
+            if time.monotonic() - last_sketch_flush >= SKETCH_FLUSH_INTERVAL:
+                await asyncio.to_thread(sketches.flush, get_user_mgr(shared=True))
+                last_sketch_flush = time.monotonic()
+
+            await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+    async def execute(self, job: dict) -> None:
+        trace = RequestTrace(
+            f"job_{job['kind']}", job_id=job["job_id"], attempt=job["attempts"], worker=self.worker_id
+        )
+        trace.set(parent_request_id=job["payload"].get("request_id"))
+        handler = JOB_HANDLERS.get(job["kind"])
+
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind {job['kind']}")
+            result = await handler(job["job_id"], job["payload"], trace)
+
+        except asyncio.CancelledError:
+            trace.finish("cancelled")
+            return
+
+        except Exception as e:
+            logger.error(f"Job {job['job_id']} failed on attempt {job['attempts']}: {e}")
+            await asyncio.to_thread(
+                self.work_queue.fail,
+                job["job_id"],
+                self.worker_id,
+                str(e),
+                job["attempts"],
+                WORKER_MAX_ATTEMPTS,
+                WORKER_RETRY_BACKOFF,
+            )
+            trace.finish("error")
+            return
+
+        finally:
+            self.tasks.pop(job["job_id"], None)
+            self.dropped.discard(job["job_id"])
+
+        if not await asyncio.to_thread(self.work_queue.complete, job["job_id"], self.worker_id, result):
+            logger.warning(f"Job {job['job_id']} was cancelled, failed or reclaimed meanwhile, result dropped")
+        trace.finish("ok")
+
+    async def run(self) -> None:
+        await asyncio.to_thread(self.work_queue.register_worker, self.worker_id, os.getpid())
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"Worker {self.worker_id} started (pid {os.getpid()})")
+
+        while not self.stopping:
+            job = None
+            if len(self.tasks) < WORKER_CONCURRENCY:
+                job = await asyncio.to_thread(
+                    self.work_queue.claim, self.worker_id, WORKER_VISIBILITY_TIMEOUT, WORKER_MAX_ATTEMPTS
+                )
+
+            if job is None:
+                await asyncio.sleep(WORKER_POLL_INTERVAL)
+                continue
+
+            self.tasks[job["job_id"]] = asyncio.create_task(self.execute(job))
+
+        # Finish what was claimed, heartbeats keep these jobs from being handed to another worker meanwhile
+        try:
+            if self.tasks:
+                await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        finally:
+            heartbeat_task.cancel()
+
+
+async def _run_process_worker(worker: Worker) -> None:
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, worker.stop)
+    await worker.run()
+
+
+def run_worker(worker_id: str) -> None:
+    """Worker process entry point, runs until SIGTERM"""
+    # Ctrl+C reaches the whole process group, the Telegram process stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    load_dotenv()
+    logging.basicConfig(
+        format=f"%(asctime)s - {worker_id} - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+
+    load_tenants(init_user_mgr(DB_MASTER_FPATH, QUERY_PATH), None, require_tokens=False)
+    llm_models = init_llm_models(MODEL_CATALOG_FPATH)
+    build_pricing_table(MODEL_PRICING)
+    llm_models.add_reload_hook(lambda: build_pricing_table(MODEL_PRICING))
+    work_queue = init_work_queue(JOBS_DB_FPATH, QUERY_PATH)
+
+    # One trace file per process, RotatingFileHandler is not safe across processes
+    trace_fpath = os.path.join(LOG_PATH, f"trace-{worker_id}.jsonl")
+    trace_listener = setup_trace_logging(trace_fpath, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT)
+    try:
+        asyncio.run(_run_process_worker(Worker(worker_id, work_queue)))
+    finally:
+        sketches.flush(get_user_mgr(shared=True))
+        trace_listener.stop()
+
+
+# ---- Telegram process side ----
+
+
+class WorkerPool:
+    """Starts the worker processes and restarts any that exit"""
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        # Spawned rather than forked, the Telegram process already runs threads and an event loop
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.processes: dict[str, multiprocessing.Process] = {}
+
+    def _spawn(self, worker_id: str) -> None:
+        process = self.mp_context.Process(target=run_worker, args=(worker_id,), name=worker_id, daemon=True)
+        process.start()
+        self.processes[worker_id] = process
+
+    def start(self) -> None:
+        for i in range(self.count):
+            self._spawn(f"worker-{i + 1}")
+        logger.info(f"Started {self.count} worker processes")
+
+    def supervise(self) -> None:
+        for worker_id, process in list(self.processes.items()):
+            if not process.is_alive():
+                logger.warning(f"Worker {worker_id} exited with code {process.exitcode}, restarting")
+                WORKER_RESTARTS.inc(worker=worker_id)
+                self._spawn(worker_id)
+
+    def stop(self) -> None:
+        for process in self.processes.values():
+            process.terminate()
+
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+        for worker_id, process in self.processes.items():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {worker_id} did not stop in time, killing it")
+                process.kill()
+
+        self.processes.clear()
+
+
+# kind -> coroutine(bot, job) that answers the user once the job is done or failed
+DELIVERY_HANDLERS: dict = {
+    "llm_query": deliver_queued_reply,
+}
+
+
+async def deliver_results(context: ContextTypes.DEFAULT_TYPE) -> None:
+    work_queue = get_work_queue()
+    jobs = await asyncio.to_thread(work_queue.fetch_finished)
+    if not jobs:
+        return
+
+    delivered = []
+    for job in jobs:
+        # Replies go out through the bot the request came in on
+        tenant = tenants.get(job["payload"].get("tenant"))
+        bot = tenant.bot if tenant is not None and tenant.bot is not None else context.bot
+        try:
+            with use_tenant(tenant):
+                await DELIVERY_HANDLERS[job["kind"]](bot, job)
+
+        except NetworkError as e:
+            # Telegram unreachable, retried on the next run
+            logger.warning(f"Delivery of job {job['job_id']} postponed: {e}")
+            continue
+
+        except Exception as e:
+            logger.error(f"Error delivering job {job['job_id']}: {e}")
+
+        delivered.append(job["job_id"])
+
+    await asyncio.to_thread(work_queue.mark_delivered, delivered)
+
+
+async def supervise_workers(context: ContextTypes.DEFAULT_TYPE) -> None:
+    worker_pool = context.bot_data.get("worker_pool")
+    if worker_pool is not None:
+        worker_pool.supervise()
+
+    work_queue = get_work_queue()
+    now = time.time()
+    for worker in await asyncio.to_thread(work_queue.list_workers):
+        WORKER_HEARTBEAT_AGE.set(now - worker["heartbeat_at"], worker=worker["worker_id"])
+
+    counts = await asyncio.to_thread(work_queue.count_by_status)
+    for status in ("queued", "running", "done", "failed"):
+        QUEUED_JOBS.set(counts.get(status, 0), status=status)
+
+
+@maintenance_job("jobs_purge")
+def purge_jobs(data) -> str:
+    deleted = get_work_queue().purge_delivered(time.time() - JOBS_RETENTION_HOURS * 3600)
+    return f"{deleted} delivered jobs deleted"
+
+
+def schedule_worker_jobs(job_queue: JobQueue | None) -> None:
+    if job_queue is None:
+        logger.error("JobQueue unavailable (install python-telegram-bot[job-queue]), worker results can't be delivered")
+        return
+
+    job_queue.run_repeating(
+        deliver_results, interval=WORKER_DELIVERY_INTERVAL, name="worker_delivery", job_kwargs=JOB_KWARGS
+    )
+    job_queue.run_repeating(
+        supervise_workers, interval=WORKER_SUPERVISE_INTERVAL, name="worker_supervise", job_kwargs=JOB_KWARGS
+    )
+    job_queue.run_repeating(purge_jobs, interval=60 * 60, name="jobs_purge", job_kwargs=JOB_KWARGS)
@@ -0,0 +1,89 @@
+import pytest
+
+from src import budget
+from src.budget import BudgetEngine
+from src.utils import build_pricing_table, pricing_table
+
+CAPS = {
+    "user": {"free": {"daily": 1.0, "monthly": 10.0}, "admin": {"daily": None, "monthly": None}},
+    "provider": {"claude": {"daily": 100.0, "monthly": 1000.0}},
+}
+
+
+@pytest.fixture(autouse=True)
+def models(monkeypatch):
+    build_pricing_table(
+        {
+            "big": {"input_cost": 0.001, "output_cost": 0.0004},
+            "small": {"input_cost": 0.0001, "output_cost": 0.0001},
+        }
+    )
+    monkeypatch.setattr(budget, "MAX_TOKENS", 1000)
+    monkeypatch.setattr(budget, "SYSTEM_PROMPT", None, raising=False)
+    monkeypatch.setattr(budget, "MODEL_CHOICES", {"claude": [{"id": "big"}, {"id": "small"}]})
+    yield
+    pricing_table.clear()
+
+
+def spent(engine: BudgetEngine, user_id: int) -> float:
+    return engine.spend[("user", str(user_id))][1]
+
+
+def test_reserve_holds_the_worst_case():
+    engine = BudgetEngine(CAPS)
+
+    decision = engine.reserve(1, "free", "claude", "big", "hi")
+
+    assert decision.allowed
+    assert decision.model_id == "big"
+    assert decision.reserved == pytest.approx(0.001 * 1 + 0.0004 * 1000)
+    assert spent(engine, 1) == pytest.approx(decision.reserved)
+
+
+def test_settle_swaps_the_reservation_for_the_cost():
+    engine = BudgetEngine(CAPS)
+    decision = engine.reserve(1, "free", "claude", "big", "hi")
+
+    engine.settle(decision, 0.05)
+
+    assert spent(engine, 1) == pytest.approx(0.05)
+    assert engine.spend[("provider", "claude")][3] == pytest.approx(0.05)
+
+
+def test_settle_is_applied_once():
+    engine = BudgetEngine(CAPS)
+    decision = engine.reserve(1, "free", "claude", "big", "hi")
+
+    engine.settle(decision, 0.05)
+    engine.settle(decision, 0.05)
+
+    assert spent(engine, 1) == pytest.approx(0.05)
+
+
+def test_concurrent_reservations_share_the_cap():
+    engine = BudgetEngine(CAPS, allow_downgrade=False)
+
+    decisions = [engine.reserve(1, "free", "claude", "big", "hi") for _ in range(3)]
+
+    # Two worst cases of ~0.4 fit under the 1.0 daily cap, the third doesn't
+    assert [d.allowed for d in decisions] == [True, True, False]
+    assert decisions[2].reason == "daily user budget"
+
+
+def test_reserve_downgrades_when_the_model_doesnt_fit():
+    engine = BudgetEngine(CAPS)
+    engine.seed([{"user_id": 1, "access_level": "free", "provider": "claude", "is_today": True, "cost": 0.8}])
+
+    decision = engine.reserve(1, "free", "claude", "big", "hi")
+
+    assert decision.allowed
+    assert decision.model_id == "small"
+
+
+def test_uncapped_level_and_unpriced_model_pass():
+    engine = BudgetEngine(CAPS)
+
+    assert engine.reserve(1, "admin", "claude", "big", "hi " * 10_000).allowed
+    unpriced = engine.reserve(1, "free", "claude", "unknown", "hi")
+    assert unpriced.allowed
+    assert unpriced.reserved == 0.0
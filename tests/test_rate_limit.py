@@ -0,0 +1,60 @@
+import pytest
+
+from src.rate_limit import RateLimiter
+
+LIMITS = {
+    "free": {"per_minute": 2, "per_hour": 5},
+    "premium": {"per_minute": 4, "per_hour": None},
+    "admin": {"per_minute": None, "per_hour": None},
+}
+NOW = 1_800_000_000.0
+
+
+def test_over_the_minute_limit_waits_for_a_bucket():
+    limiter = RateLimiter(LIMITS, 10)
+
+    assert limiter.check("a", NOW) is None
+    assert limiter.check("a", NOW + 1) is None
+    # The oldest message leaves the window with its 5s bucket
+    assert limiter.check("a", NOW + 2) == pytest.approx(58)
+    assert limiter.check("a", NOW + 60) is None
+
+
+def test_refused_messages_are_not_counted():
+    limiter = RateLimiter(LIMITS, 10)
+    for second in range(0, 600, 30):
+        limiter.check("a", NOW + second)
+
+    # 5 per hour let through, the rest refused
+    assert limiter.check("a", NOW + 3600) is None
+
+
+def test_tier_survives_eviction():
+    limiter = RateLimiter(LIMITS, 2)
+    limiter.set_tier("a", "premium")
+    for key in "abcde":
+        limiter.check(key, NOW)
+
+    assert "a" not in limiter.slots
+    assert [limiter.check("a", NOW + 1) for _ in range(5)][-2:] == [None, pytest.approx(59)]
+
+
+def test_eviction_skips_recently_seen_users():
+    limiter = RateLimiter(LIMITS, 3)
+    for key in "abcd":
+        limiter.check(key, NOW)
+    limiter.check("b", NOW)
+    limiter.check("e", NOW)
+
+    assert set(limiter.slots) == {"b", "d", "e"}
+    # An evicted user starts with empty windows
+    limiter.check("c", NOW)
+    assert limiter.check("c", NOW) is None
+
+
+def test_notify_once_per_cooldown():
+    limiter = RateLimiter(LIMITS, 10)
+
+    assert limiter.should_notify("a", 10, NOW)
+    assert not limiter.should_notify("a", 10, NOW + 5)
+    assert limiter.should_notify("a", 10, NOW + 11)
@@ -0,0 +1,209 @@
+import os
+import time
+
+import pytest
+
+from src.work_queue import WorkQueue
+
+QUERY_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "query")
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / "jobs.db"), QUERY_PATH)
+
+
+def test_claim_takes_jobs_by_priority_then_age(queue):
+    low = queue.enqueue("llm_query", {"n": 1}, priority=3)
+    first = queue.enqueue("llm_query", {"n": 2})
+    second = queue.enqueue("llm_query", {"n": 3})
+
+    claimed = [queue.claim("w1", 60, 3)["job_id"] for _ in range(3)]
+
+    assert claimed == [first, second, low]
+    assert queue.claim("w1", 60, 3) is None
+
+
+def test_claim_skips_delayed_jobs(queue):
+    queue.enqueue("llm_query", {}, delay=60)
+
+    assert queue.claim("w1", 60, 3) is None
+
+
+def test_claim_counts_attempts(queue):
+    job_id = queue.enqueue("llm_query", {"text": "hi"})
+
+    job = queue.claim("w1", 60, 3)
+
+    assert job == {"job_id": job_id, "kind": "llm_query", "payload": {"text": "hi"}, "attempts": 1}
+
+
+def test_retry_requeues_with_backoff(queue):
+    job_id = queue.enqueue("llm_query", {})
+    job = queue.claim("w1", 60, 3)
+
+    assert queue.fail(job_id, "w1", "timeout", job["attempts"], 3, backoff=60)
+    assert queue.count_by_status() == {"queued": 1}
+    # Not visible again until the backoff has passed
+    assert queue.claim("w2", 60, 3) is None
+
+
+def test_retry_is_claimable_again(queue):
+    job_id = queue.enqueue("llm_query", {})
+    queue.claim("w1", 60, 3)
+    queue.fail(job_id, "w1", "timeout", 1, 3, backoff=0)
+
+    job = queue.claim("w2", 60, 3)
+
+    assert job["job_id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_fail_after_max_attempts(queue):
+    job_id = queue.enqueue("llm_query", {})
+    queue.claim("w1", 60, 1)
+    queue.fail(job_id, "w1", "timeout", 1, 1, backoff=0)
+
+    [job] = queue.fetch_finished()
+
+    assert job["status"] == "failed"
+    assert job["result"] == {"error": "timeout"}
+    assert queue.claim("w1", 60, 1) is None
+
+
+def test_complete_delivers_result(queue):
+    job_id = queue.enqueue("llm_query", {"text": "hi"})
+    queue.claim("w1", 60, 3)
+
+    assert queue.complete(job_id, "w1", {"text": "hello", "cost": 0.01})
+
+    [job] = queue.fetch_finished()
+    assert job["status"] == "done"
+    assert job["result"] == {"text": "hello", "cost": 0.01}
+
+    queue.mark_delivered([job_id])
+    assert queue.fetch_finished() == []
+
+
+def test_visibility_expiry_lets_another_worker_claim(queue):
+    job_id = queue.enqueue("llm_query", {})
+    # Visibility already over, as if the worker died right after claiming
+    queue.claim("w1", -1, 3)
+
+    job = queue.claim("w2", 60, 3)
+
+    assert job["job_id"] == job_id
+    assert job["attempts"] == 2
+    # The first worker lost the job, its late result is ignored
+    assert not queue.complete(job_id, "w1", {"text": "late"})
+    assert queue.complete(job_id, "w2", {"text": "hello"})
+
+
+def test_heartbeat_keeps_the_job_invisible(queue):
+    queue.enqueue("llm_query", {})
+    queue.claim("w1", 0, 3)
+
+    queue.heartbeat("w1", 1, time.time(), 60, job_deadline=600)
+
+    assert queue.claim("w2", 60, 3) is None
+
+
+def test_fail_exhausted_jobs_on_claim(queue):
+    job_id = queue.enqueue("llm_query", {})
+    for _ in range(3):
+        queue.claim("w1", -1, 3)
+
+    # Abandoned with every attempt used, failed instead of being claimed a fourth time
+    assert queue.claim("w2", 60, 3) is None
+
+    [job] = queue.fetch_finished()
+    assert job["job_id"] == job_id
+    assert job["status"] == "failed"
+    assert job["result"] == {"error": "worker lost"}
+
+
+def test_claim_charge_is_idempotent(queue):
+    job_id = queue.enqueue("llm_query", {})
+
+    assert queue.claim_charge(job_id)
+    assert not queue.claim_charge(job_id)
+
+
+def test_purge_drops_delivered_jobs_and_their_charges(queue):
+    job_id = queue.enqueue("llm_query", {})
+    queue.claim("w1", 60, 3)
+    queue.claim_charge(job_id)
+    queue.complete(job_id, "w1", {"text": "hello"})
+    queue.mark_delivered([job_id])
+
+    assert queue.purge_delivered(time.time() + 1) == 1
+    # A job id reused after the purge is billed again
+    assert queue.claim_charge(job_id)
+
+
+def test_heartbeat_fails_jobs_past_the_deadline(queue):
+    job_id = queue.enqueue("llm_query", {})
+    queue.claim("w1", 60, 3)
+
+    # Claimed longer ago than the deadline allows
+    queue.heartbeat("w1", 1, time.time(), 60, job_deadline=-1)
+
+    [job] = queue.fetch_finished()
+    assert job["job_id"] == job_id
+    assert job["result"] == {"error": "deadline exceeded"}
+    assert not queue.complete(job_id, "w1", {"text": "late"})
+
+
+def test_cancel_queued_job_closes_it(queue):
+    job_id = queue.enqueue("llm_query", {"user_id": 7})
+
+    assert queue.cancel(job_id, 7, "default") == "cancelled"
+    assert queue.claim("w1", 60, 3) is None
+    assert queue.fetch_finished() == []
+    assert queue.list_user_jobs(7, "default") == []
+
+
+def test_cancel_only_own_jobs(queue):
+    job_id = queue.enqueue("llm_query", {"user_id": 7, "tenant": "other"})
+
+    assert queue.cancel(job_id, 8, "other") is None
+    assert queue.cancel(job_id, 7, "default") is None
+    assert queue.cancel(job_id, 7, "other") == "cancelled"
+
+
+def test_cancel_running_job_waits_for_the_call(queue):
+    job_id = queue.enqueue("llm_query", {"user_id": 7})
+    queue.claim("w1", 60, 3)
+
+    assert queue.cancel(job_id, 7, "default") == "cancelling"
+    # Still pending, so it keeps its slot until the call ends
+    [pending] = queue.list_user_jobs(7, "default")
+    assert pending["cancel_requested"]
+
+    queue.complete(job_id, "w1", {"text": "hello", "cost": 0.01})
+
+    [job] = queue.fetch_finished()
+    assert job["cancel_requested"]
+    assert job["result"]["cost"] == 0.01
+
+
+def test_cancelled_running_job_is_not_retried(queue):
+    job_id = queue.enqueue("llm_query", {"user_id": 7})
+    queue.claim("w1", 60, 3)
+    queue.cancel(job_id, 7, "default")
+
+    queue.fail(job_id, "w1", "timeout", 1, 3, backoff=0)
+
+    [job] = queue.fetch_finished()
+    assert job["status"] == "failed"
+    assert job["cancel_requested"]
+
+
+def test_cancelled_job_of_a_lost_worker_is_failed(queue):
+    job_id = queue.enqueue("llm_query", {"user_id": 7})
+    queue.claim("w1", -1, 3)
+    queue.cancel(job_id, 7, "default")
+
+    assert queue.claim("w2", 60, 3) is None
+    [job] = queue.fetch_finished()
+    assert job["result"] == {"error": "worker lost"}
@@ -0,0 +1,80 @@
+"""Summarise stage latency percentiles from the handle_message JSONL traces.
+
+Usage: python tools/analyze_traces.py [--dir logs] [--since 2025-01-01] [--name handle_message]
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+
+from datetime import datetime
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_PATH)
+
+from src.query_profiler import percentile  # noqa: E402
+
+
+def load_traces(log_dir: str, name: str | None, since: float | None):
+    # Rotated files are trace.jsonl.N (worker processes write trace-<worker>.jsonl), oldest has the highest suffix
+    for fpath in sorted(glob.glob(os.path.join(log_dir, "trace*.jsonl*")), reverse=True):
+        with open(fpath, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    trace = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                if name and trace.get("name") != name:
+                    continue
+                if since and trace.get("ts", 0) < since:
+                    continue
+
+                yield trace
+
+
+def summarise(traces) -> tuple[dict[str, list[float]], dict[str, int]]:
+    durations: dict[str, list[float]] = {}
+    outcomes: dict[str, int] = {}
+
+    for trace in traces:
+        outcomes[trace.get("status", "unknown")] = outcomes.get(trace.get("status", "unknown"), 0) + 1
+        durations.setdefault("total", []).append(trace.get("total_ms", 0.0))
+
+        for stage in trace.get("stages", []):
+            durations.setdefault(stage["stage"], []).append(stage["duration_ms"])
+
+    return durations, outcomes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=os.path.join(os.getcwd(), "logs"), help="directory holding trace*.jsonl*")
+    parser.add_argument("--name", default="handle_message", help="trace name to include (empty for all)")
+    parser.add_argument("--since", default=None, help="only include traces from this ISO date/time")
+    args = parser.parse_args()
+
+    since = datetime.fromisoformat(args.since).timestamp() if args.since else None
+    durations, outcomes = summarise(load_traces(args.dir, args.name or None, since))
+
+    if not durations:
+        print(f"No traces found in {args.dir}")
+        return
+
+    print(f"Requests: {len(durations['total'])}  " + "  ".join(f"{k}={v}" for k, v in sorted(outcomes.items())))
+    print()
+    print(f"{'stage':<22}{'count':>8}{'p50 ms':>12}{'p90 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+
+    for stage, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        values.sort()
+        print(
+            f"{stage:<22}{len(values):>8}"
+            f"{percentile(values, 50):>12.1f}{percentile(values, 90):>12.1f}"
+            f"{percentile(values, 99):>12.1f}{values[-1]:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
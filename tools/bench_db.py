@@ -0,0 +1,361 @@
+"""Benchmark every UserManager method and every named query in query/common.sql against a database.
+
+Runs on a temporary copy of --db (writes included) unless --in-place is given; named write queries are
+additionally rolled back after each call. Arguments are sampled from the data so lookups hit real rows.
+Build a large database first with tools/gen_synthetic_db.py, save a run with --json and pass it back
+as --baseline after a schema or query change to see the p50 difference per entry.
+
+Usage: python tools/bench_db.py [--db data/synthetic.db] [--iterations 50] [--warmup 3] [--only 'get_.*']
+           [--json bench.json] [--baseline previous.json] [--in-place]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import inspect
+import sqlite3
+import argparse
+import tempfile
+
+from datetime import datetime
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_PATH)
+
+from src.database import UserManager  # noqa: E402
+from src.sketches import DDSketch, SKETCH_METRICS  # noqa: E402
+from src.query_profiler import percentile  # noqa: E402
+
+
+def load_sample(db_path: str) -> dict:
+    """Real IDs and boundaries to draw benchmark arguments from"""
+    conn = sqlite3.connect(db_path)
+    try:
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM users")]
+        free_ids = [row[0] for row in conn.execute("SELECT user_id FROM users WHERE access_level = 'free'")]
+        cursors = conn.execute("SELECT last_active_at, user_id FROM users ORDER BY random() LIMIT 100").fetchall()
+        model_ids = [row[0] for row in conn.execute("SELECT DISTINCT model_id FROM messages LIMIT 50")]
+        providers = [row[0] for row in conn.execute("SELECT provider FROM provider_stats")]
+        oldest_prompt = conn.execute("SELECT MIN(created_at) FROM prompt_cache").fetchone()[0]
+    finally:
+        conn.close()
+
+    if not user_ids:
+        raise SystemExit(f"{db_path} has no users, generate one with tools/gen_synthetic_db.py")
+
+    return {
+        "user_ids": user_ids,
+        "free_ids": free_ids or user_ids,
+        "cursors": cursors or [("9999-12-31 23:59:59", 0)],
+        "model_ids": model_ids or ["gpt-4o"],
+        "providers": providers or ["chatgpt"],
+        "oldest_prompt": oldest_prompt or time.time(),
+    }
+
+
+def sample_sketch(rng: random.Random) -> DDSketch:
+    sketch = DDSketch()
+    for _ in range(100):
+        sketch.add(rng.lognormvariate(0, 1))
+    return sketch
+
+
+def sample_sketches(rng: random.Random, sample: dict) -> dict[tuple[str, str, str], DDSketch]:
+    """One flush worth of sketches: every metric of a few models"""
+    return {
+        (rng.choice(sample["providers"]), model_id, metric): sample_sketch(rng)
+        for model_id in rng.sample(sample["model_ids"], min(3, len(sample["model_ids"])))
+        for metric in SKETCH_METRICS
+    }
+
+
+# name -> (rng, sample) -> positional args. Every public UserManager method needs an entry
+METHOD_SPECS = {
+    "register_user": lambda rng, s: (rng.choice(s["user_ids"]), "bench", "Bench", None),
+    "validate_user": lambda rng, s: (rng.choice(s["user_ids"]),),
+    "record_msg": lambda rng, s: (
+        rng.choice(s["user_ids"]),
+        rng.choice(s["providers"]),
+        rng.choice(s["model_ids"]),
+        rng.randint(10, 2000),
+        rng.randint(10, 2000),
+        rng.uniform(0.0001, 0.05),
+    ),
+    "get_user": lambda rng, s: (rng.choice(s["user_ids"]),),
+    "get_user_count": lambda rng, s: (),
+    "get_active_users": lambda rng, s: (7,),
+    "get_total_cost": lambda rng, s: (),
+    "get_provider_stats": lambda rng, s: (),
+    "get_daily_stats": lambda rng, s: (7,),
+    "list_users": lambda rng, s: (10,),
+    "list_free_user": lambda rng, s: (5,),
+    "list_users_page": lambda rng, s: (
+        rng.choice(("all", "free", "premium")),
+        tuple(rng.choice(s["cursors"])),
+        rng.choice(("next", "prev")),
+        10,
+    ),
+    "iter_export_rows": lambda rng, s: ("users",),
+    "update_user_access": lambda rng, s: (rng.choice(s["user_ids"]), rng.choice(("free", "premium"))),
+    "reset_free_queries": lambda rng, s: (rng.choice(s["free_ids"]), 30),
+    "find_inactive_free_users": lambda rng, s: (30,),
+    "bulk_update_access": lambda rng, s: (rng.sample(s["user_ids"], min(100, len(s["user_ids"]))), "free"),
+    "bulk_add_credits": lambda rng, s: (rng.sample(s["user_ids"], min(100, len(s["user_ids"]))), 5),
+    "refill_free_quota": lambda rng, s: (30,),
+    "refresh_rollups": lambda rng, s: (),
+    "optimize_db": lambda rng, s: (),
+    "checkpoint_wal": lambda rng, s: (),
+    "get_month_spend": lambda rng, s: (),
+    "store_cached_prompt": lambda rng, s: (
+        rng.choice(s["model_ids"]),
+        rng.getrandbits(64) - (1 << 63),
+        "x" * 500,
+        time.time(),
+    ),
+    "load_cached_prompts": lambda rng, s: (time.time() - 86400,),
+    # Only the oldest hour, so repeated runs don't empty the cache
+    "prune_cached_prompts": lambda rng, s: (s["oldest_prompt"] + 3600,),
+    "merge_sketches": lambda rng, s: (sample_sketches(rng, s),),
+    "load_sketches": lambda rng, s: (),
+    "claim_update": lambda rng, s: (rng.choice(s["user_ids"]), rng.randint(1, 10**9), rng.randint(1, 10**9)),
+    "get_update_reply": lambda rng, s: (rng.choice(s["user_ids"]), rng.randint(1, 10**9)),
+    "complete_update": lambda rng, s: (rng.choice(s["user_ids"]), rng.randint(1, 10**9), "x" * 500),
+    "get_committed_update_id": lambda rng, s: (),
+    "prune_processed_updates": lambda rng, s: (time.time() - 48 * 3600,),
+}
+
+# name -> (rng, sample) -> query parameters. Every named query in common.sql needs an entry
+QUERY_SPECS = {
+    "find_user": lambda rng, s: (rng.choice(s["user_ids"]),),
+    "update_existing_user": lambda rng, s: ("bench", None, None, rng.choice(s["user_ids"])),
+    "add_new_user": lambda rng, s: (rng.randint(1, 10**6), "bench", "Bench", None, 30),
+    "validate_user": lambda rng, s: (rng.choice(s["user_ids"]),),
+    "minus_free_query": lambda rng, s: (rng.choice(s["free_ids"]),),
+    "add_query_count": lambda rng, s: (rng.choice(s["user_ids"]),),
+    "register_msg": lambda rng, s: (
+        rng.choice(s["user_ids"]),
+        rng.choice(s["providers"]),
+        rng.choice(s["model_ids"]),
+        500,
+        800,
+        0.01,
+    ),
+    "update_provider_stats": lambda rng, s: (500, 800, 1300, 0.01, rng.choice(s["providers"])),
+    "update_provider_cache_stats": lambda rng, s: (rng.choice(s["providers"]), 1500, 1024, 0),
+    "get_users_count": lambda rng, s: (),
+    "get_active_users_count": lambda rng, s: ("-7 days",),
+    "get_total_cost": lambda rng, s: (),
+    "get_provider_stats": lambda rng, s: (),
+    "get_daily_stats": lambda rng, s: (7,),
+    "get_recent_users": lambda rng, s: (10,),
+    "get_free_users": lambda rng, s: (5,),
+    "get_users_page_next": lambda rng, s: ("all", "all", *rng.choice(s["cursors"]), 10),
+    "get_users_page_prev": lambda rng, s: ("free", "free", *rng.choice(s["cursors"]), 10),
+    "export_users": lambda rng, s: (),
+    "export_messages": lambda rng, s: (),
+    "admin_change_user_role": lambda rng, s: ("premium", rng.choice(s["user_ids"])),
+    "admin_add_credit": lambda rng, s: (30, rng.choice(s["user_ids"])),
+    "find_existing_users": lambda rng, s: (json.dumps(rng.sample(s["user_ids"], min(100, len(s["user_ids"])))),),
+    "find_inactive_free_users": lambda rng, s: ("-30 days",),
+    "admin_bulk_add_credit": lambda rng, s: (5, rng.choice(s["user_ids"])),
+    "refill_free_quota": lambda rng, s: (30,),
+    "refresh_provider_stats": lambda rng, s: (),
+    "analyze_db": lambda rng, s: (),
+    "optimize_db": lambda rng, s: (),
+    "wal_checkpoint": lambda rng, s: (),
+    "get_month_spend": lambda rng, s: (),
+    "store_cached_prompt": lambda rng, s: (rng.choice(s["model_ids"]), rng.getrandbits(63), "x" * 500, time.time()),
+    "load_cached_prompts": lambda rng, s: (time.time() - 86400,),
+    "prune_cached_prompts": lambda rng, s: (time.time() - 3600,),
+    "get_sketch": lambda rng, s: (rng.choice(s["providers"]), rng.choice(s["model_ids"]), "latency"),
+    "upsert_sketch": lambda rng, s: (
+        rng.choice(s["providers"]),
+        rng.choice(s["model_ids"]),
+        "latency",
+        sample_sketch(rng).to_json(),
+        time.time(),
+    ),
+    "load_sketches": lambda rng, s: (),
+    "claim_update": lambda rng, s: (
+        rng.choice(s["user_ids"]),
+        rng.randint(1, 10**9),
+        rng.randint(1, 10**9),
+        time.time(),
+    ),
+    "get_update_reply": lambda rng, s: (rng.choice(s["user_ids"]), rng.randint(1, 10**9)),
+    "complete_update": lambda rng, s: ("x" * 500, rng.choice(s["user_ids"]), rng.randint(1, 10**9)),
+    "get_committed_update_id": lambda rng, s: (),
+    "prune_processed_updates": lambda rng, s: (time.time() - 48 * 3600,),
+}
+
+# Can't run inside the rollback transaction (a checkpoint there only reports busy)
+NO_TRANSACTION = {"wal_checkpoint"}
+
+
+def public_methods() -> list[str]:
+    return [name for name, _ in inspect.getmembers(UserManager, inspect.isfunction) if not name.startswith("_")]
+
+
+def bench_method(user_mgr: UserManager, name: str, make_args, rng, sample, iterations: int, warmup: int):
+    method = getattr(user_mgr, name)
+    durations = []
+
+    for i in range(warmup + iterations):
+        args = make_args(rng, sample)
+        started = time.perf_counter()
+        result = method(*args)
+        if inspect.isgenerator(result):
+            for _ in result:
+                pass
+        elapsed = time.perf_counter() - started
+
+        if i >= warmup:
+            durations.append(elapsed)
+
+    return durations
+
+
+def bench_query(
+    conn: sqlite3.Connection, name: str, query: str, make_params, rng, sample, iterations: int, warmup: int
+):
+    durations = []
+
+    for i in range(warmup + iterations):
+        params = make_params(rng, sample)
+        in_transaction = name not in NO_TRANSACTION
+
+        started = time.perf_counter()
+        if in_transaction:
+            conn.execute("BEGIN")
+        conn.execute(query, params).fetchall()
+        if in_transaction:
+            conn.execute("ROLLBACK")
+        elapsed = time.perf_counter() - started
+
+        if i >= warmup:
+            durations.append(elapsed)
+
+    return durations
+
+
+def summarise(kind: str, name: str, durations: list[float]) -> dict:
+    millis = sorted(duration * 1000 for duration in durations)
+    total = sum(durations)
+    return {
+        "kind": kind,
+        "name": name,
+        "count": len(millis),
+        "ops_per_sec": len(millis) / total if total else 0.0,
+        "p50_ms": percentile(millis, 50),
+        "p90_ms": percentile(millis, 90),
+        "p99_ms": percentile(millis, 99),
+    }
+
+
+def run(args: argparse.Namespace, db_path: str) -> list[dict]:
+    rng = random.Random(args.seed)
+    only = re.compile(args.only) if args.only else None
+    sample = load_sample(db_path)
+    user_mgr = UserManager(db_path, args.query_path)
+
+    for name in sorted(set(public_methods()) - set(METHOD_SPECS)):
+        print(f"WARNING: no benchmark spec for UserManager.{name}", file=sys.stderr)
+    for name in sorted(set(user_mgr.queries) - set(QUERY_SPECS)):
+        print(f"WARNING: no benchmark spec for named query {name}", file=sys.stderr)
+
+    results = []
+    for name, make_args in METHOD_SPECS.items():
+        if not hasattr(user_mgr, name) or (only and not only.search(name)):
+            continue
+        durations = bench_method(user_mgr, name, make_args, rng, sample, args.iterations, args.warmup)
+        results.append(summarise("method", name, durations))
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        for name, make_params in QUERY_SPECS.items():
+            if name not in user_mgr.queries or (only and not only.search(name)):
+                continue
+            durations = bench_query(
+                conn, name, user_mgr.queries[name], make_params, rng, sample, args.iterations, args.warmup
+            )
+            results.append(summarise("query", name, durations))
+    finally:
+        conn.close()
+
+    return results
+
+
+def print_results(results: list[dict], baseline: dict[tuple[str, str], dict]) -> None:
+    header = f"{'kind':<8}{'name':<28}{'count':>7}{'ops/s':>11}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+    print(header + (f"{'p50 vs base':>13}" if baseline else ""))
+
+    for result in results:
+        line = (
+            f"{result['kind']:<8}{result['name']:<28}{result['count']:>7}{result['ops_per_sec']:>11.1f}"
+            f"{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+        )
+        base = baseline.get((result["kind"], result["name"]))
+        if base and base["p50_ms"]:
+            line += f"{(result['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100:>+12.1f}%"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(BASE_PATH, "data", "synthetic.db"), help="database to benchmark")
+    parser.add_argument("--iterations", type=int, default=50, help="timed calls per method / query")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls before measuring")
+    parser.add_argument("--only", default=None, help="regex on method / query names to include")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--baseline", default=None, help="results file of an earlier run to compare p50 against")
+    parser.add_argument("--in-place", action="store_true", help="run against --db itself instead of a copy")
+    parser.add_argument("--query-path", default=os.path.join(BASE_PATH, "query"))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise SystemExit(f"{args.db} not found, generate one with tools/gen_synthetic_db.py")
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = {(result["kind"], result["name"]): result for result in json.load(file)["results"]}
+
+    if args.in_place:
+        results = run(args, args.db)
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix="bench_db_")
+        try:
+            db_path = os.path.join(tmp_dir, os.path.basename(args.db))
+            # Backup API copies a consistent snapshot including anything still in the WAL
+            src, dst = sqlite3.connect(args.db), sqlite3.connect(db_path)
+            src.backup(dst)
+            src.close()
+            dst.close()
+            results = run(args, db_path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(
+                {
+                    "db": args.db,
+                    "ran_at": datetime.now().isoformat(timespec="seconds"),
+                    "iterations": args.iterations,
+                    "seed": args.seed,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
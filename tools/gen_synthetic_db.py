@@ -0,0 +1,217 @@
+"""Build a reproducible synthetic bot database with the real schema (query/init_db.sql).
+
+User activity is heavy-tailed (a few users send most messages), providers and models follow the given
+mix and message timestamps are spread over the last --days days. The same --seed gives the same data
+(timestamps are relative to when the generator runs, so "last 7 days" queries always hit rows).
+
+Usage: python tools/gen_synthetic_db.py [--out data/synthetic.db] [--users 10000] [--messages 1000000]
+           [--days 180] [--provider-mix claude=0.3,chatgpt=0.4,deepseek=0.2,perplexity=0.1] [--seed 42]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import itertools
+
+from datetime import datetime, timedelta
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_PATH)
+
+from src.database import UserManager  # noqa: E402
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    """"a=0.3,b=0.7" -> {"a": 0.3, "b": 0.7}, weights don't have to sum to 1"""
+    mix = {}
+    for part in text.split(","):
+        key, _, weight = part.partition("=")
+        mix[key.strip()] = float(weight)
+    return mix
+
+
+def load_catalog_models(catalog_fpath: str) -> dict[str, list[tuple[str, dict]]]:
+    """provider (lowercase, as stored in messages) -> [(model_id, pricing)]"""
+    with open(catalog_fpath, "r") as file:
+        catalog = json.load(file)
+
+    return {
+        provider.lower(): [(model["id"], model["pricing"]) for model in spec["models"]]
+        for provider, spec in catalog["providers"].items()
+    }
+
+
+def generate_users(rng: random.Random, count: int, access_mix: dict[str, float], start: datetime, days: int):
+    levels, weights = list(access_mix), list(access_mix.values())
+    for user_id in range(1, count + 1):
+        registered_at = start + timedelta(seconds=rng.uniform(0, days * 86400))
+        yield {
+            "user_id": 10_000_000 + user_id,
+            "username": f"user{user_id}",
+            "first_name": f"First{user_id}",
+            "last_name": f"Last{user_id}",
+            "access_level": rng.choices(levels, weights)[0],
+            "remaining_free_queries": rng.randint(0, 30),
+            "registered_at": registered_at,
+        }
+
+
+def generate_messages(
+    rng: random.Random,
+    users: list[dict],
+    count: int,
+    provider_mix: dict[str, float],
+    models: dict[str, list[tuple[str, dict]]],
+    end: datetime,
+):
+    # Pareto activity weights give the long tail real usage has
+    cum_weights = list(itertools.accumulate(rng.paretovariate(1.2) for _ in users))
+    providers = [provider for provider in provider_mix if provider in models]
+    provider_weights = [provider_mix[provider] for provider in providers]
+
+    for _ in range(count):
+        user = rng.choices(users, cum_weights=cum_weights)[0]
+        provider = rng.choices(providers, provider_weights)[0]
+        model_id, pricing = rng.choice(models[provider])
+
+        input_tokens = max(1, int(rng.lognormvariate(4.5, 1.0)))
+        output_tokens = max(1, int(rng.lognormvariate(5.5, 0.8)))
+        search_used = "search_cost" in pricing
+        cost = (
+            input_tokens * pricing["input_cost"]
+            + output_tokens * pricing["output_cost"]
+            + (pricing["search_cost"] if search_used else 0)
+        )
+
+        span = (end - user["registered_at"]).total_seconds()
+        created_at = user["registered_at"] + timedelta(seconds=rng.uniform(0, max(span, 1)))
+        if created_at > user["last_active_at"]:
+            user["last_active_at"] = created_at
+        user["total_queries"] += 1
+
+        yield (
+            user["user_id"],
+            provider,
+            model_id,
+            input_tokens,
+            output_tokens,
+            cost,
+            search_used,
+            created_at.strftime(TIMESTAMP_FORMAT),
+        )
+
+
+def build(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=args.days)
+
+    if os.path.exists(args.out):
+        if not args.force:
+            raise SystemExit(f"{args.out} exists, pass --force to overwrite")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.out + suffix):
+                os.remove(args.out + suffix)
+
+    # Creates the file with the real schema
+    user_mgr = UserManager(args.out, args.query_path)
+    conn = sqlite3.connect(args.out)
+
+    # Bulk load only, the real bot keeps the defaults
+    conn.execute("PRAGMA synchronous = OFF")
+
+    started = time.perf_counter()
+    users = list(generate_users(rng, args.users, parse_mix(args.access_mix), start, args.days))
+    for user in users:
+        user["last_active_at"] = user["registered_at"]
+        user["total_queries"] = 0
+
+    models = load_catalog_models(args.catalog)
+    messages = generate_messages(rng, users, args.messages, parse_mix(args.provider_mix), models, end)
+
+    written = 0
+    while batch := list(itertools.islice(messages, args.batch)):
+        conn.executemany(
+            "INSERT INTO messages (user_id, provider, model_id, input_tokens, output_tokens, query_cost, "
+            "search_used, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            batch,
+        )
+        conn.commit()
+        written += len(batch)
+        print(f"\rmessages {written}/{args.messages}", end="", flush=True)
+    print()
+
+    conn.executemany(
+        "INSERT INTO users (user_id, username, first_name, last_name, access_level, remaining_free_queries, "
+        "total_queries, registered_at, last_active_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (
+                user["user_id"],
+                user["username"],
+                user["first_name"],
+                user["last_name"],
+                user["access_level"],
+                user["remaining_free_queries"],
+                user["total_queries"],
+                user["registered_at"].strftime(TIMESTAMP_FORMAT),
+                user["last_active_at"].strftime(TIMESTAMP_FORMAT),
+            )
+            for user in users
+        ],
+    )
+
+    # Cached prompts (fingerprints as signed 64-bit like src/prompt_cache.py stores them)
+    model_ids = [model_id for provider_models in models.values() for model_id, _ in provider_models]
+    now = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO prompt_cache (model_id, fingerprint, response, created_at) VALUES (?, ?, ?, ?)",
+        [
+            (
+                rng.choice(model_ids),
+                rng.getrandbits(64) - (1 << 63),
+                "x" * rng.randint(50, 2000),
+                now - rng.uniform(0, 86400),
+            )
+            for _ in range(args.cached_prompts)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    # Same maintenance the bot runs: provider_stats rollup, planner statistics, WAL folded back in
+    user_mgr.refresh_rollups()
+    user_mgr.optimize_db()
+    user_mgr.checkpoint_wal()
+
+    size_mb = os.path.getsize(args.out) / (1024 * 1024)
+    print(
+        f"Wrote {args.out}: {args.users} users, {written} messages, {args.cached_prompts} cached prompts, "
+        f"{size_mb:.1f} MB in {time.perf_counter() - started:.1f}s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=os.path.join(BASE_PATH, "data", "synthetic.db"), help="database file")
+    parser.add_argument("--force", action="store_true", help="overwrite an existing file")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=180, help="spread of registrations and messages")
+    parser.add_argument("--provider-mix", default="claude=0.3,chatgpt=0.4,deepseek=0.2,perplexity=0.1")
+    parser.add_argument("--access-mix", default="free=0.85,premium=0.14,admin=0.01")
+    parser.add_argument("--cached-prompts", type=int, default=5_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch", type=int, default=50_000, help="messages per insert transaction")
+    parser.add_argument("--query-path", default=os.path.join(BASE_PATH, "query"))
+    parser.add_argument("--catalog", default=os.path.join(BASE_PATH, "model_catalog.json"))
+    build(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
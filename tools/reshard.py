@@ -0,0 +1,214 @@
+"""Split the users and messages of a bot database into shard files by user_id (see config.DB_SHARDS).
+
+Rows are copied from --db (or its --from-shards existing shards) into new files next to it, routed by the same
+user_id hash the bot uses, and the copy is checked by row counts before the new files replace the old shards.
+Provider rollups are rebuilt per shard and the provider cache counters go to shard 0. --db keeps the shared
+tables (prompt cache, sketches, processed updates); its own users / messages stay unless --prune is given.
+Stop the bot (and its workers) first, then set DB_SHARDS to --shards.
+
+Usage: python tools/reshard.py --shards 4 [--db data/master.db] [--from-shards 0] [--batch 10000] [--prune]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_PATH)
+
+from src.database import UserManager, shard_index, shard_fpaths  # noqa: E402
+
+# Columns copied as they are, message_id is reassigned since it is only unique within one source file
+USER_COLUMNS = (
+    "user_id",
+    "username",
+    "first_name",
+    "last_name",
+    "access_level",
+    "remaining_free_queries",
+    "total_queries",
+    "registered_at",
+    "last_active_at",
+)
+MESSAGE_COLUMNS = (
+    "user_id",
+    "provider",
+    "model_id",
+    "input_tokens",
+    "output_tokens",
+    "query_cost",
+    "search_used",
+    "created_at",
+)
+
+
+def remove_db(fpath: str) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(fpath + suffix):
+            os.remove(fpath + suffix)
+
+
+def count_rows(fpaths: list[str], table: str) -> int:
+    total = 0
+    for fpath in fpaths:
+        conn = sqlite3.connect(fpath)
+        try:
+            total += conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        finally:
+            conn.close()
+    return total
+
+
+def copy_table(sources: list[str], targets: list[sqlite3.Connection], table: str, columns: tuple, batch: int) -> int:
+    """Stream the table from every source into the target picked by user_id (the first column), batch by batch"""
+    select_sql = f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid"
+    insert_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    copied = 0
+    for fpath in sources:
+        source = sqlite3.connect(fpath)
+        try:
+            cursor = source.execute(select_sql)
+            while rows := cursor.fetchmany(batch):
+                routed: list[list[tuple]] = [[] for _ in targets]
+                for row in rows:
+                    routed[shard_index(row[0], len(targets))].append(row)
+
+                for target, target_rows in zip(targets, routed):
+                    target.executemany(insert_sql, target_rows)
+                    target.commit()
+
+                copied += len(rows)
+                print(f"\r{table} {copied}", end="", flush=True)
+        finally:
+            source.close()
+
+    print()
+    return copied
+
+
+def copy_cache_stats(sources: list[str], target: sqlite3.Connection) -> None:
+    """Provider cache counters aren't per user, their sum over the shards is what gets reported"""
+    for fpath in sources:
+        source = sqlite3.connect(fpath)
+        try:
+            rows = source.execute(
+                "SELECT provider, input_tokens, cached_tokens, cache_write_tokens FROM provider_cache_stats"
+            ).fetchall()
+        finally:
+            source.close()
+
+        target.executemany(
+            "INSERT INTO provider_cache_stats (provider, input_tokens, cached_tokens, cache_write_tokens) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT (provider) DO UPDATE SET "
+            "input_tokens = input_tokens + excluded.input_tokens, "
+            "cached_tokens = cached_tokens + excluded.cached_tokens, "
+            "cache_write_tokens = cache_write_tokens + excluded.cache_write_tokens",
+            rows,
+        )
+    target.commit()
+
+
+def prune_source(db_path: str) -> None:
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("DELETE FROM messages")
+        conn.execute("DELETE FROM users")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def reshard(args: argparse.Namespace) -> None:
+    if args.shards < 1:
+        raise SystemExit("--shards must be at least 1")
+
+    sources = shard_fpaths(args.db, args.from_shards) or [args.db]
+    for fpath in sources:
+        if not os.path.exists(fpath):
+            raise SystemExit(f"{fpath} does not exist")
+
+    final_paths = shard_fpaths(args.db, args.shards)
+    new_paths = [fpath + ".new" for fpath in final_paths]
+
+    started = time.perf_counter()
+    with open(os.path.join(args.query_path, "init_db.sql"), "r") as file:
+        schema = file.read()
+
+    # Files from before the latest schema changes get the missing tables, as on bot startup
+    for fpath in sources:
+        conn = sqlite3.connect(fpath)
+        try:
+            conn.executescript(schema)
+        finally:
+            conn.close()
+
+    targets = []
+    for fpath in new_paths:
+        remove_db(fpath)
+        conn = sqlite3.connect(fpath)
+        conn.executescript(schema)
+        # Bulk load only, nothing is lost if the copy is interrupted since the sources are untouched
+        conn.execute("PRAGMA synchronous = OFF")
+        targets.append(conn)
+
+    try:
+        users = copy_table(sources, targets, "users", USER_COLUMNS, args.batch)
+        messages = copy_table(sources, targets, "messages", MESSAGE_COLUMNS, args.batch)
+        copy_cache_stats(sources, targets[0])
+    finally:
+        for conn in targets:
+            conn.close()
+
+    expected = (count_rows(sources, "users"), count_rows(sources, "messages"))
+    if (users, messages) != expected or (count_rows(new_paths, "users"), count_rows(new_paths, "messages")) != expected:
+        for fpath in new_paths:
+            remove_db(fpath)
+        raise SystemExit(f"Row counts don't match the sources {expected}, nothing was replaced")
+
+    # Sources are only dropped once every new shard is complete
+    for fpath in sources:
+        if fpath != args.db:
+            remove_db(fpath)
+    for new_path, final_path in zip(new_paths, final_paths):
+        remove_db(final_path)
+        os.replace(new_path, final_path)
+
+    if args.prune and args.from_shards == 0:
+        prune_source(args.db)
+
+    # Same maintenance the bot runs: provider_stats rollup, planner statistics, WAL folded back in
+    user_mgr = UserManager(args.db, args.query_path, shards=args.shards)
+    user_mgr.refresh_rollups()
+    user_mgr.optimize_db()
+    user_mgr.checkpoint_wal()
+
+    for fpath in final_paths:
+        conn = sqlite3.connect(fpath)
+        try:
+            shard_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        finally:
+            conn.close()
+        print(f"{fpath}: {shard_users} users, {os.path.getsize(fpath) / (1024 * 1024):.1f} MB")
+
+    print(
+        f"Moved {users} users and {messages} messages from {len(sources)} into {args.shards} shards "
+        f"in {time.perf_counter() - started:.1f}s, set DB_SHARDS = {args.shards}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(BASE_PATH, "data", "master.db"), help="main database file")
+    parser.add_argument("--shards", type=int, required=True, help="number of shard files to write")
+    parser.add_argument("--from-shards", type=int, default=0, help="current DB_SHARDS, 0 reads --db itself")
+    parser.add_argument("--batch", type=int, default=10_000, help="rows read per batch")
+    parser.add_argument("--prune", action="store_true", help="delete users / messages from --db once copied")
+    parser.add_argument("--query-path", default=os.path.join(BASE_PATH, "query"))
+    reshard(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()